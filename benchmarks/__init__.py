@@ -0,0 +1,7 @@
+"""Standalone benchmarks for git-cola's data structures
+
+Run them from the top of the source tree, e.g.
+
+    python -m benchmarks.dag_memory --count 100000
+
+"""
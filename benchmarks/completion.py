@@ -0,0 +1,94 @@
+"""Compare path completion queries on a large tree
+
+    python -m benchmarks.completion --count 500000
+
+The path completers used to rebuild the parent directories of every
+tracked file, lowercase each candidate and substring-scan the list on
+every keystroke.  CompletionIndex is built once and each keystroke is
+answered from the index, refining the previous keystroke's matches.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import random
+import time
+
+from cola import utils
+from cola.models import completionindex
+
+
+def paths(count, seed, dir_count=None):
+    """Generate a tree of `count` files spread over shared directories"""
+    rng = random.Random(seed)
+    words = ['src', 'lib', 'test', 'docs', 'widgets', 'models', 'core',
+             'util', 'net', 'io', 'ui', 'data', 'build', 'tools', 'api',
+             'drivers', 'include', 'arch', 'fs', 'kernel', 'mm', 'sound']
+    exts = ['.py', '.c', '.h', '.txt', '.js', '.rst']
+    dirs = ['']
+    for idx in range(dir_count or max(1, count // 20)):
+        parent = rng.choice(dirs)
+        if parent.count('/') >= 5:
+            parent = ''
+        name = '%s%d' % (rng.choice(words), rng.randint(0, 99))
+        dirs.append(parent and parent + '/' + name or name)
+    result = []
+    for idx in range(count):
+        name = '%s_%s%d%s' % (rng.choice(words), rng.choice(words), idx,
+                              rng.choice(exts))
+        parent = rng.choice(dirs)
+        result.append(parent and parent + '/' + name or name)
+    return result
+
+
+def filter_path_matches(match_text, file_list):
+    """The original per-keystroke path filter"""
+    files = set(file_list)
+    files_and_dirs = utils.add_parents(files)
+    text = match_text.lower()
+    matches = [r for r in files_and_dirs if text in r.lower()]
+    matches.sort(key=lambda x: x.replace('.', '').lower())
+    return matches
+
+
+def typing(word):
+    return [word[:i] for i in range(1, len(word) + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=500000,
+                        help='number of tracked files')
+    parser.add_argument('--old', action='store_true',
+                        help='also time the original filter (slow)')
+    args = parser.parse_args()
+
+    files = paths(args.count, 42)
+    queries = (typing('drivers3/core_') + typing('net_io4999') +
+               typing('mdlcore') + typing('zzz'))
+
+    if args.old:
+        start = time.time()
+        for query in queries[:3]:
+            filter_path_matches(query, files)
+        elapsed = (time.time() - start) / 3
+        print('original filter:  %9.3f ms/keystroke' % (elapsed * 1000))
+
+    start = time.time()
+    index = completionindex.CompletionIndex(files, parents=True)
+    print('index build:      %9.3f s for %d entries' %
+          (time.time() - start, len(index)))
+
+    worst = 0.0
+    start = time.time()
+    for query in queries:
+        begin = time.time()
+        index.search(query)
+        worst = max(worst, time.time() - begin)
+    elapsed = (time.time() - start) / len(queries)
+    print('index search:     %9.3f ms/keystroke, %9.3f ms worst' %
+          (elapsed * 1000, worst * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compare the DAG layout engines over synthetic histories
+
+    python -m benchmarks.dag_layout --count 20000
+
+Each engine lays out the history in batches, like ReaderThread feeds
+GraphView, for several merge densities.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import time
+
+from cola.models import daglayout
+from cola.models import dagstore
+
+from benchmarks import synthetic
+
+
+def load(records):
+    store = dagstore.CommitStore()
+    ids = [store.add_record(record) for record in records]
+    return [store.commit(i) for i in ids]
+
+
+def run(name, commits, batch_size):
+    layout = daglayout.new_layout(name, 18, 24)
+    start = time.time()
+    for idx in range(0, len(commits), batch_size):
+        layout.append(commits[idx:idx+batch_size])
+    elapsed = time.time() - start
+    width = int(layout.x_max // 18) + 1
+    return elapsed, width
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=20000,
+                        help='number of synthetic commits')
+    parser.add_argument('--batch-size', type=int, default=512,
+                        help='commits per appended batch')
+    parser.add_argument('--merge-rates', default='0.0,0.02,0.1,0.3',
+                        help='comma-separated merge probabilities')
+    parser.add_argument('--fork-depth', type=int, default=5000,
+                        help='fork new branches from this far back')
+    args = parser.parse_args()
+
+    names = sorted(daglayout.LAYOUTS)
+    print('%d commits, batches of %d' % (args.count, args.batch_size))
+    header = '%-8s' % 'merges'
+    for name in names:
+        header += ' %12s %7s' % (name, 'width')
+    print(header)
+
+    for rate in [float(r) for r in args.merge_rates.split(',')]:
+        records = synthetic.history(args.count, merge_rate=rate,
+                                    branch_rate=max(0.01, rate),
+                                    fork_depth=args.fork_depth)
+        commits = load(records)
+        line = '%-8.2f' % rate
+        for name in names:
+            elapsed, width = run(name, commits, args.batch_size)
+            line += ' %11.3fs %7d' % (elapsed, width)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
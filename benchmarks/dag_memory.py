@@ -0,0 +1,79 @@
+"""Compare the memory used by dag.CommitFactory and dagstore.CommitStore
+
+    python -m benchmarks.dag_memory --count 100000
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from cola.models import dag
+from cola.models import dagstore
+
+from benchmarks import synthetic
+
+
+def load_objects(entries):
+    dag.CommitFactory.reset()
+    commits = [dag.CommitFactory.new(log_entry=entry) for entry in entries]
+    return commits
+
+
+def load_store(entries):
+    store = dagstore.CommitStore()
+    for entry in entries:
+        store.add_log_entry(entry)
+    return store
+
+
+def walk_objects(commits):
+    for commit in commits:
+        commit.is_fork()
+        commit.parents and commit.parents[0].generation
+
+
+def walk_store(store):
+    for idx in range(len(store)):
+        commit = store.commit(idx)
+        commit.is_fork()
+        parents = commit.parents
+        parents and parents[0].generation
+
+
+def measure(name, load, walk, entries):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    result = load(entries)
+    elapsed = time.time() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.time()
+    walk(result)
+    walked = time.time() - start
+    print('%-14s %10.1f MiB %10.1f MiB %8.2fs %8.2fs' % (
+          name, size / 1048576.0, peak / 1048576.0, elapsed, walked))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of synthetic commits')
+    args = parser.parse_args()
+
+    entries = synthetic.log_entries(synthetic.history(args.count))
+    print('%d commits' % args.count)
+    print('%-14s %14s %14s %9s %9s' % ('', 'retained', 'peak',
+                                       'load', 'walk'))
+    commits = measure('Commit', load_objects, walk_objects, entries)
+    del commits
+    dag.CommitFactory.reset()
+    measure('CommitStore', load_store, walk_store, entries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Measure diff syntax highlighting throughput in lines/sec
+
+    python -m benchmarks.diff_highlight --count 100000
+
+Compares the original rule list, which tries every regex on every line,
+with diffsyntax.DiffClassifier.  Only the classification is timed;
+Qt's setFormat() calls are not.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import re
+import time
+
+from cola import diffsyntax
+
+from benchmarks import synthetic
+
+
+def TERMINAL(pattern):
+    return '__TERMINAL__:%s' % pattern
+
+
+class RuleHighlighter(object):
+    """The original GenericSyntaxHighligher/DiffSyntaxHighlighter rules"""
+
+    def __init__(self, whitespace=True):
+        self._rules = []
+        rules = [
+            TERMINAL(r'^--- '), 'header',
+            TERMINAL(r'^\+\+\+ '), 'header',
+            TERMINAL(r'^@@ '), 'header_bold',
+            TERMINAL(r'^([ ]+.*)(\|[ ]+\d+[ ]+[+-]+)$'),
+                ('header_bold', 'header'),
+            TERMINAL(r'^diff --git a/.*b/.*'), 'header',
+            TERMINAL(r'^index \S+\.\.\S+'), 'header',
+            TERMINAL(r'^new file mode'), 'header',
+            TERMINAL(r'^deleted file mode'), 'header',
+            TERMINAL(r'^\+'), 'add',
+            TERMINAL(r'^-'), 'remove',
+            r'(.+\|.+?)(\d+)(.+?)([\+]*?)([-]*?)$',
+                (None, 'header', None, 'header', 'header'),
+            (r'(\s+\d+ files changed[^\d]*)'
+             r'(:?\d+ insertions[^\d]*)'
+             r'(:?\d+ deletions.*)$'), ('header', 'header', 'header'),
+        ]
+        if whitespace:
+            rules.extend([r'(..*?)(\s+)$', (None, 'bad_whitespace')])
+        for idx in range(0, len(rules), 2):
+            rule = rules[idx]
+            terminal = rule.startswith(TERMINAL(''))
+            if terminal:
+                rule = rule[len(TERMINAL('')):]
+            self._rules.append((re.compile(rule), rules[idx+1], terminal))
+
+    def spans(self, line):
+        matched = []
+        for regex, fmts, terminal in self._rules:
+            match = regex.match(line)
+            if not match:
+                continue
+            matched.append((match, fmts))
+            if terminal:
+                break
+        spans = []
+        for match, fmts in matched:
+            start = match.start()
+            groups = match.groups()
+            if not groups:
+                spans.append((0, len(line), fmts))
+                continue
+            for grpidx, group in enumerate(groups):
+                if not group:
+                    continue
+                if fmts[grpidx]:
+                    spans.append((start, len(group), fmts[grpidx]))
+                start += len(group)
+        return tuple(spans)
+
+
+def run(highlighter, lines):
+    spans = highlighter.spans
+    start = time.time()
+    for line in lines:
+        spans(line)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of synthetic diff lines')
+    parser.add_argument('--file', default=None,
+                        help='benchmark the lines of a diff file instead')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            lines = f.read().splitlines()
+    else:
+        lines = synthetic.diff_lines(args.count)
+
+    rules = RuleHighlighter()
+    classifier = diffsyntax.DiffClassifier()
+    mismatches = sum([1 for line in lines
+                      if rules.spans(line) != classifier.spans(line)])
+
+    count = len(lines)
+    print('%d lines, %d mismatches' % (count, mismatches))
+    for name, elapsed in (('rules', run(rules, lines)),
+                          ('single-pass', run(classifier, lines))):
+        print('%-12s %12.0f lines/sec' % (name, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
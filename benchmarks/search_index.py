@@ -0,0 +1,77 @@
+"""Time commit searches against the persistent search index
+
+    python -m benchmarks.search_index --count 200000
+
+The Search dialog used to run "git log --all" for every query.  This
+builds a CommitIndex over synthetic commits and times the typical
+queries, serialization and loading.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import random
+import time
+
+from cola.models import searchindex
+
+
+def commits(count, seed):
+    """Generate commit tuples with realistic vocabularies"""
+    rng = random.Random(seed)
+    words = ['fix', 'add', 'remove', 'update', 'refactor', 'parser', 'widget',
+             'model', 'diff', 'grep', 'search', 'index', 'tests', 'docs',
+             'cache', 'startup', 'regression', 'typo', 'merge', 'branch']
+    people = ['Dev%d <dev%d@example.com>' % (i, i) for i in range(300)]
+    dirs = ['d%d/s%d' % (i, j) for i in range(40) for j in range(25)]
+    date = 1000000000
+    for idx in range(count):
+        date += rng.randint(1, 3600)
+        message = '%s %s %s #%d\n\n%s\n' % (
+                rng.choice(words), rng.choice(words), rng.choice(words), idx,
+                ' '.join([rng.choice(words) for i in range(12)]))
+        paths = ['%s/f%d.py' % (rng.choice(dirs), rng.randint(0, 50))
+                 for i in range(rng.randint(1, 4))]
+        author = rng.choice(people)
+        yield ('%040x' % idx, author, date, author, date, message, paths)
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    print('%-32s %9.2f ms' % (label, (time.time() - start) * 1000))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=200000,
+                        help='number of commits')
+    args = parser.parse_args()
+
+    def build():
+        index = searchindex.CommitIndex()
+        for commit in commits(args.count, 42):
+            index.add(*commit)
+        return index
+
+    index = timed('build', build)
+    data = timed('pack', index.pack)
+    index = timed('unpack (%d MB)' % (len(data) >> 20),
+                  searchindex.CommitIndex.unpack, data)
+    timed('first query (ranks dates)', index.search, message='regression')
+    for label, kwargs in [
+            ('message word', {'message': 'regression'}),
+            ('rare message word', {'message': '#12345'}),
+            ('message regex', {'message': '^fix.*typo$'}),
+            ('author', {'author': 'Dev7 '}),
+            ('path', {'paths': ['d3/s4']}),
+            ('date range', {'after': 1100000000, 'before': 1200000000}),
+            ('combined', {'message': 'cache', 'author': 'Dev1',
+                          'paths': ['d1'], 'after': 1050000000})]:
+        kwargs['max_count'] = 500
+        timed(label, index.search, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
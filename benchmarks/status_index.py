@@ -0,0 +1,89 @@
+"""Compare status lookups for the worktree browser
+
+    python -m benchmarks.status_index --count 100000
+
+The browser used to rebuild utils.add_parents() over all five status
+lists for every entry it rendered.  StatusIndex is built once per
+status update and answers each lookup with a dict access.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import argparse
+import random
+import time
+
+from cola import utils
+from cola.models import statusindex
+
+
+class Model(object):
+    """Stands in for MainModel's status lists"""
+
+    def __init__(self, count, depth, seed):
+        rng = random.Random(seed)
+        self.status_version = 1
+        lists = dict([(name, []) for name, flag in statusindex.FLAGS])
+        names = sorted(lists)
+        for idx in range(count):
+            parts = ['d%d' % rng.randint(0, 20) for i in range(depth)]
+            path = '/'.join(parts + ['f%d' % idx])
+            lists[rng.choice(names)].append(path)
+        for name, paths in lists.items():
+            setattr(self, name, sorted(paths))
+
+    def paths(self):
+        paths = []
+        for name, flag in statusindex.FLAGS:
+            paths.extend(getattr(self, name))
+        return utils.add_parents(paths)
+
+
+def per_item(model, paths):
+    """The original GitRepoInfoTask.status() lookups"""
+    for path in paths:
+        unmerged = utils.add_parents(model.unmerged)
+        modified = utils.add_parents(model.modified)
+        staged = utils.add_parents(model.staged)
+        untracked = utils.add_parents(model.untracked)
+        upstream_changed = utils.add_parents(model.upstream_changed)
+        (path in unmerged, path in modified, path in staged,
+         path in untracked, path in upstream_changed)
+
+
+def indexed(model, paths):
+    cache = statusindex.StatusIndexCache()
+    for path in paths:
+        cache.get(model).flags(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of paths with a status')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='directory depth of each path')
+    parser.add_argument('--lookups', type=int, default=20,
+                        help='per-item lookups to time for the old code')
+    args = parser.parse_args()
+
+    model = Model(args.count, args.depth, 42)
+    paths = sorted(model.paths())
+    print('%d status paths, %d paths with parents' % (args.count, len(paths)))
+
+    sample = paths[:args.lookups]
+    start = time.time()
+    per_item(model, sample)
+    elapsed = (time.time() - start) / len(sample)
+    print('per-item rebuild: %9.3f ms/lookup, %9.1f s for all paths' %
+          (elapsed * 1000, elapsed * len(paths)))
+
+    start = time.time()
+    indexed(model, paths)
+    elapsed = time.time() - start
+    print('status index:     %9.6f ms/lookup, %9.3f s for all paths '
+          '(including one build)' % (elapsed * 1000 / len(paths), elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Synthetic commit histories for benchmarks"""
+from __future__ import division, absolute_import, unicode_literals
+
+import hashlib
+import random
+
+from cola import core
+from cola.models.dag import logsep
+
+
+def sha1(value):
+    return hashlib.sha1(core.encode('%d' % value)).hexdigest()
+
+
+def history(count, branch_rate=0.05, merge_rate=0.04, max_branches=16,
+            fork_depth=0, seed=1):
+    """Generate (sha1, parents, author, authdate, email, summary) records
+
+    Records are returned oldest-first in topological order, the same
+    order used by "git log --topo-order --reverse".  New branches fork
+    from a branch head, or from any of the last `fork_depth` commits
+    to simulate long-lived branches.
+
+    """
+    rng = random.Random(seed)
+    authors = ['Author %d' % i for i in range(max(1, count // 500))]
+    heads = []
+    records = []
+    for idx in range(count):
+        commit = sha1(idx)
+        roll = rng.random()
+        if not heads:
+            parents = ()
+            heads.append(commit)
+        elif roll < merge_rate and len(heads) > 1:
+            other = heads.pop(rng.randrange(1, len(heads)))
+            parents = (heads[0], other)
+            heads[0] = commit
+        elif roll < merge_rate + branch_rate and len(heads) < max_branches:
+            if fork_depth:
+                base = records[rng.randrange(max(0, idx - fork_depth), idx)]
+                parents = (base[0],)
+            else:
+                parents = (rng.choice(heads),)
+            heads.append(commit)
+        else:
+            lane = rng.randrange(len(heads))
+            parents = (heads[lane],)
+            heads[lane] = commit
+        author = rng.choice(authors)
+        email = author.lower().replace(' ', '.') + '@example.com'
+        authdate = 'Mon Jan 1 00:00:%02d 2001 +0000' % (idx % 60)
+        summary = 'commit %d: %s' % (idx, 'x' * rng.randrange(10, 60))
+        records.append((commit, parents, author, authdate, email, summary))
+    return records
+
+
+def log_entries(records, tags_every=500):
+    """Format records as dag.logfmt "git log" output lines"""
+    entries = []
+    for idx, record in enumerate(records):
+        commit, parents, author, authdate, email, summary = record
+        tags = ''
+        if tags_every and idx % tags_every == 0:
+            tags = ' (tag: v%d)' % idx
+        entries.append(logsep.join([commit, ' '.join(parents), tags,
+                                    author, authdate, email, summary]))
+    return entries
+
+
+def diff_lines(count, seed=1):
+    """Generate the lines of a multi-file diff with a diffstat"""
+    rng = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'self', 'return', '(x)',
+             'if', 'for', 'in', '=', '+=', 'None', '# comment']
+    lines = [' src/file%d.py | %d %s' % (i, i * 3, '+' * (i % 9) + '-' * 3)
+             for i in range(20)]
+    lines.append(' 20 files changed, 300 insertions(+), 60 deletions(-)')
+    nfile = 0
+    while len(lines) < count:
+        name = 'src/file%d.py' % nfile
+        nfile += 1
+        lines.extend(['diff --git a/%s b/%s' % (name, name),
+                      'index 0123456..789abcd 100644',
+                      '--- a/%s' % name,
+                      '+++ b/%s' % name])
+        for hunk in range(rng.randint(1, 8)):
+            lines.append('@@ -%d,20 +%d,21 @@ def function%d(self):' %
+                         (hunk * 40, hunk * 40, hunk))
+            for idx in range(rng.randint(5, 60)):
+                text = ' '.join(rng.choice(words)
+                                for i in range(rng.randint(1, 10)))
+                if rng.random() < 0.03:
+                    text += '  '
+                lines.append(rng.choice(' +- ') + '    ' + text)
+    return lines[:count]
@@ -186,12 +186,15 @@ class ColaApplication(object):
         if hasattr(self._app, 'view'):
             self._app.view = view
 
-    def _update_files(self):
+    def _update_files(self, paths):
         # Respond to inotify updates
-        cmds.do(cmds.Refresh)
+        if inotify.requires_full_refresh(paths):
+            cmds.do(cmds.Refresh)
+        else:
+            cmds.do(cmds.RefreshChanges, **inotify.classify_paths(paths))
 
-    def _update_files_notifier(self):
-        self.notifier.emit(SIGNAL('update_files'))
+    def _update_files_notifier(self, paths):
+        self.notifier.emit(SIGNAL('update_files'), paths)
 
 
 @memoize
@@ -13,6 +13,7 @@ except ImportError:
 
 from cola import compat
 from cola import core
+from cola import diffstream
 from cola import gitcfg
 from cola import gitcmds
 from cola import inotify
@@ -212,7 +213,8 @@ class ApplyDiffSelection(Command):
         self.apply_to_worktree = apply_to_worktree
 
     def do(self):
-        parser = DiffParser(self.model.filename, self.model.diff_text)
+        parser = DiffParser(self.model.filename, self.model.diff_text,
+                            index=self.model.diff_index())
         if self.has_selection:
             patch = parser.generate_patch(self.first_line_idx,
                                           self.last_line_idx,
@@ -670,10 +672,26 @@ class Diff(Command):
             opts['ref'] = self.model.head
         self.new_filename = filename
         self.new_mode = self.model.mode_worktree
-        self.new_diff_text = gitcmds.diff_helper(filename=filename,
-                                                 cached=cached,
-                                                 deleted=deleted,
-                                                 **opts)
+        self.stream = None
+        if diffstream.is_large(filename, prefs.diff_stream_threshold(),
+                               ref=opts.get('ref')):
+            # Huge diffs are read from a pipe by the diff viewer
+            self.new_diff_text = ''
+            self.stream = gitcmds.diff_helper_command(filename=filename,
+                                                      cached=cached,
+                                                      **opts)
+            self.deleted = deleted
+        else:
+            self.new_diff_text = gitcmds.diff_helper(filename=filename,
+                                                     cached=cached,
+                                                     deleted=deleted,
+                                                     **opts)
+
+    def do(self):
+        Command.do(self)
+        if self.stream is not None:
+            command, encoding = self.stream
+            self.model.stream_diff(command, encoding, self.deleted)
 
 
 class Diffstat(Command):
@@ -1152,6 +1170,28 @@ class Refresh(Command):
         self.model.update_status(update_index=True)
 
 
+class RefreshPaths(Command):
+    """Rescan a set of changed paths"""
+
+    def __init__(self, paths):
+        Command.__init__(self)
+        self.paths = paths
+
+    def do(self):
+        self.model.update_paths_status(self.paths)
+
+
+class RefreshChanges(Command):
+    """Update only the parts of the model affected by a set of changes"""
+
+    def __init__(self, **changes):
+        Command.__init__(self)
+        self.changes = changes
+
+    def do(self):
+        self.model.update_changes(**self.changes)
+
+
 class RevertEditsCommand(ConfirmAction):
 
     def __init__(self):
@@ -0,0 +1,151 @@
+"""A bounded LRU cache for diff output
+
+Selecting a file runs "git diff" and post-processes its output.  When
+the user flips between files the same diffs are computed again and
+again, so gitcmds caches the results here.
+
+Diffs between commits are immutable and are keyed by their sha1s.
+Diffs against the index or worktree are keyed by the stat() state of
+the index, HEAD and the files involved so that any change to them is
+a cache miss.  Entries are evicted least-recently-used first once the
+cached text exceeds a size limit.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import collections
+import re
+import threading
+
+from cola import core
+from cola.decorators import memoize
+
+# Limit the cache to ~16M characters of diff text
+MAX_SIZE = 16 * 1024 * 1024
+
+_SHA1_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+@memoize
+def current():
+    """Return the DiffCache singleton"""
+    return DiffCache()
+
+
+def is_sha1(value):
+    """Return True when value is a full, and thus immutable, sha1"""
+    return bool(value) and _SHA1_RE.match(value) is not None
+
+
+def sizeof(value):
+    """Return the size of a cached diff result"""
+    if isinstance(value, tuple):
+        return sum([len(v) for v in value])
+    return len(value)
+
+
+def _stat_key(path):
+    try:
+        st = core.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_ctime, st.st_size, st.st_ino)
+
+
+def worktree_key(git, filenames):
+    """Return a key describing the index, HEAD and worktree files
+
+    Any write to the index, HEAD, the current branch or the given files
+    changes the key.
+
+    """
+    git_path = git.git_path
+    head = git_path('HEAD')
+    try:
+        data = core.read(head).strip()
+    except (IOError, OSError):
+        data = ''
+    paths = [git_path('index'), head, git_path('packed-refs')]
+    if data.startswith('ref: '):
+        paths.append(git_path(data[5:]))
+    key = [git.worktree(), data]
+    key.extend([_stat_key(path) for path in paths])
+    key.extend([(filename, _stat_key(filename)) for filename in filenames])
+    return tuple(key)
+
+
+class DiffCache(object):
+    """An LRU cache of diff results bounded by the size of their text"""
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, size, stamp)
+        self._entries = {}
+        # (stamp, key) in least-recently-used order.  Entries whose stamp
+        # is no longer current are skipped.
+        self._lru = collections.deque()
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        with self._lock:
+            try:
+                value, size, stamp = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._store(key, value, size)
+            self.hits += 1
+            return value
+
+    def _store(self, key, value, size):
+        self._clock += 1
+        self._entries[key] = (value, size, self._clock)
+        self._lru.append((self._clock, key))
+        if len(self._lru) > 2 * len(self._entries) + 64:
+            # Drop the stale entries left behind by get()
+            self._lru = collections.deque(sorted(
+                [(entry[2], k) for k, entry in self._entries.items()],
+                key=lambda item: item[0]))
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entries"""
+        size = sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._store(key, value, size)
+            self.size += size
+            while self.size > self.max_size:
+                stamp, evicted = self._lru.popleft()
+                entry = self._entries.get(evicted)
+                if entry is None or entry[2] != stamp:
+                    continue
+                del self._entries[evicted]
+                self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._lru.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dict with the cache's hit/miss counters and size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self.size,
+            }
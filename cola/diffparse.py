@@ -1,5 +1,6 @@
 from __future__ import division, absolute_import, unicode_literals
 
+import bisect
 import re
 
 from collections import defaultdict
@@ -48,30 +49,63 @@ def _format_hunk_header(old_start, old_count,
 
 
 def _parse_diff(diff_text):
-    hunks = []
-    for line_idx, line in enumerate(diff_text.split('\n')):
-        match = _HUNK_HEADER_RE.match(line)
-        if match:
-            old_start, old_count = _parse_range_str(match.group(1))
-            new_start, new_count = _parse_range_str(match.group(2))
-            heading = match.group(3)
-            hunks.append(_DiffHunk(old_start, old_count,
-                                   new_start, new_count,
-                                   heading, line_idx, lines=[line]))
-        elif not hunks:
-            # first line of the diff is not a header line
-            errmsg = 'Malformed diff?: %s' % diff_text
-            raise AssertionError(errmsg)
-        elif line:
-            hunks[-1].lines.append(line)
-    return hunks
+    return DiffIndex(diff_text).hunks
+
+
+class DiffIndex(object):
+    """An index of a diff's lines and hunks, computed once per diff
+
+    `hunk_starts` holds the line index of each hunk header so that the
+    hunk containing a line can be found by bisection.
+
+    """
+
+    def __init__(self, diff_text):
+        self.text = diff_text
+        self.lines = lines = diff_text.split('\n')
+        self.hunks = hunks = []
+        self.hunk_starts = hunk_starts = []
+
+        for line_idx, line in enumerate(lines):
+            if line[:1] == '@':
+                match = _HUNK_HEADER_RE.match(line)
+            else:
+                match = None
+            if match:
+                old_start, old_count = _parse_range_str(match.group(1))
+                new_start, new_count = _parse_range_str(match.group(2))
+                heading = match.group(3)
+                hunks.append(_DiffHunk(old_start, old_count,
+                                       new_start, new_count,
+                                       heading, line_idx, lines=[line]))
+                hunk_starts.append(line_idx)
+            elif not hunks:
+                # first line of the diff is not a header line
+                errmsg = 'Malformed diff?: %s' % diff_text
+                raise AssertionError(errmsg)
+            elif line:
+                hunks[-1].lines.append(line)
+
+    def hunk_index(self, line_idx):
+        """Return the index of the hunk containing a line, or -1"""
+        return bisect.bisect_right(self.hunk_starts, line_idx) - 1
+
+    def hunk_at(self, line_idx):
+        """Return the hunk containing a line, or None"""
+        idx = self.hunk_index(line_idx)
+        if idx < 0:
+            return None
+        return self.hunks[idx]
 
 
 class DiffParser(object):
 
-    def __init__(self, filename, diff_text):
+    def __init__(self, filename, diff_text, index=None):
         self.filename = filename
-        self.hunks = _parse_diff(diff_text)
+        if index is None:
+            index = DiffIndex(diff_text)
+        self.index = index
+        self.hunks = index.hunks
 
     def generate_patch(self, first_line_idx, last_line_idx,
                        reverse=False):
@@ -86,9 +120,10 @@ class DiffParser(object):
 
         start_offset = 0
 
-        for hunk in self.hunks:
-            # skip hunks until we get to the one that contains the first
-            # selected line
+        # Skip to the hunk that contains the first selected line
+        first_hunk = max(0, self.index.hunk_index(first_line_idx))
+
+        for hunk in self.hunks[first_hunk:]:
             if hunk.last_line_idx < first_line_idx:
                 continue
             # once we have processed the hunk that contains the last selected
@@ -165,8 +200,10 @@ class DiffParser(object):
         specified line."""
         if not self.hunks:
             return None
-        for hunk in self.hunks:
-            if line_idx <= hunk.last_line_idx:
-                break
+        idx = max(0, self.index.hunk_index(line_idx))
+        if line_idx > self.hunks[idx].last_line_idx:
+            # Lines after a hunk belong to the next hunk, if any
+            idx = min(idx + 1, len(self.hunks) - 1)
+        hunk = self.hunks[idx]
         return self.generate_patch(hunk.first_line_idx, hunk.last_line_idx,
                                    reverse=reverse)
@@ -0,0 +1,147 @@
+"""Incremental parsing of "git diff" output for the diff viewer
+
+Huge diffs are read from a pipe and appended to the diff viewer in
+batches instead of being loaded all at once.  DiffStream turns decoded
+chunks of "git diff" output into complete lines, records the position
+of every hunk as it is seen so that a hunk index can be shown before
+the text has been displayed, and drops the rest of a file's diff once
+it exceeds a size limit.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import codecs
+
+from cola import core
+from cola.git import git
+from cola.i18n import N_
+
+
+def is_large(filename, threshold, ref=None, git=git):
+    """Return True when a file's diff is large enough to be streamed
+
+    Worktree diffs check the size of the worktree file.  Staged diffs,
+    which compare the index against `ref`, check the sizes of the
+    index and `ref` blobs instead.
+
+    """
+    if not filename or threshold <= 0:
+        return False
+    if ref is not None:
+        reader = git.object_reader()
+        for objname in (':' + filename, '%s:%s' % (ref, filename)):
+            try:
+                info = reader.info(objname)
+            except (IOError, OSError, ValueError):
+                continue
+            if info is not None and info[2] > threshold:
+                return True
+        return False
+    try:
+        return core.stat(filename).st_size > threshold
+    except OSError:
+        return False
+
+
+def incremental_decoder(encoding):
+    """Return an incremental decoder, falling back to utf-8
+
+    The encoding comes from the "encoding" gitattribute, which may name
+    a codec that Python does not know.
+
+    """
+    try:
+        factory = codecs.getincrementaldecoder(encoding or 'utf-8')
+    except LookupError:
+        factory = codecs.getincrementaldecoder('utf-8')
+    return factory(errors='replace')
+
+
+def format_size(size):
+    """Return a human-readable size"""
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%d %s' % (size, unit)
+        size //= 1024
+    return '%d GiB' % size
+
+
+class DiffStream(object):
+    """Splits streamed diff output into lines and indexes its hunks
+
+    :param max_file_size: stop showing a file's diff after this many
+        characters; 0 disables truncation
+    :param suppress_header: drop the lines before the first hunk, like
+        gitcmds.extract_diff_header()
+    :param deleted: keep "deleted file mode" header lines
+
+    """
+
+    def __init__(self, max_file_size=0, suppress_header=True, deleted=False,
+                 encoding=None):
+        self.max_file_size = max_file_size
+        self.suppress_header = suppress_header
+        self.deleted = deleted
+        self.hunks = []         # (line number, hunk header)
+        self.truncated = []     # (filename, characters not shown)
+        self.line_count = 0
+        self._decoder = incremental_decoder(encoding)
+        self._remainder = ''
+        self._started = not suppress_header
+        self._filename = None
+        self._file_size = 0
+        self._skipped = 0
+
+    def feed(self, data):
+        """Add a chunk of raw output and return the new complete lines"""
+        text = self._remainder + self._decoder.decode(data)
+        lines = text.split('\n')
+        self._remainder = lines.pop()
+        return self._process(lines)
+
+    def finish(self):
+        """Return the lines that remain once the output has ended"""
+        text = self._remainder + self._decoder.decode(b'', final=True)
+        self._remainder = ''
+        lines = []
+        if text:
+            lines = self._process([text])
+        self._end_file()
+        return lines
+
+    def _process(self, lines):
+        result = []
+        append = result.append
+        max_file_size = self.max_file_size
+        for line in lines:
+            if line.startswith('diff --git '):
+                self._end_file()
+                self._filename = line.rsplit(' b/', 1)[-1]
+            if not self._started:
+                if line.startswith('@@') and '@@' in line[2:]:
+                    self._started = True
+                elif not (self.deleted and 'deleted file mode ' in line):
+                    continue
+
+            if self._skipped:
+                self._skipped += len(line) + 1
+                continue
+            size = len(line) + 1
+            if max_file_size and self._file_size + size > max_file_size:
+                self._skipped = size
+                append(N_('... diff truncated after %s') %
+                       format_size(self._file_size))
+                self.line_count += 1
+                continue
+            self._file_size += size
+            if line.startswith('@@'):
+                self.hunks.append((self.line_count, line))
+            append(line)
+            self.line_count += 1
+        return result
+
+    def _end_file(self):
+        if self._skipped:
+            self.truncated.append((self._filename, self._skipped))
+        self._file_size = 0
+        self._skipped = 0
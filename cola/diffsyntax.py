@@ -0,0 +1,108 @@
+"""Single-pass classification of diff lines for syntax highlighting
+
+DiffClassifier returns the formatted spans of a diff line as
+(start, length, style) tuples.  The first character of a line decides
+which rules can apply, so most lines are classified with a couple of
+string comparisons.  The diffstat and trailing-whitespace regexes only
+run for lines that can match them.
+
+The styles and their precedence match the original rule list of
+qtutils.DiffSyntaxHighlighter.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import re
+
+HEADER = 'header'
+HEADER_BOLD = 'header_bold'
+ADD = 'add'
+REMOVE = 'remove'
+BAD_WHITESPACE = 'bad_whitespace'
+
+_DIFF_GIT_RE = re.compile(r'^diff --git a/.*b/.*')
+_INDEX_RE = re.compile(r'^index \S+\.\.\S+')
+_DIFFSTAT_BAR_RE = re.compile(r'^([ ]+.*)(\|[ ]+\d+[ ]+[+-]+)$')
+_DIFFSTAT_RE = re.compile(r'(.+\|.+?)(\d+)(.+?)([\+]*?)([-]*?)$')
+_SUMMARY_RE = re.compile(r'(\s+\d+ files changed[^\d]*)'
+                         r'(:?\d+ insertions[^\d]*)'
+                         r'(:?\d+ deletions.*)$')
+_WHITESPACE_RE = re.compile(r'(..*?)(\s+)$')
+
+_DIFFSTAT_STYLES = (None, HEADER, None, HEADER, HEADER)
+_SUMMARY_STYLES = (HEADER, HEADER, HEADER)
+_WHITESPACE_STYLES = (None, BAD_WHITESPACE)
+_BAR_STYLES = (HEADER_BOLD, HEADER)
+
+
+def _group_spans(match, styles, spans):
+    start = match.start()
+    for group, style in zip(match.groups(), styles):
+        if not group:
+            continue
+        length = len(group)
+        if style:
+            spans.append((start, length, style))
+        start += length
+
+
+class DiffClassifier(object):
+    """Classifies diff lines into formatted spans
+
+    A line's spans never depend on the lines around it, so highlighters
+    need no per-block state and Qt only re-highlights edited blocks.
+
+    """
+
+    def __init__(self, whitespace=True):
+        self.whitespace = whitespace
+
+    def spans(self, line):
+        """Return a tuple of (start, length, style) spans for a line"""
+        if not line:
+            return ()
+        first = line[0]
+        whole = None
+        if first == '-':
+            whole = line.startswith('--- ') and HEADER or REMOVE
+        elif first == '+':
+            whole = line.startswith('+++ ') and HEADER or ADD
+        elif first == '@':
+            if line.startswith('@@ '):
+                whole = HEADER_BOLD
+        elif first == ' ':
+            if '|' in line:
+                match = _DIFFSTAT_BAR_RE.match(line)
+                if match:
+                    spans = []
+                    _group_spans(match, _BAR_STYLES, spans)
+                    return tuple(spans)
+        elif first == 'd':
+            if ((line.startswith('diff --git a/') and
+                    _DIFF_GIT_RE.match(line)) or
+                    line.startswith('deleted file mode')):
+                whole = HEADER
+        elif first == 'i':
+            if line.startswith('index ') and _INDEX_RE.match(line):
+                whole = HEADER
+        elif first == 'n':
+            if line.startswith('new file mode'):
+                whole = HEADER
+        if whole is not None:
+            return ((0, len(line), whole),)
+
+        # Rules that combine with each other
+        spans = []
+        if '|' in line:
+            match = _DIFFSTAT_RE.match(line)
+            if match:
+                _group_spans(match, _DIFFSTAT_STYLES, spans)
+        if ' files changed' in line:
+            match = _SUMMARY_RE.match(line)
+            if match:
+                _group_spans(match, _SUMMARY_STYLES, spans)
+        if self.whitespace and line[-1].isspace():
+            match = _WHITESPACE_RE.match(line)
+            if match:
+                _group_spans(match, _WHITESPACE_STYLES, spans)
+        return tuple(spans)
@@ -1,19 +1,22 @@
 from __future__ import division, absolute_import, unicode_literals
 
+import binascii
 import functools
 import errno
 import os
+import re
 import sys
 import subprocess
 import threading
+import time
 from os.path import join
 
 from cola import core
+from cola.decorators import interruptable
 from cola.decorators import memoize
 from cola.interaction import Interaction
 
 
-INDEX_LOCK = threading.Lock()
 GIT_COLA_TRACE = core.getenv('GIT_COLA_TRACE', '')
 STATUS = 0
 STDOUT = 1
@@ -54,6 +57,180 @@ def read_git_file(path):
     return None
 
 
+# Command classes used by the scheduler
+READ = 'read'
+WRITE = 'write'
+
+# Commands that never write to the index, refs or worktree.
+# Commands that only refresh the index opportunistically (diff, status)
+# skip the refresh when .git/index.lock is held and are safe to share.
+READ_ONLY_COMMANDS = frozenset((
+    'blame',
+    'cat-file',
+    'check-attr',
+    'check-ignore',
+    'cherry',
+    'describe',
+    'diff',
+    'diff-files',
+    'diff-index',
+    'diff-tree',
+    'fmt-merge-msg',
+    'for-each-ref',
+    'grep',
+    'log',
+    'ls-files',
+    'ls-remote',
+    'ls-tree',
+    'merge-base',
+    'name-rev',
+    'rev-list',
+    'rev-parse',
+    'shortlog',
+    'show',
+    'show-ref',
+    'status',
+    'var',
+    'version',
+    'whatchanged',
+))
+
+# Commands that are read-only only when one of these options is present
+READ_ONLY_OPTIONS = {
+    'config': frozenset(('--get', '--get-all', '--get-regexp',
+                         '--list', '-l')),
+}
+
+
+def classify_command(command):
+    """Return READ for read-only git commands and WRITE for all others
+
+    Unknown commands and non-git commands are considered to be writers.
+
+    """
+    if len(command) < 2 or os.path.basename(command[0]) not in ('git',
+                                                                 'git.exe'):
+        return WRITE
+    subcmd = command[1]
+    if subcmd in READ_ONLY_COMMANDS:
+        return READ
+    options = READ_ONLY_OPTIONS.get(subcmd)
+    if options:
+        for arg in command[2:]:
+            if arg == '--':
+                break
+            if arg in options:
+                return READ
+    return WRITE
+
+
+class CommandStats(object):
+    """Queue-depth and wait-time counters for a single command class"""
+
+    def __init__(self):
+        self.count = 0
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'active': self.active,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+
+class CommandScheduler(object):
+    """A readers-writer lock for git commands
+
+    Any number of READ commands can run concurrently.  WRITE commands run
+    exclusively.  Waiting writers block new readers so that a steady
+    stream of long-running readers (log, grep) cannot starve them.
+
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+        self._stats = {READ: CommandStats(), WRITE: CommandStats()}
+
+    def acquire(self, command_class):
+        stats = self._stats[command_class]
+        start = time.time()
+        with self._cond:
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            if command_class == READ:
+                while self._writing or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+            else:
+                self._writers_waiting += 1
+                while self._writing or self._readers:
+                    self._cond.wait()
+                self._writers_waiting -= 1
+                self._writing = True
+            waited = time.time() - start
+            stats.queued -= 1
+            stats.active += 1
+            stats.count += 1
+            stats.wait_time += waited
+            stats.max_wait_time = max(stats.max_wait_time, waited)
+
+    def release(self, command_class):
+        with self._cond:
+            self._stats[command_class].active -= 1
+            if command_class == READ:
+                self._readers -= 1
+            else:
+                self._writing = False
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return a snapshot of the per-class counters"""
+        with self._cond:
+            return dict([(k, v.as_dict()) for k, v in self._stats.items()])
+
+    def reset_stats(self):
+        with self._cond:
+            for stats in self._stats.values():
+                active = stats.active
+                queued = stats.queued
+                stats.__init__()
+                stats.active = active
+                stats.queued = queued
+
+
+SCHEDULER = CommandScheduler()
+
+
+def command_stats():
+    """Return the scheduler's per-class counters for profiling"""
+    return SCHEDULER.stats()
+
+
+def _popen_extra():
+    """Return platform-specific keyword arguments for subprocess.Popen"""
+    extra = {}
+    if sys.platform == 'win32':
+        # If git-cola is invoked on Windows using "start pythonw git-cola",
+        # a console window will briefly flash on the screen each time
+        # git-cola invokes git, which is very annoying.  The code below
+        # prevents this by ensuring that any window will be hidden.
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        extra['startupinfo'] = startupinfo
+    return extra
+
+
 class Git(object):
     """
     The Git class manages communication with the Git binary
@@ -62,14 +239,44 @@ class Git(object):
         self._git_cwd = None #: The working directory used by execute()
         self._worktree = None
         self._git_file_path = None
+        self._object_reader = None
+        self._attr_reader = None
         self.set_worktree(core.getcwd())
 
     def set_worktree(self, path):
         self._git_dir = core.decode(path)
         self._git_file_path = None
         self._worktree = None
+        self.close_object_reader()
+        self.close_attr_reader()
         return self.worktree()
 
+    def object_reader(self):
+        """Return the persistent "git cat-file --batch" object reader"""
+        if self._object_reader is None:
+            self._object_reader = ObjectReader(self._git_cwd)
+        return self._object_reader
+
+    def close_object_reader(self):
+        """Stop the object reader's coprocesses, if any"""
+        if self._object_reader is not None:
+            self._object_reader.close()
+            self._object_reader = None
+
+    def attr_reader(self):
+        """Return the persistent "git check-attr --stdin" encoding reader"""
+        if self._attr_reader is None:
+            self._attr_reader = CheckAttrProcess(('encoding',),
+                                                 cwd=self._git_cwd)
+        return self._attr_reader
+
+    def close_attr_reader(self):
+        """Stop the check-attr coprocess, if any"""
+        if self._attr_reader is not None:
+            with self._attr_reader.lock:
+                self._attr_reader.close()
+            self._attr_reader = None
+
     def worktree(self):
         if self._worktree:
             return self._worktree
@@ -162,27 +369,23 @@ class Git(object):
         if not _cwd:
             _cwd = core.getcwd()
 
-        extra = {}
-        if sys.platform == 'win32':
-            # If git-cola is invoked on Windows using "start pythonw git-cola",
-            # a console window will briefly flash on the screen each time
-            # git-cola invokes git, which is very annoying.  The code below
-            # prevents this by ensuring that any window will be hidden.
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            extra['startupinfo'] = startupinfo
+        extra = _popen_extra()
 
         # Start the process
-        # Guard against thread-unsafe .git/index.lock files
-        INDEX_LOCK.acquire()
-        status, out, err = core.run_command(command,
-                                            cwd=_cwd,
-                                            encoding=_encoding,
-                                            stdin=_stdin, stdout=_stdout, stderr=_stderr,
-                                            **extra)
-        # Let the next thread in
-        INDEX_LOCK.release()
+        # Guard against thread-unsafe .git/index.lock files.
+        # Read-only commands share the lock; everything else is exclusive.
+        command_class = classify_command(command)
+        SCHEDULER.acquire(command_class)
+        try:
+            status, out, err = core.run_command(command,
+                                                cwd=_cwd,
+                                                encoding=_encoding,
+                                                stdin=_stdin, stdout=_stdout,
+                                                stderr=_stderr,
+                                                **extra)
+        finally:
+            # Let the next thread in
+            SCHEDULER.release(command_class)
         if not _raw and out is not None:
             out = out.rstrip('\n')
 
@@ -250,6 +453,311 @@ class Git(object):
             sys.exit(1)
 
 
+class Coprocess(object):
+    """A long-lived git command that answers requests over stdin/stdout
+
+    The lock serializes round-trips so that a single process can be shared
+    between threads.  Subclasses implement _roundtrip().
+
+    """
+    def __init__(self, argv, cwd=None):
+        self.argv = argv
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self._proc = None
+
+    def start(self):
+        cwd = self.cwd or core.getcwd()
+        self._proc = core.start_command(['git'] + self.argv,
+                                        cwd=cwd, stderr=None,
+                                        **_popen_extra())
+        if GIT_COLA_TRACE:
+            core.stderr('git %s (started)' % ' '.join(self.argv))
+
+    def close(self):
+        proc = self._proc
+        self._proc = None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            core.wait(proc)
+        except OSError:
+            pass
+        proc.stdout.close()
+
+    def request(self, data):
+        """Return the response to a request
+
+        A dead process is restarted once before giving up.
+
+        """
+        with self.lock:
+            for attempt in (1, 2):
+                if self._proc is None:
+                    self.start()
+                try:
+                    return self._roundtrip(data)
+                except (IOError, OSError, ValueError):
+                    self.close()
+                    if attempt == 2:
+                        raise
+
+    def _roundtrip(self, data):
+        raise NotImplementedError()
+
+
+class CatFileProcess(Coprocess):
+    """A long-lived "git cat-file --batch" or "--batch-check" coprocess
+
+    Requests are written to the process' stdin one object name per line
+    and the response is read back from its stdout.  A request returns
+    (header, content), where `header` is the raw header line without its
+    trailing newline and `content` is the object's data in --batch mode,
+    None otherwise.
+
+    """
+    def __init__(self, mode, cwd=None):
+        Coprocess.__init__(self, ['cat-file', mode], cwd=cwd)
+        self.mode = mode
+
+    def _roundtrip(self, objname):
+        proc = self._proc
+        core.fwrite(proc.stdin, objname + '\n')
+        proc.stdin.flush()
+        header = _readline_raw(proc.stdout)
+        if not header.endswith(b'\n'):
+            raise IOError(errno.EPIPE, 'git cat-file exited unexpectedly')
+        header = header[:-1]
+        content = None
+        if self.mode == '--batch' and _parse_header(header) is not None:
+            size = int(header.rsplit(b' ', 1)[-1])
+            content = _read_raw(proc.stdout, size + 1)[:-1]
+        return header, content
+
+
+class CheckAttrProcess(Coprocess):
+    """A long-lived "git check-attr --stdin -z <attrs>" coprocess
+
+    A request takes a list of worktree-relative paths and returns a dict
+    mapping each path to a dict of {attr: value}, where value is the raw
+    value reported by git, e.g. "unspecified", "set", "unset" or "utf-8".
+
+    Paths are written in chunks small enough to fit in the pipe buffer so
+    that writing a chunk never blocks on git writing its answers.
+
+    git caches .gitattributes files for as long as it runs, so the
+    process must be closed when they change.
+
+    """
+    chunk_size = 4096
+
+    def __init__(self, attrs, cwd=None):
+        Coprocess.__init__(self, ['check-attr', '--stdin', '-z'] + list(attrs),
+                           cwd=cwd)
+        self.attrs = tuple(attrs)
+
+    def _roundtrip(self, paths):
+        result = {}
+        chunk = []
+        chunk_size = 0
+        for path in paths:
+            encoded = core.encode(path) + b'\0'
+            if chunk and chunk_size + len(encoded) > self.chunk_size:
+                self._check_chunk(chunk, result)
+                chunk = []
+                chunk_size = 0
+            chunk.append((path, encoded))
+            chunk_size += len(encoded)
+        if chunk:
+            self._check_chunk(chunk, result)
+        return result
+
+    def _check_chunk(self, chunk, result):
+        proc = self._proc
+        core.fwrite(proc.stdin, b''.join([encoded for path, encoded in chunk]))
+        proc.stdin.flush()
+        for path, encoded in chunk:
+            values = result[path] = {}
+            for attr in self.attrs:
+                # Each answer is "<path> NUL <attr> NUL <value> NUL"
+                prefix = encoded + core.encode(attr) + b'\0'
+                if _read_raw(proc.stdout, len(prefix)) != prefix:
+                    raise IOError(errno.EPIPE,
+                                  'git check-attr exited unexpectedly')
+                values[attr] = core.decode(_read_field_raw(proc.stdout))
+
+
+def _read_field_raw(fh):
+    """Read a NUL-terminated field"""
+    field = []
+    while True:
+        c = _read_raw(fh, 1)
+        if not c:
+            raise IOError(errno.EPIPE, 'unexpected end of output')
+        if c == b'\0':
+            return b''.join(field)
+        field.append(c)
+
+
+@interruptable
+def _readline_raw(fh):
+    return fh.readline()
+
+
+@interruptable
+def _read_raw(fh, size):
+    return fh.read(size)
+
+
+class ObjectReader(object):
+    """Read git objects without forking a process per object
+
+    Object lookups are multiplexed over a pair of persistent
+    "git cat-file --batch" and "git cat-file --batch-check" processes
+    which are started lazily on first use.
+
+    """
+    def __init__(self, cwd=None):
+        self._batch = CatFileProcess('--batch', cwd=cwd)
+        self._check = CatFileProcess('--batch-check', cwd=cwd)
+
+    def close(self):
+        for proc in (self._batch, self._check):
+            with proc.lock:
+                proc.close()
+
+    def info(self, objname):
+        """Return (sha1, objtype, size) for an object, or None if missing"""
+        if not _valid_objname(objname):
+            return None
+        header, content = self._check.request(objname)
+        return _parse_header(header)
+
+    def read(self, objname):
+        """Return (sha1, objtype, data) for an object, or None if missing
+
+        The data is returned as raw bytes.
+
+        """
+        if not _valid_objname(objname):
+            return None
+        header, content = self._batch.request(objname)
+        info = _parse_header(header)
+        if info is None:
+            return None
+        sha1, objtype, size = info
+        return (sha1, objtype, content)
+
+    def read_blob(self, objname, encoding=None):
+        """Return the decoded contents of a blob, or None"""
+        result = self.read(objname)
+        if result is None or result[1] != 'blob':
+            return None
+        return core.decode(result[2], encoding=encoding)
+
+    def read_tree(self, objname):
+        """Return a list of (mode, objtype, sha1, name) for a single tree
+
+        The entries are equivalent to a non-recursive "git ls-tree".
+        Commits and tags are peeled to their tree.
+
+        """
+        result = self.read(_peel(objname, 'tree'))
+        if result is None:
+            return None
+        return parse_tree_object(result[2])
+
+    def read_commit(self, objname):
+        """Return a dict describing the commit header and message, or None
+
+        The dict contains sha1, tree, parents, author, committer,
+        encoding and message.  Tags are peeled to their commit.
+
+        """
+        result = self.read(_peel(objname, 'commit'))
+        if result is None:
+            return None
+        commit = parse_commit_object(result[2])
+        commit['sha1'] = result[0]
+        return commit
+
+
+def _peel(objname, objtype):
+    """Apply a ^{type} suffix unless objname uses the "rev:path" syntax"""
+    if ':' in objname:
+        return objname
+    return '%s^{%s}' % (objname, objtype)
+
+
+def _valid_objname(objname):
+    return bool(objname) and '\n' not in objname
+
+
+_HEADER_RE = re.compile(r'^([0-9a-f]{40,64}) ([a-z]+) (\d+)$')
+
+
+def _parse_header(header):
+    """Parse "<sha1> <type> <size>" as returned by git cat-file"""
+    match = _HEADER_RE.match(core.decode(header))
+    if match is None:
+        # "<objname> missing" or "<objname> ambiguous"
+        return None
+    return (match.group(1), match.group(2), int(match.group(3)))
+
+
+def _tree_entry_type(mode):
+    if mode == b'40000':
+        return 'tree'
+    if mode == b'160000':
+        return 'commit'
+    return 'blob'
+
+
+def parse_tree_object(data):
+    """Parse raw tree data into (mode, objtype, sha1, name) tuples"""
+    entries = []
+    offset = 0
+    end = len(data)
+    while offset < end:
+        space = data.index(b' ', offset)
+        nul = data.index(b'\0', space)
+        mode = data[offset:space]
+        name = core.decode(data[space+1:nul])
+        sha1 = core.decode(binascii.hexlify(data[nul+1:nul+21]))
+        entries.append((core.decode(mode.zfill(6)), _tree_entry_type(mode),
+                        sha1, name))
+        offset = nul + 21
+    return entries
+
+
+def parse_commit_object(data):
+    """Parse raw commit data into a dict of header fields and message"""
+    commit = {
+        'tree': None,
+        'parents': [],
+        'author': '',
+        'committer': '',
+        'encoding': None,
+        'message': '',
+    }
+    header, sep, message = data.partition(b'\n\n')
+    for line in header.split(b'\n'):
+        if line.startswith(b' '):
+            # continuation of a multi-line header, e.g. gpgsig
+            continue
+        key, sep, value = core.decode(line).partition(' ')
+        if key == 'parent':
+            commit['parents'].append(value)
+        elif key in ('tree', 'author', 'committer', 'encoding'):
+            commit[key] = value
+    commit['message'] = core.decode(message, encoding=commit['encoding'])
+    return commit
+
+
 @memoize
 def current():
     """Return the Git singleton"""
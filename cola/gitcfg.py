@@ -4,6 +4,7 @@ import copy
 import fnmatch
 import os
 import re
+import time
 from os.path import join
 
 from cola import core
@@ -14,7 +15,12 @@ from cola.decorators import memoize
 from cola.git import STDOUT
 from cola.compat import ustr
 
-BUILTIN_READER = os.environ.get('GIT_COLA_BUILTIN_CONFIG_READER', False)
+# Config files are parsed in-process unless this is set to "0" or "false"
+BUILTIN_READER = (os.environ.get('GIT_COLA_BUILTIN_CONFIG_READER', '1')
+                  .lower() not in ('0', 'false', 'no'))
+
+# Include directives are followed this many levels deep, like git
+MAX_INCLUDE_DEPTH = 10
 
 _USER_CONFIG = core.expanduser(join('~', '.gitconfig'))
 _USER_XDG_CONFIG = core.expanduser(
@@ -42,19 +48,11 @@ def _stat_info():
     return statinfo
 
 
-def _cache_key():
-    # Try /etc/gitconfig as a fallback for the system config
-    paths = ('/etc/gitconfig',
-             _USER_XDG_CONFIG,
-             _USER_CONFIG,
-             git.current().git_path('config'))
-    mtimes = []
-    for path in paths:
-        try:
-            mtimes.append(core.stat(path).st_mtime)
-        except OSError:
-            continue
-    return mtimes
+def _mtime(path):
+    try:
+        return core.stat(path).st_mtime
+    except OSError:
+        return None
 
 
 def _config_to_python(v):
@@ -72,17 +70,192 @@ def _config_to_python(v):
     return v
 
 
-def _config_key_value(line, splitchar):
-    """Split a config line into a (key, value) pair"""
-
-    try:
-        k, v = line.split(splitchar, 1)
-    except ValueError:
-        # the user has a emptyentry in their git config,
-        # which Git interprets as meaning "true"
-        k = line
-        v = 'true'
-    return k, _config_to_python(v)
+_SECTION_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz'
+                           'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                           '0123456789-.')
+_KEY_CHARS = _SECTION_CHARS - frozenset('.')
+_VALUE_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+
+def _config_error(text, pos):
+    lineno = text.count('\n', 0, pos) + 1
+    return ValueError('bad config line %d' % lineno)
+
+
+def _end_of_line(text, pos):
+    end = text.find('\n', pos)
+    if end < 0:
+        return len(text)
+    return end + 1
+
+
+def _parse_section(text, pos):
+    """Parse a "[section]" or '[section "subsection"]' header"""
+    size = len(text)
+    start = pos
+    while pos < size and text[pos] in _SECTION_CHARS:
+        pos += 1
+    name = text[start:pos].lower()
+    if not name or pos >= size:
+        raise _config_error(text, pos)
+    if text[pos] in ' \t':
+        while pos < size and text[pos] in ' \t':
+            pos += 1
+        if pos >= size or text[pos] != '"':
+            raise _config_error(text, pos)
+        pos += 1
+        subsection = []
+        while True:
+            if pos >= size or text[pos] == '\n':
+                raise _config_error(text, pos)
+            c = text[pos]
+            pos += 1
+            if c == '"':
+                break
+            if c == '\\':
+                if pos >= size or text[pos] == '\n':
+                    raise _config_error(text, pos)
+                c = text[pos]
+                pos += 1
+            subsection.append(c)
+        name = name + '.' + ''.join(subsection)
+    if pos >= size or text[pos] != ']':
+        raise _config_error(text, pos)
+    return name, pos + 1
+
+
+def _parse_value(text, pos):
+    """Parse a value, handling quotes, escapes and line continuations"""
+    size = len(text)
+    value = []
+    spaces = 0
+    quoted = False
+    while pos < size:
+        c = text[pos]
+        pos += 1
+        if c == '\n':
+            if quoted:
+                raise _config_error(text, pos - 1)
+            return ''.join(value), pos
+        if not quoted:
+            if c.isspace():
+                # Leading and trailing whitespace is dropped
+                if value:
+                    spaces += 1
+                continue
+            if c == '#' or c == ';':
+                return ''.join(value), _end_of_line(text, pos)
+        if spaces:
+            value.append(' ' * spaces)
+            spaces = 0
+        if c == '\\':
+            if pos >= size:
+                break
+            c = text[pos]
+            pos += 1
+            if c == '\n':
+                continue
+            try:
+                value.append(_VALUE_ESCAPES[c])
+            except KeyError:
+                raise _config_error(text, pos - 1)
+        elif c == '"':
+            quoted = not quoted
+        else:
+            value.append(c)
+    if quoted:
+        raise _config_error(text, pos)
+    return ''.join(value), pos
+
+
+def parse_config(text):
+    """Return the (key, value) pairs defined by git config file contents
+
+    Pairs are returned in file order, so multi-valued keys appear once per
+    value.  Keys are normalized like "git config --list": section and
+    variable names are lowercased and subsection names keep their case.
+    Variables without a "=", which git treats as true, have a None value.
+
+    Raises ValueError on syntax errors.
+
+    """
+    text = text.replace('\r\n', '\n')
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    size = len(text)
+    pos = 0
+    section = None
+    result = []
+    while pos < size:
+        c = text[pos]
+        if c.isspace():
+            pos += 1
+        elif c == '#' or c == ';':
+            pos = _end_of_line(text, pos)
+        elif c == '[':
+            section, pos = _parse_section(text, pos + 1)
+        elif c in _KEY_CHARS and c.isalpha() and section is not None:
+            start = pos
+            while pos < size and text[pos] in _KEY_CHARS:
+                pos += 1
+            key = section + '.' + text[start:pos].lower()
+            while pos < size and text[pos] in ' \t':
+                pos += 1
+            if pos >= size or text[pos] == '\n':
+                value = None
+            elif text[pos] == '=':
+                value, pos = _parse_value(text, pos + 1)
+            else:
+                raise _config_error(text, pos)
+            result.append((key, value))
+        else:
+            raise _config_error(text, pos)
+    return result
+
+
+def _wildmatch(pattern, icase=False):
+    """Compile a wildmatch pattern with pathname semantics into a regex"""
+    regex = []
+    size = len(pattern)
+    pos = 0
+    while pos < size:
+        c = pattern[pos]
+        pos += 1
+        if c == '*':
+            if pos < size and pattern[pos] == '*':
+                pos += 1
+                at_start = pos == 2 or pattern[pos - 3] == '/'
+                if at_start and pos < size and pattern[pos] == '/':
+                    # "**/" matches zero or more directories
+                    regex.append('(?:.*/)?')
+                    pos += 1
+                elif at_start and pos == size:
+                    regex.append('.*')
+                else:
+                    regex.append('[^/]*')
+            else:
+                regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', pos + 1)
+            if end < 0:
+                regex.append(re.escape(c))
+                continue
+            chars = pattern[pos:end]
+            pos = end + 1
+            negate = chars[:1] in ('!', '^')
+            if negate:
+                chars = chars[1:]
+            chars = chars.replace('\\', '\\\\')
+            regex.append('[%s%s]' % (negate and '^' or '', chars))
+        elif c == '\\' and pos < size:
+            regex.append(re.escape(pattern[pos]))
+            pos += 1
+        else:
+            regex.append(re.escape(c))
+    flags = icase and re.IGNORECASE or 0
+    return re.compile(''.join(regex) + r'\Z', flags)
 
 
 class GitConfig(observable.Observable):
@@ -91,6 +264,9 @@ class GitConfig(observable.Observable):
     message_user_config_changed = 'user_config_changed'
     message_repo_config_changed = 'repo_config_changed'
 
+    # Config files are stat()ed at most once per interval (in seconds)
+    check_interval = 1.0
+
     def __init__(self):
         observable.Observable.__init__(self)
         self.git = git.current()
@@ -100,11 +276,15 @@ class GitConfig(observable.Observable):
         self._user_or_system = {}
         self._repo = {}
         self._all = {}
-        self._cache_key = None
+        self._all_values = {}
+        self._mtimes = None
+        self._checked = 0.0
         self._configs = []
         self._config_files = {}
         self._value_cache = {}
         self._attr_cache = {}
+        self._attr_mtimes = {}
+        self._attr_checked = 0.0
         self._find_config_files()
 
     def reset(self):
@@ -114,11 +294,15 @@ class GitConfig(observable.Observable):
         self._user_or_system.clear()
         self._repo.clear()
         self._all.clear()
-        self._cache_key = None
+        self._all_values.clear()
+        self._mtimes = None
+        self._checked = 0.0
         self._configs = []
         self._config_files.clear()
         self._value_cache = {}
         self._attr_cache = {}
+        self._attr_mtimes = {}
+        self._attr_checked = 0.0
         self._find_config_files()
 
     def user(self):
@@ -146,9 +330,9 @@ class GitConfig(observable.Observable):
         for (cat, path, mtime) in statinfo:
             self._config_files[cat] = path
 
-    def update(self):
-        """Read config values from git."""
-        if self._cached():
+    def update(self, force=False):
+        """Read config values when the config files have changed."""
+        if not force and self._cached():
             return
         self._read_configs()
 
@@ -156,13 +340,19 @@ class GitConfig(observable.Observable):
         """
         Return True when the cache matches.
 
-        Updates the cache and returns False when the cache does not match.
+        The files that were read are stat()ed at most once every
+        `check_interval` seconds; lookups in between use the cache.
 
         """
-        cache_key = _cache_key()
-        if self._cache_key is None or cache_key != self._cache_key:
-            self._cache_key = cache_key
+        if self._mtimes is None:
             return False
+        now = time.time()
+        if now - self._checked < self.check_interval:
+            return True
+        self._checked = now
+        for path, mtime in self._mtimes.items():
+            if _mtime(path) != mtime:
+                return False
         return True
 
     def _read_configs(self):
@@ -173,6 +363,12 @@ class GitConfig(observable.Observable):
         self._user_or_system.clear()
         self._repo.clear()
         self._all.clear()
+        self._all_values.clear()
+        self._value_cache = {}
+        # core.attributesFile, gui.encoding or cola.fileattributes may change
+        self._reset_attributes()
+        self._mtimes = {}
+        self._checked = time.time()
 
         if 'system' in self._config_files:
             self._system.update(
@@ -194,52 +390,124 @@ class GitConfig(observable.Observable):
 
     def read_config(self, path):
         """Return git config data from a path as a dictionary."""
-
         if BUILTIN_READER:
-            return self._read_config_file(path)
+            entries = self._read_config_file(path)
+        else:
+            entries = self._read_config_git(path)
 
         dest = {}
+        for k, v in entries:
+            v = _config_to_python(v)
+            self._map[k.lower()] = k
+            self._all_values.setdefault(k, []).append(v)
+            dest[k] = v
+        return dest
+
+    def _read_config_git(self, path):
+        """Read a config file using git config --list"""
+        if self._mtimes is not None:
+            self._mtimes[path] = _mtime(path)
+        entries = []
         args = ('--null', '--file', path, '--list')
         config_lines = self.git.config(*args)[STDOUT].split('\0')
         for line in config_lines:
             if not line:
                 # the user has an invalid entry in their git config
                 continue
-            k, v = _config_key_value(line, '\n')
-            self._map[k.lower()] = k
-            dest[k] = v
-        return dest
+            try:
+                k, v = line.split('\n', 1)
+            except ValueError:
+                # the user has a emptyentry in their git config,
+                # which Git interprets as meaning "true"
+                k, v = line, 'true'
+            entries.append((k, v))
+        return entries
 
-    def _read_config_file(self, path):
-        """Read a .gitconfig file into a dict"""
+    def _read_config_file(self, path, depth=0):
+        """Read a config file and the files it includes as (key, value) pairs
 
-        config = {}
-        header_simple = re.compile(r'^\[(\s+)]$')
-        header_subkey = re.compile(r'^\[(\s+) "(\s+)"\]$')
+        Included files are expanded in place, as git does.
 
-        with core.xopen(path, 'rt') as f:
-            lines = filter(bool, [line.strip() for line in f.readlines()])
-
-        prefix = ''
-        for line in lines:
-            if line.startswith('#'):
-                continue
-
-            match = header_simple.match(line)
-            if match:
-                prefix = match.group(1) + '.'
+        """
+        if self._mtimes is not None:
+            self._mtimes[path] = _mtime(path)
+        try:
+            entries = parse_config(core.read(path))
+        except (IOError, OSError):
+            return []
+        except ValueError as e:
+            core.stderr('%s: %s' % (path, e))
+            return []
+
+        result = []
+        for k, v in entries:
+            if v is None:
+                # a key without a value is a boolean true
+                result.append((k, 'true'))
                 continue
-            match = header_subkey.match(line)
-            if match:
-                prefix = match.group(1) + '.' + match.group(2) + '.'
+            result.append((k, v))
+            if depth >= MAX_INCLUDE_DEPTH:
                 continue
+            if k == 'include.path':
+                include = True
+            elif (k.startswith('includeif.') and k.endswith('.path') and
+                    len(k) > len('includeif..path')):
+                condition = k[len('includeif.'):-len('.path')]
+                include = self._include_condition(condition, path)
+            else:
+                include = False
+            if include:
+                include_path = core.expanduser(v)
+                if not os.path.isabs(include_path):
+                    include_path = join(os.path.dirname(path), include_path)
+                result.extend(self._read_config_file(include_path,
+                                                     depth=depth + 1))
+        return result
 
-            k, v = _config_key_value(line, '=')
-            k = prefix + k
-            self._map[k.lower()] = k
-            config[k] = v
-
-        return config
+    def _include_condition(self, condition, path):
+        """Evaluate an includeIf condition for the config file at path"""
+        if condition.startswith('gitdir:'):
+            return self._match_gitdir(condition[len('gitdir:'):], path)
+        if condition.startswith('gitdir/i:'):
+            return self._match_gitdir(condition[len('gitdir/i:'):], path,
+                                      icase=True)
+        if condition.startswith('onbranch:'):
+            return self._match_branch(condition[len('onbranch:'):])
+        return False
+
+    def _match_gitdir(self, pattern, path, icase=False):
+        if not self.git.git_dir():
+            return False
+        if pattern.startswith('~/'):
+            pattern = core.expanduser(pattern)
+        elif pattern.startswith('./'):
+            dirname = os.path.dirname(core.realpath(path))
+            pattern = join(dirname, pattern[2:])
+        elif not os.path.isabs(pattern):
+            pattern = '**/' + pattern
+        if pattern.endswith('/'):
+            pattern += '**'
+        regex = _wildmatch(pattern, icase=icase)
+        gitdir = core.abspath(self.git.git_path())
+        return bool(regex.match(gitdir) or
+                    regex.match(core.realpath(gitdir)))
+
+    def _match_branch(self, pattern):
+        if not self.git.git_dir():
+            return False
+        head = self.git.git_path('HEAD')
+        if self._mtimes is not None:
+            self._mtimes[head] = _mtime(head)
+        try:
+            ref = core.read(head).strip()
+        except (IOError, OSError):
+            return False
+        prefix = 'ref: refs/heads/'
+        if not ref.startswith(prefix):
+            return False
+        if pattern.endswith('/'):
+            pattern += '**'
+        return bool(_wildmatch(pattern).match(ref[len(prefix):]))
 
     def _get(self, src, key, default):
         self.update()
@@ -266,6 +534,10 @@ class GitConfig(observable.Observable):
         """Return the string value for a config key."""
         return self._get(self._all, key, default)
 
+    def get_all(self, key, default=None):
+        """Return all values of a multi-valued config key as a list."""
+        return self._get(self._all_values, key, default)
+
     def get_user(self, key, default=None):
         return self._get(self._user, key, default)
 
@@ -288,13 +560,13 @@ class GitConfig(observable.Observable):
     def set_user(self, key, value):
         msg = self.message_user_config_changed
         self.git.config('--global', key, self.python_to_git(value))
-        self.update()
+        self.update(force=True)
         self.notify_observers(msg, key, value)
 
     def set_repo(self, key, value):
         msg = self.message_repo_config_changed
         self.git.config(key, self.python_to_git(value))
-        self.update()
+        self.update(force=True)
         self.notify_observers(msg, key, value)
 
     def find(self, pat):
@@ -324,27 +596,93 @@ class GitConfig(observable.Observable):
     def file_encoding(self, path):
         if not self.is_per_file_attrs_enabled():
             return self.gui_encoding()
+        self._check_attributes()
         cache = self._attr_cache
         try:
             value = cache[path]
         except KeyError:
-            value = cache[path] = (self._file_encoding(path) or
-                                   self.gui_encoding())
+            self._read_file_encodings([path])
+            value = cache[path]
         return value
 
-    def _file_encoding(self, path):
-        """Return the file encoding for a path"""
-        status, out, err = self.git.check_attr('encoding', '--', path)
-        if status != 0:
-            return None
-        header = '%s: encoding: ' % path
-        if out.startswith(header):
-            encoding = out[len(header):].strip()
-            if (encoding != 'unspecified' and
-                    encoding != 'unset' and
-                    encoding != 'set'):
-                return encoding
-        return None
+    def prefetch_file_encodings(self, paths):
+        """Resolve the encodings of many paths in a single round-trip"""
+        if not self.is_per_file_attrs_enabled():
+            return
+        self._check_attributes()
+        cache = self._attr_cache
+        paths = [path for path in paths if path not in cache]
+        if paths:
+            self._read_file_encodings(paths)
+
+    def _read_file_encodings(self, paths):
+        """Ask "git check-attr" for the encodings of paths and cache them"""
+        self._watch_attributes(paths)
+        try:
+            attrs = self.git.attr_reader().request(paths)
+        except (IOError, OSError, ValueError):
+            attrs = {}
+        gui_encoding = self.gui_encoding()
+        cache = self._attr_cache
+        for path in paths:
+            encoding = attrs.get(path, {}).get('encoding')
+            if encoding in (None, 'unspecified', 'unset', 'set'):
+                encoding = gui_encoding
+            cache[path] = encoding
+
+    def _watch_attributes(self, paths):
+        """Record the mtimes of the attributes files that apply to paths
+
+        Attributes come from the .gitattributes files in a path's parent
+        directories, $GIT_DIR/info/attributes and core.attributesFile.
+
+        """
+        if not self.git.git_dir():
+            return
+        mtimes = self._attr_mtimes
+        if not mtimes:
+            attributes_file = self.get('core.attributesfile')
+            if attributes_file:
+                attributes_file = core.expanduser(attributes_file)
+            else:
+                attributes_file = core.expanduser(
+                    join(core.getenv('XDG_CONFIG_HOME', join('~', '.config')),
+                         'git', 'attributes'))
+            for filename in (self.git.git_path('info', 'attributes'),
+                             attributes_file):
+                mtimes[filename] = _mtime(filename)
+        worktree = self.git.worktree()
+        for path in paths:
+            dirname = os.path.dirname(path)
+            while True:
+                filename = join(worktree, dirname, '.gitattributes')
+                if filename in mtimes:
+                    break
+                mtimes[filename] = _mtime(filename)
+                if not dirname:
+                    break
+                dirname = os.path.dirname(dirname)
+
+    def _check_attributes(self):
+        """Drop cached encodings when an attributes file has changed
+
+        The files are stat()ed at most once every `check_interval` seconds.
+
+        """
+        now = time.time()
+        if now - self._attr_checked < self.check_interval:
+            return
+        self._attr_checked = now
+        for filename, mtime in self._attr_mtimes.items():
+            if _mtime(filename) != mtime:
+                self._reset_attributes()
+                break
+
+    def _reset_attributes(self):
+        self._attr_cache.clear()
+        self._attr_mtimes.clear()
+        # git check-attr never re-reads the attributes files it has seen
+        self.git.close_attr_reader()
 
     def get_guitool_opts(self, name):
         """Return the guitool.<name> namespace as a dict
@@ -5,6 +5,7 @@ import re
 from io import StringIO
 
 from cola import core
+from cola import diffcache
 from cola import gitcfg
 from cola import utils
 from cola import version
@@ -83,6 +84,7 @@ class _current_branch:
 
 def reset():
     _current_branch.key = None
+    diffcache.current().clear()
 
 
 def current_branch():
@@ -256,6 +258,16 @@ def sha1_diff(git, sha1, filename=None):
     args = [sha1 + '~', sha1]
     opts = common_diff_opts()
     _add_filename(args, filename)
+
+    # Diffs between commits never change so they are cached forever
+    key = None
+    if diffcache.is_sha1(sha1):
+        key = ('sha1_diff', git.worktree(), tuple(args),
+               tuple(sorted(opts.items())))
+        out = diffcache.current().get(key)
+        if out is not None:
+            return out
+
     status, out, err = git.diff(*args, **opts)
     if status != 0:
         # We probably don't have "$sha1~" because this is the root commit.
@@ -264,6 +276,8 @@ def sha1_diff(git, sha1, filename=None):
         _add_filename(args, filename)
         status, out, err = git.show(pretty='format:', *args, **opts)
         out = out.lstrip()
+    if key is not None and status == 0:
+        diffcache.current().put(key, out)
     return out
 
 
@@ -289,6 +303,37 @@ def diff_helper(commit=None,
     "Invokes git diff on a filepath."
     if commit:
         ref, endref = commit+'^', commit
+    argv, encoding = _diff_helper_args(ref, endref, filename,
+                                       cached, head, amending)
+    opts = common_diff_opts()
+    key = _diff_cache_key(git, commit, ref, endref, filename, argv, opts,
+                          (cached, deleted, with_diff_header,
+                           suppress_header, reverse, encoding))
+    if key is not None:
+        result = diffcache.current().get(key)
+        if result is not None:
+            return result
+
+    status, out, err = git.diff(R=reverse, M=True, cached=cached,
+                                _encoding=encoding,
+                                *argv,
+                                **opts)
+    if status != 0:
+        # git init
+        if with_diff_header:
+            return ('', '')
+        else:
+            return ''
+
+    result = extract_diff_header(status, deleted,
+                                 with_diff_header, suppress_header, out)
+    if key is not None:
+        diffcache.current().put(key, result)
+    return result
+
+
+def _diff_helper_args(ref, endref, filename, cached, head, amending):
+    """Return the revision and path arguments and encoding for a diff"""
     argv = []
     if ref and endref:
         argv.append('%s..%s' % (ref, endref))
@@ -307,20 +352,56 @@ def diff_helper(commit=None,
             argv.append(filename)
             cfg = gitcfg.current()
             encoding = cfg.file_encoding(filename)
+    return argv, encoding
 
-    status, out, err = git.diff(R=reverse, M=True, cached=cached,
-                                _encoding=encoding,
-                                *argv,
-                                **common_diff_opts())
-    if status != 0:
-        # git init
-        if with_diff_header:
-            return ('', '')
-        else:
-            return ''
 
-    return extract_diff_header(status, deleted,
-                               with_diff_header, suppress_header, out)
+def diff_helper_command(ref=None, filename=None, cached=True,
+                        head=None, amending=False, reverse=False, git=git):
+    """Return (command, encoding) for streaming a diff_helper() diff
+
+    The command is run by the caller, e.g. to read huge diffs from a
+    pipe.  Its output includes the diff header.
+
+    """
+    argv, encoding = _diff_helper_args(ref, None, filename,
+                                       cached, head, amending)
+    opts = common_diff_opts()
+    opts = dict([(k, v) for k, v in opts.items() if not k.startswith('_')])
+    cmd = ['git', 'diff'] + git.transform_kwargs(R=reverse, M=True,
+                                                 cached=cached, **opts)
+    return cmd + argv, encoding
+
+
+def _diff_cache_key(git, commit, ref, endref, filename, argv, opts, flags):
+    """Return the diffcache key for a diff_helper() call, or None
+
+    Diffs between commits are keyed by their sha1s.  Diffs of specific
+    files against the index or worktree are keyed by the state of the
+    index, HEAD and the files.  Anything else is not cached, including
+    directories such as submodules, whose stat() does not change when
+    their contents or HEAD do.
+
+    """
+    if commit:
+        if not diffcache.is_sha1(commit):
+            return None
+        state = None
+    elif ref or endref:
+        if not (diffcache.is_sha1(ref) and diffcache.is_sha1(endref)):
+            return None
+        state = None
+    elif filename:
+        if type(filename) is list:
+            filenames = filename
+        else:
+            filenames = [filename]
+        if [f for f in filenames if core.isdir(f)]:
+            return None
+        state = diffcache.worktree_key(git, filenames)
+    else:
+        return None
+    return ('diff_helper', git.worktree(), tuple(argv),
+            tuple(sorted(opts.items())), flags, state)
 
 
 def extract_diff_header(status, deleted,
@@ -431,9 +512,11 @@ def untrack_paths(args, head='HEAD'):
 def worktree_state(head='HEAD',
                    update_index=False,
                    display_untracked=True,
-                   paths=None):
+                   paths=None,
+                   upstream=True):
     """Return a dict of files in various states of being
 
+    :param upstream: whether to compute the upstream_changed list.
     :rtype: dict, keys are staged, unstaged, untracked, unmerged,
             changed_upstream, and submodule.
 
@@ -441,6 +524,19 @@ def worktree_state(head='HEAD',
     if update_index:
         git.update_index(refresh=True)
 
+    # "git status" compares against HEAD only, so amend mode (HEAD^)
+    # still uses the diff-index/diff-files pair.
+    if head == 'HEAD' and _status_porcelain_v2():
+        state = status_state(display_untracked=display_untracked,
+                             paths=paths, upstream=upstream)
+        if state is not None:
+            return state
+    return diff_state(head, display_untracked=display_untracked,
+                      paths=paths, upstream=upstream)
+
+
+def diff_state(head, display_untracked=True, paths=None, upstream=True):
+    """Return the worktree_state() dict using diff-index and diff-files"""
     staged, unmerged, staged_deleted, staged_submods = diff_index(head,
                                                                   paths=paths)
     modified, unstaged_deleted, modified_submods = diff_worktree(paths)
@@ -452,7 +548,10 @@ def worktree_state(head='HEAD',
         modified = [path for path in modified if path not in unmerged_set]
 
     # Look for upstream modified files if this is a tracking branch
-    upstream_changed = diff_upstream(head)
+    if upstream:
+        upstream_changed = diff_upstream(head)
+    else:
+        upstream_changed = []
 
     # Keep stuff sorted
     staged.sort()
@@ -471,6 +570,146 @@ def worktree_state(head='HEAD',
             'submodules': staged_submods | modified_submods}
 
 
+def _status_porcelain_v2():
+    return version.check('status-porcelain-v2', version.git_version())
+
+
+def status_state(display_untracked=True, paths=None, upstream=True):
+    """Return the worktree_state() dict using a single "git status" call
+
+    The porcelain v2 output covers the index, the worktree, untracked
+    files and the upstream ahead/behind counts in one pass.  `paths`
+    limits the scan to a set of pathspecs.
+    Returns None when "git status" fails.
+
+    """
+    if paths is None:
+        paths = []
+    args = ['--porcelain=v2', '-z', '--branch',
+            '--untracked-files=' + (display_untracked and 'all' or 'no'),
+            '--'] + paths
+    status, out, err = git.status(*args)
+    if status != 0:
+        return None
+    state = parse_status_porcelain_v2(out)
+    branch = state.pop('branch')
+
+    # Only ask for the upstream changes when upstream has new commits
+    tracked = branch.get('upstream')
+    if upstream and tracked and branch.get('behind'):
+        base = merge_base('HEAD', tracked)
+        state['upstream_changed'] = sorted(diff_filenames(base, tracked))
+    return state
+
+
+def parse_status_porcelain_v2(out):
+    """Parse "git status --porcelain=v2 -z --branch" output
+
+    Returns a worktree_state() dict with an additional "branch" dict
+    containing the oid, head, upstream, ahead and behind headers.
+
+    """
+    staged = []
+    modified = []
+    unmerged = []
+    untracked = []
+    staged_deleted = set()
+    unstaged_deleted = set()
+    submodules = set()
+    branch = {}
+
+    records = out.split('\0')
+    idx = 0
+    count = len(records)
+    while idx < count:
+        record = records[idx]
+        idx += 1
+        if not record:
+            continue
+        kind = record[0]
+        if kind == '#':
+            _parse_status_branch_header(record, branch)
+            continue
+        if kind == '?':
+            untracked.append(record[2:])
+            continue
+        if kind == '1':
+            # 1 XY sub mH mI mW hH hI path
+            fields = record.split(' ', 8)
+            xy, sub, path = fields[1], fields[2], fields[8]
+            orig_path = None
+        elif kind == '2':
+            # 2 XY sub mH mI mW hH hI Xscore path NUL origPath
+            fields = record.split(' ', 9)
+            xy, sub, path = fields[1], fields[2], fields[9]
+            orig_path = records[idx]
+            idx += 1
+        elif kind == 'u':
+            # u XY sub m1 m2 m3 mW h1 h2 h3 path
+            fields = record.split(' ', 10)
+            unmerged.append(fields[10])
+            if fields[2][0] == 'S':
+                submodules.add(fields[10])
+            continue
+        else:
+            # "!" ignored entries or unknown record types
+            continue
+
+        if sub[0] == 'S':
+            submodules.add(path)
+        index_status, worktree_status = xy[0], xy[1]
+        if index_status in 'DAMT':
+            staged.append(path)
+            if index_status == 'D':
+                staged_deleted.add(path)
+        elif index_status in 'RC':
+            staged.append(path)
+            if index_status == 'R':
+                # The rename source is deleted from the index
+                staged.append(orig_path)
+                staged_deleted.add(orig_path)
+        if worktree_status in 'DAMT':
+            modified.append(path)
+            if worktree_status == 'D':
+                unstaged_deleted.add(path)
+        elif worktree_status in 'RC':
+            modified.append(path)
+            if worktree_status == 'R':
+                modified.append(orig_path)
+                unstaged_deleted.add(orig_path)
+
+    # Entries are emitted in path order; renames may break that order
+    staged.sort()
+    modified.sort()
+    unmerged.sort()
+    untracked.sort()
+
+    return {'staged': staged,
+            'modified': modified,
+            'unmerged': unmerged,
+            'untracked': untracked,
+            'upstream_changed': [],
+            'staged_deleted': staged_deleted,
+            'unstaged_deleted': unstaged_deleted,
+            'submodules': submodules,
+            'branch': branch}
+
+
+def _parse_status_branch_header(record, branch):
+    """Parse a "# branch.<key> <value>" header into the branch dict"""
+    key, sep, value = record[2:].partition(' ')
+    if key == 'branch.oid':
+        branch['oid'] = value
+    elif key == 'branch.head':
+        branch['head'] = value
+    elif key == 'branch.upstream':
+        branch['upstream'] = value
+    elif key == 'branch.ab':
+        ahead, behind = value.split(' ')
+        branch['ahead'] = int(ahead)
+        branch['behind'] = abs(int(behind))
+
+
 def _parse_raw_diff(out):
     while out:
         info, path, out = out.split('\0', 2)
@@ -0,0 +1,399 @@
+"""Incremental reading of "git grep" output for the Grep dialog
+
+A common pattern in a big repository can produce hundreds of megabytes
+of "git grep" output.  GrepStream turns decoded chunks of that output
+into complete lines and releases at most `limit` of them.  Once the
+limit is reached the reader waits in wait_for_room() without reading,
+so "git grep" blocks on its full pipe instead of the output piling up
+in memory.  show_more() raises the limit and lets the reader continue.
+
+ShardedGrep splits a search into shards, one "git grep" per top-level
+directory (and per revision when searching history), and runs them on a
+bounded pool of threads that each drive one process.  The output is
+merged in shard order, which is the order a single "git grep" would
+print except that worktree paths missing from HEAD come last.  Shards
+that are not yet being merged buffer a bounded amount of output.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import codecs
+import collections
+import multiprocessing
+import os
+import threading
+import time
+
+from cola import core
+from cola import utils
+from cola.git import git
+
+# Number of result lines shown before "Show More" is needed
+MAX_RESULTS = 5000
+
+
+def grep_args(query, shell=False):
+    """Return the "git grep" arguments of a query"""
+    if shell:
+        return utils.shell_split(query)
+    return [query]
+
+
+def grep_command(query, shell=False, regexp_mode='--basic-regexp',
+                 revisions=(), pathspecs=()):
+    """Return the "git grep" command line for a query"""
+    argv = ['git', 'grep', '-n', regexp_mode] + grep_args(query, shell=shell)
+    argv.extend(revisions)
+    if pathspecs:
+        argv.append('--')
+        argv.extend(pathspecs)
+    return argv
+
+
+def default_jobs():
+    """Return the number of grep processes to run at once"""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def top_level_entries(revision='HEAD'):
+    """Return (name, objtype) for the top-level entries of a revision"""
+    status, out, err = git.ls_tree('-z', revision)
+    if status != 0:
+        return []
+    entries = []
+    for line in out.split('\0'):
+        if '\t' not in line:
+            continue
+        info, name = line.split('\t', 1)
+        entries.append((name, info.split(' ')[1]))
+    return entries
+
+
+def pathspec_shards(entries, worktree=True):
+    """Group top-level entries into lists of pathspecs
+
+    Every tree gets a shard and consecutive blobs share one, so the
+    shards follow the order of "git grep" output.  When grepping the
+    worktree a last shard covers paths that are not in HEAD.
+
+    """
+    shards = []
+    blobs = []
+    for name, objtype in entries:
+        pathspec = ':(literal)' + name
+        if objtype == 'tree':
+            if blobs:
+                shards.append(blobs)
+                blobs = []
+            shards.append([pathspec])
+        elif objtype == 'blob':
+            blobs.append(pathspec)
+    if blobs:
+        shards.append(blobs)
+    if worktree and entries:
+        shards.append(['.'] + [':(exclude,literal)' + name
+                               for name, objtype in entries])
+    return shards
+
+
+def grep_shards(query, shell=False, regexp_mode='--basic-regexp',
+                revisions=(), paths=None, entries=top_level_entries):
+    """Return the GrepShards of a query
+
+    `paths` gives the pathspecs to shard over.  By default the
+    top-level entries of HEAD, or of each revision, are used.  A query
+    with its own "--" pathspecs is not split by path.
+
+    """
+    args = grep_args(query, shell=shell)
+    argv = ['git', 'grep', '-n', regexp_mode] + args
+    shards = []
+    for revision in (revisions or [None]):
+        rev_args = revision and [revision] or []
+        if '--' in args:
+            pathspecs = [[]]
+        elif paths:
+            pathspecs = [[path] for path in paths]
+        else:
+            pathspecs = pathspec_shards(entries(revision or 'HEAD'),
+                                        worktree=revision is None) or [[]]
+        for specs in pathspecs:
+            shard_argv = argv + rev_args
+            if specs:
+                shard_argv = shard_argv + ['--'] + specs
+            shards.append(GrepShard(len(shards), shard_argv,
+                                    revision=revision, pathspecs=specs))
+    return shards
+
+
+class GrepShard(object):
+    """A single "git grep" process of a sharded search"""
+
+    def __init__(self, index, argv, revision=None, pathspecs=()):
+        self.index = index
+        self.argv = argv
+        self.revision = revision
+        self.pathspecs = pathspecs
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.done = False
+        self.status = None
+        self.err = ''
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def label(self):
+        names = [spec.split(')', 1)[-1] for spec in self.pathspecs[:3]]
+        if len(self.pathspecs) > 3:
+            names.append('...')
+        label = ' '.join(names) or '.'
+        if self.revision:
+            label = '%s:%s' % (self.revision, label)
+        return label
+
+
+class ShardedGrep(object):
+    """Runs GrepShards on a bounded pool of processes
+
+    chunks() generates the output of every shard in shard order.  The
+    shard being merged is read as it arrives.  Other shards buffer up to
+    `buffer_size` bytes each and no shard more than `2 * jobs` places
+    ahead of it is started.
+
+    """
+
+    chunk_size = 65536
+    buffer_size = 4 << 20
+
+    def __init__(self, shards, jobs=None):
+        self.shards = shards
+        self.jobs = max(1, min(jobs or default_jobs(), len(shards)))
+        self._cond = threading.Condition(threading.Lock())
+        self._next = 0
+        self._head = 0
+        self._stopped = False
+        self._procs = set()
+        self._threads = []
+
+    def start(self):
+        for idx in range(self.jobs):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Kill the running processes and stop merging"""
+        with self._cond:
+            self._stopped = True
+            procs = list(self._procs)
+            self._cond.notify_all()
+        for proc in procs:
+            if proc.poll() is None:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while (not self._stopped and
+                        self._next >= self._head + 2 * self.jobs and
+                        self._next < len(self.shards)):
+                    cond.wait()
+                if self._stopped or self._next >= len(self.shards):
+                    return
+                shard = self.shards[self._next]
+                self._next += 1
+            self._run(shard)
+
+    def _run(self, shard):
+        cond = self._cond
+        shard.started = time.time()
+        try:
+            proc = core.start_command(shard.argv)
+        except OSError as e:
+            with cond:
+                shard.status = -1
+                shard.err = '%s: %s' % (shard.argv[0], e)
+                shard.finished = time.time()
+                shard.done = True
+                cond.notify_all()
+            return
+        with cond:
+            self._procs.add(proc)
+        fd = proc.stdout.fileno()
+        while True:
+            data = os.read(fd, self.chunk_size)
+            if not data:
+                break
+            with cond:
+                while (not self._stopped and shard.index != self._head and
+                        shard.buffered >= self.buffer_size):
+                    cond.wait()
+                if self._stopped:
+                    break
+                shard.chunks.append(data)
+                shard.buffered += len(data)
+                cond.notify_all()
+        if self._stopped and proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        proc.stdout.close()
+        err = core.decode(proc.stderr.read())
+        proc.stderr.close()
+        status = proc.wait()
+        with cond:
+            self._procs.discard(proc)
+            shard.status = status
+            shard.err = err
+            shard.finished = time.time()
+            shard.done = True
+            cond.notify_all()
+
+    def chunks(self):
+        """Generate the output of every shard, in shard order"""
+        cond = self._cond
+        for shard in self.shards:
+            while True:
+                with cond:
+                    while (not shard.chunks and not shard.done and
+                            not self._stopped):
+                        cond.wait()
+                    if self._stopped:
+                        return
+                    if not shard.chunks:
+                        self._head += 1
+                        cond.notify_all()
+                        break
+                    data = shard.chunks.popleft()
+                    shard.buffered -= len(data)
+                    cond.notify_all()
+                yield data
+
+    def status(self):
+        """Return the exit status of the search
+
+        0 when any shard found a match, otherwise the first error, or 1.
+
+        """
+        statuses = [shard.status for shard in self.shards]
+        if 0 in statuses:
+            return 0
+        for status in statuses:
+            if status != 1:
+                return status
+        return 1
+
+    def errors(self):
+        """Return the error output of every shard, without repeats"""
+        errors = []
+        for shard in self.shards:
+            for line in shard.err.splitlines():
+                if line not in errors:
+                    errors.append(line)
+        return '\n'.join(errors)
+
+    def timings(self):
+        """Return (label, seconds, status) for every shard"""
+        return [(shard.label(), shard.elapsed, shard.status)
+                for shard in self.shards]
+
+
+class GrepStream(object):
+    """Splits streamed grep output into lines, up to a result limit
+
+    feed() and finish() are called by the reader thread and show_more()
+    and close() by the GUI thread.
+
+    """
+
+    def __init__(self, limit=MAX_RESULTS, encoding=None):
+        self.limit = limit
+        self.count = 0          # lines released so far
+        self.done = False
+        self.closed = False
+        self._held = []         # lines read beyond the limit
+        self._remainder = ''
+        self._decoder = codecs.getincrementaldecoder(
+                encoding or 'utf-8')(errors='replace')
+        self._cond = threading.Condition(threading.Lock())
+
+    def feed(self, data):
+        """Add a chunk of raw output and return the lines to show"""
+        text = self._remainder + self._decoder.decode(data)
+        lines = text.split('\n')
+        self._remainder = lines.pop()
+        with self._cond:
+            self._held.extend(lines)
+            return self._release()
+
+    def finish(self):
+        """Return the lines to show once the output has ended"""
+        text = self._remainder + self._decoder.decode(b'', final=True)
+        self._remainder = ''
+        with self._cond:
+            if text:
+                self._held.append(text)
+            self.done = True
+            return self._release()
+
+    def show_more(self, count=MAX_RESULTS):
+        """Raise the limit by `count` and return the lines it releases"""
+        with self._cond:
+            self.limit += count
+            lines = self._release()
+            self._cond.notify_all()
+            return lines
+
+    def _release(self):
+        room = max(0, self.limit - self.count)
+        lines = self._held[:room]
+        del self._held[:room]
+        self.count += len(lines)
+        return lines
+
+    def is_full(self):
+        """Return True when the limit has been reached"""
+        with self._cond:
+            return self.count >= self.limit
+
+    def has_more(self):
+        """Return True when show_more() could release more lines"""
+        with self._cond:
+            return bool(self._held) or (not self.done and
+                                        self.count >= self.limit)
+
+    def wait_for_room(self):
+        """Block while the limit is reached
+
+        Returns False once the stream has been closed.
+
+        """
+        with self._cond:
+            while self.count >= self.limit and not self.closed:
+                self._cond.wait()
+            return not self.closed
+
+    def close(self):
+        """Wake up a waiting reader and make it stop"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
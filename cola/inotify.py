@@ -3,6 +3,7 @@
 from __future__ import division, absolute_import, unicode_literals
 
 import os
+import time
 from threading import Timer
 from threading import Lock
 
@@ -39,16 +40,92 @@ from cola.git import STDOUT
 from cola.i18n import N_
 from cola.interaction import Interaction
 from cola.models import main
+from cola.watchset import WatchError
+from cola.watchset import WatchSet
 
 
 _thread = None
 _observers = []
 
+# Rescan everything rather than passing huge pathspecs to git
+MAX_SCOPED_PATHS = 512
+
+# Changes inside the git directory are reported relative to this prefix
+GIT_PREFIX = '.git/'
+
+# Files inside the git directory that signal merges and rebases
+MERGE_STATE_NAMES = ('MERGE_HEAD', 'rebase-merge', 'rebase-apply')
+
 
 def observer(fn):
+    """Register a callback that receives the set of changed paths"""
     _observers.append(fn)
 
 
+def requires_full_refresh(paths):
+    """Can the changed paths not be handled incrementally?
+
+    An empty set means that the changes are unknown.
+
+    """
+    return not paths or len(paths) > MAX_SCOPED_PATHS
+
+
+def is_git_state_path(path):
+    """Is path a git directory entry that cola's model depends on?"""
+    return classify_git_path(path) is not None
+
+
+def classify_git_path(path):
+    """Classify a path relative to the git directory
+
+    Returns "head", "index", "refs", "merge" or None for paths that
+    do not affect the model, e.g. lock files and objects.
+
+    """
+    if path.endswith('.lock'):
+        return None
+    if path == 'HEAD':
+        return 'head'
+    if path == 'index':
+        return 'index'
+    if path == 'packed-refs' or path.startswith('refs/'):
+        return 'refs'
+    for name in MERGE_STATE_NAMES:
+        if path == name or path.startswith(name + '/'):
+            return 'merge'
+    return None
+
+
+def classify_paths(paths):
+    """Split changed paths into model updates
+
+    Returns a dict of keyword arguments for MainModel.update_changes():
+    head, index and merge are booleans, refs is the set of changed refs
+    (or "packed-refs") and paths is the set of changed worktree paths.
+
+    """
+    changes = {
+        'head': False,
+        'index': False,
+        'merge': False,
+        'refs': set(),
+        'paths': set(),
+    }
+    for path in paths:
+        if not path.startswith(GIT_PREFIX):
+            if path != '.git':
+                changes['paths'].add(path)
+            continue
+        name = path[len(GIT_PREFIX):]
+        kind = classify_git_path(name)
+        if kind == 'refs':
+            changes['refs'].add(name)
+        elif kind is not None:
+            changes[kind] = True
+    return changes
+
+
 def start():
     global _thread
 
@@ -103,44 +180,83 @@ class Handler():
         """Create an event handler"""
         ## Timer used to prevent notification floods
         self._timer = None
+        ## Paths touched since the last broadcast
+        self._paths = set()
         ## Lock to protect files and timer from threading issues
         self._lock = Lock()
 
     def broadcast(self):
         """Broadcasts a list of all files touched since last broadcast"""
         with self._lock:
+            paths = self._paths
+            self._paths = set()
             for observer in _observers:
-                observer()
+                observer(paths)
             self._timer = None
 
     def handle(self, path):
         """Queues up filesystem events for broadcast"""
         with self._lock:
+            self._paths.add(path.replace('\\', '/'))
             if self._timer is None:
                 self._timer = Timer(0.888, self.broadcast)
                 self._timer.start()
 
 
+def max_user_watches(default=8192):
+    """Return the kernel's fs.inotify.max_user_watches limit"""
+    try:
+        return int(core.read('/proc/sys/fs/inotify/max_user_watches'))
+    except (IOError, OSError, ValueError):
+        return default
+
+
 class FileSysEvent(ProcessEvent):
     """Generated by GitNotifier in response to inotify events"""
 
-    def __init__(self):
+    def __init__(self, watches=None, git_dir=None):
         """Maintain event state"""
         ProcessEvent.__init__(self)
         ## Takes care of Queueing events for broadcast
         self._handler = Handler()
+        ## Watched directories
+        self._watches = watches
+        ## The resolved git directory
+        self._git_dir = git_dir
+
+    def handle(self, path):
+        self._handler.handle(path)
 
     def process_default(self, event):
         """Queues up inotify events for broadcast"""
         if not event.name:
             return
-        path = os.path.relpath(os.path.join(event.path, event.name))
-        self._handler.handle(path)
+        path = os.path.join(event.path, event.name)
+        if self._watches is not None:
+            self._watches.touch(event.path)
+            if event.dir and event.mask & EventsCodes.ALL_FLAGS['IN_CREATE']:
+                self._watches.created([path])
+
+        git_dir = self._git_dir
+        if git_dir and (event.path == git_dir or
+                        event.path.startswith(git_dir + os.sep)):
+            relpath = os.path.relpath(path, git_dir).replace(os.sep, '/')
+            if is_git_state_path(relpath):
+                self._handler.handle(GIT_PREFIX + relpath)
+            return
+        self._handler.handle(os.path.relpath(path))
 
 
 class GitNotifier(QtCore.QThread):
     """Polls inotify for changes and generates FileSysEvents"""
 
+    ## Watches added per iteration of the event loop
+    watch_batch_size = 256
+    ## Polled directories visited per poll
+    poll_batch_size = 128
+    ## Seconds between polls of unwatched directories
+    poll_interval = 3.0
+
     def __init__(self, timeout=333):
         """Set up the pyinotify thread"""
         QtCore.QThread.__init__(self)
@@ -150,12 +266,14 @@ class GitNotifier(QtCore.QThread):
         self._timeout = timeout
         ## Path to monitor
         self._path = self._git.worktree()
+        ## Resolved path to monitor, set in run()
+        self._root = None
         ## Signals thread termination
         self._running = True
-        ## Directories to watching
-        self._dirs_seen = set()
         ## The inotify watch manager instantiated in run()
         self._wmgr = None
+        ## The watched and polled directories, created in run()
+        self._watches = None
         ## Has add_watch() failed?
         self._add_watch_failed = False
         ## Events to capture
@@ -172,26 +290,35 @@ class GitNotifier(QtCore.QThread):
         self._timeout = 0
         self._running = not stopped
 
-    def _watch_directory(self, directory):
-        """Set up a directory for monitoring by inotify"""
-        if self._wmgr is None or self._add_watch_failed:
-            return
-        directory = core.realpath(directory)
-        if directory in self._dirs_seen:
-            return
-        self._dirs_seen.add(directory)
-        if core.exists(directory):
-            dir_arg = directory if PY3 else core.encode(directory)
-            try:
-                self._wmgr.add_watch(dir_arg, self._mask, quiet=False)
-            except WatchManagerError as e:
+    def _add_watch(self, directory):
+        """Set up a directory for monitoring by inotify
+
+        Returns None when the directory no longer exists and raises
+        WatchError when inotify refuses the watch.
+
+        """
+        if not core.isdir(directory):
+            return None
+        dir_arg = directory if PY3 else core.encode(directory)
+        try:
+            result = self._wmgr.add_watch(dir_arg, self._mask, quiet=False)
+        except WatchManagerError as e:
+            if not core.isdir(directory):
+                return None
+            if not self._add_watch_failed:
                 self._add_watch_failed = True
                 self._add_watch_failed_warning(directory, e)
+            raise WatchError(ustr(e))
+        return result.get(dir_arg)
+
+    def _rm_watch(self, wd):
+        self._wmgr.rm_watch(wd, quiet=True)
 
     def _add_watch_failed_warning(self, directory, e):
         core.stderr('inotify: failed to watch "%s"' % directory)
         core.stderr(ustr(e))
         core.stderr('')
+        core.stderr('Directories that cannot be watched will be polled.')
         core.stderr('If you have run out of watches then you may be able to')
         core.stderr('increase the number of allowed watches by running:')
         core.stderr('')
@@ -210,6 +337,68 @@ class GitNotifier(QtCore.QThread):
                 return False
         return True
 
+    def _queue_hot_directories(self):
+        """Prioritize directories that contain changed files"""
+        model = main.model()
+        paths = (model.staged + model.modified +
+                 model.unmerged + model.untracked)
+        self._watches.queue(self._directories(paths), hot=True)
+
+    def _queue_tracked_directories(self):
+        """Queue every directory known to git"""
+        out = self._git.ls_files(z=True)[STDOUT]
+        self._watches.queue(self._directories(out.split('\0')))
+
+    def _directories(self, paths):
+        """Return the absolute parent directories of worktree paths"""
+        root = self._root
+        dirs = set()
+        for path in paths:
+            if not path:
+                continue
+            dirname = utils.dirname(path)
+            if dirname in dirs:
+                continue
+            while dirname and dirname not in dirs:
+                dirs.add(dirname)
+                dirname = utils.dirname(dirname)
+        return [os.path.join(root, d) for d in sorted(dirs)]
+
+    def _is_ignored(self, directories):
+        """Return the directories that git ignores"""
+        root = self._root
+        paths = [os.path.relpath(d, root) for d in directories]
+        try:
+            proc = core.start_command(['git', 'check-ignore', '--stdin', '-z'],
+                                      cwd=root)
+            out, err = proc.communicate(core.encode('\0'.join(paths) + '\0'))
+        except (IOError, OSError):
+            return []
+        if proc.returncode != 0:
+            return []
+        return [os.path.join(root, path)
+                for path in core.decode(out).split('\0') if path]
+
+    def _watch_git_dir(self, git_dir):
+        """Watch HEAD, index, packed-refs, refs/** and the merge state"""
+        paths = [git_dir] + [os.path.join(git_dir, name)
+                             for name in MERGE_STATE_NAMES]
+        for path in paths:
+            if not core.isdir(path):
+                continue
+            try:
+                self._add_watch(path)
+            except WatchError:
+                pass
+        refs = os.path.join(git_dir, 'refs')
+        for dirpath, dirnames, filenames in core.walk(refs):
+            # New ref directories are watched by FileSysEvent as they appear
+            self._watches.queue([core.decode(dirpath)], hot=True)
+
+    def _model_updated(self):
+        if self._watches is not None:
+            self._queue_hot_directories()
+
     def run(self):
         """Create the inotify WatchManager and generate FileSysEvents"""
 
@@ -219,19 +408,31 @@ class GitNotifier(QtCore.QThread):
 
         # Only capture events that git cares about
         self._wmgr = WatchManager()
+        self._root = core.realpath(self._path)
+        self._watches = WatchSet(self._add_watch, self._rm_watch,
+                                 max_user_watches() // 2,
+                                 is_ignored=self._is_ignored)
+        git_dir = core.realpath(self._git.git_path())
+        event_handler = FileSysEvent(self._watches, git_dir=git_dir)
         if self._is_pyinotify_08x():
-            notifier = Notifier(self._wmgr, FileSysEvent(),
+            notifier = Notifier(self._wmgr, event_handler,
                                 timeout=self._timeout)
         else:
-            notifier = Notifier(self._wmgr, FileSysEvent())
-
-        self._watch_directory(self._path)
-
-        # Register files/directories known to git
-        for filename in self._git.ls_files()[STDOUT].splitlines():
-            filename = core.realpath(filename)
-            directory = os.path.dirname(filename)
-            self._watch_directory(directory)
+            notifier = Notifier(self._wmgr, event_handler)
+
+        # Watch the git directory and refs so that commits, checkouts
+        # and fetches made outside of cola are noticed.
+        self._watch_git_dir(git_dir)
+
+        # Watch the root and the directories with changes first, then
+        # add watches for the rest of the tree in the background.
+        self._watches.queue([self._root], hot=True)
+        self._queue_hot_directories()
+        model = main.model()
+        model.add_observer(model.message_updated, self._model_updated)
+        self._watches.process(self.watch_batch_size)
+        self._queue_tracked_directories()
+        last_poll = time.time()
 
         # self._running signals app termination.  The timeout is a tradeoff
         # between fast notification response and waiting too long to exit.
@@ -245,6 +446,14 @@ class GitNotifier(QtCore.QThread):
             if check:
                 notifier.read_events()
                 notifier.process_events()
+            self._watches.process(self.watch_batch_size)
+
+            now = time.time()
+            if now - last_poll >= self.poll_interval:
+                last_poll = now
+                for directory in self._watches.poll(self.poll_batch_size):
+                    event_handler.handle(os.path.relpath(directory))
+        model.remove_observer(self._model_updated)
         notifier.stop()
 
     def run_win32(self):
@@ -287,6 +496,8 @@ class GitNotifier(QtCore.QThread):
                 if not self._running:
                     break
                 path = path.replace('\\', '/')
-                if (not path.startswith('.git/') and
-                        '/.git/' not in path and os.path.isfile(path)):
+                if path.startswith(GIT_PREFIX):
+                    if is_git_state_path(path[len(GIT_PREFIX):]):
+                        handler.handle(path)
+                elif '/.git/' not in path and os.path.isfile(path):
                     handler.handle(path)
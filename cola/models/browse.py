@@ -15,9 +15,11 @@ from cola import utils
 from cola import qtutils
 from cola import version
 from cola import resources
-from cola.git import STDOUT
 from cola.i18n import N_
+from cola.models import lastchange
 from cola.models import main
+from cola.models import pathlist
+from cola.models import statusindex
 
 
 # Custom event type for GitRepoInfoEvents
@@ -61,12 +63,21 @@ def _item_path(item):
 
 
 class GitRepoModel(QtGui.QStandardItemModel):
-    """Provides an interface into a git repository for browsing purposes."""
+    """Provides an interface into a git repository for browsing purposes.
+
+    Rows are created lazily: only the top-level entries are created up
+    front and the entries of a directory are created when the view first
+    expands it (see canFetchMore() and fetchMore()).
+
+    """
 
     def __init__(self, parent):
         QtGui.QStandardItemModel.__init__(self, parent)
-        self._interesting_paths = self._get_paths()
+        self._status = {}
         self._known_paths = set()
+        self._paths = pathlist.SortedPaths()
+        self._dirs = set()
+        self._loaded = set([''])
 
         self.connect(self, SIGNAL('updated'), self._updated_callback)
         model = main.model()
@@ -119,7 +130,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
         done = False
         for idx in range(parent.rowCount()):
             child = parent.child(idx, 0)
-            if child.rowCount() > 0:
+            if child.path in self._dirs:
                 continue
             if path < child.path:
                 parent.insertRow(idx, row_items)
@@ -148,6 +159,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
         row = self._dir_rows[parent_path]
         parent.insertRow(row, row_items)
         self._dir_rows[parent_path] += 1
+        self._dirs.add(path)
 
         # Update the 'name' column for this entry
         self.entry(path).update_name()
@@ -155,67 +167,137 @@ class GitRepoModel(QtGui.QStandardItemModel):
 
         return row_items[0]
 
-    def path_is_interesting(self, path):
-        """Return True if path has a status."""
-        return path in self._interesting_paths
+    def hasChildren(self, index=QtCore.QModelIndex()):
+        if self._unloaded_dir(index) is not None:
+            return True
+        return QtGui.QStandardItemModel.hasChildren(self, index)
+
+    def canFetchMore(self, index):
+        return self._unloaded_dir(index) is not None
+
+    def fetchMore(self, index):
+        path = self._unloaded_dir(index)
+        if path is not None:
+            self._populate(path)
+
+    def _unloaded_dir(self, index):
+        """Return the path of an unpopulated directory index, or None"""
+        if not index.isValid():
+            return None
+        item = self.itemFromIndex(index)
+        path = _item_path(item)
+        if path in self._dirs and path not in self._loaded:
+            return path
+        return None
+
+    def _populate(self, dirname):
+        """Create rows for the entries of a directory"""
+        if dirname in self._loaded:
+            return
+        self._loaded.add(dirname)
+        parent = self._direntries[dirname]
+        dirs, files = self._paths.children(dirname)
+        for path in dirs:
+            self._direntries[path] = self.add_directory(parent, path)
+        for path in files:
+            self._add_file(parent, path)
 
-    def _get_paths(self):
-        """Return paths of interest; e.g. paths with a status."""
-        model = main.model()
-        paths = model.staged + model.unstaged
-        return utils.add_parents(paths)
+    def path_is_interesting(self, path):
+        """Return True if path, or any path below it, has a status."""
+        index = statusindex.current().get(main.model())
+        return bool(index.flags(path) & statusindex.INTERESTING)
 
     def _model_updated(self):
         """Observes model changes and updates paths accordingly."""
         self.emit(SIGNAL('updated'))
 
     def _updated_callback(self):
-        old_paths = self._interesting_paths
-        new_paths = self._get_paths()
-        for path in new_paths.union(old_paths):
-            if path not in self._known_paths:
-                continue
-            self.entry(path).update()
-
-        self._interesting_paths = new_paths
+        """Update the rows whose status changed since the last update"""
+        old_status = self._status
+        new_status = pathlist.status_snapshot(main.model())
+        self._status = new_status
+
+        paths = set()
+        for path in pathlist.diff_snapshots(old_status, new_status):
+            status = new_status.get(path)
+            present = pathlist.is_present(path, status)
+            if path not in self._paths:
+                if pathlist.is_interesting(status) and present:
+                    self.add_file(path, insert=True)
+            elif not present:
+                self.remove_file(path)
+
+            while path:
+                paths.add(path)
+                path = utils.dirname(path)
+
+        for path in paths:
+            if path in self._known_paths:
+                self.entry(path).update()
 
     def _initialize(self):
-        """Iterate over the cola model and create GitRepoItems."""
-        for path in gitcmds.all_files():
-            self.add_file(path)
+        """Create rows for the top-level entries of the repository"""
+        self._paths = pathlist.SortedPaths(gitcmds.all_files())
+        self._status = pathlist.status_snapshot(main.model())
+        self._populate('')
 
     def add_file(self, path, insert=False):
-        """Add a file to the model."""
-        dirname = utils.dirname(path)
-        if dirname in self._direntries:
-            parent = self._direntries[dirname]
-        else:
-            parent = self._create_dir_entry(dirname, self._direntries)
-            self._direntries[dirname] = parent
-        self._add_file(parent, path, insert=insert)
+        """Add a file to the model.
+
+        Rows are only created when the file's directory has been loaded;
+        otherwise the file appears once its directory is expanded.
 
-    def _create_dir_entry(self, dirname, direntries):
         """
-        Create a directory entry for the model.
+        if not self._paths.add(path):
+            return
+        parent = self._loaded_dir_entry(utils.dirname(path))
+        if parent is not None:
+            self._add_file(parent, path, insert=insert)
+
+    def _loaded_dir_entry(self, dirname):
+        """Return the item for a loaded directory, or None
 
-        This ensures that directories are always listed before files.
+        Directories that do not exist yet are created.  A new directory
+        only contains new paths so it is considered loaded.
 
         """
-        entries = dirname.split('/')
-        curdir = []
-        parent = self.invisibleRootItem()
-        curdir_append = curdir.append
-        self_add_directory = self.add_directory
-        for entry in entries:
-            curdir_append(entry)
-            path = '/'.join(curdir)
-            try:
-                parent = direntries[path]
-            except KeyError:
-                grandparent = parent
-                parent = self_add_directory(grandparent, path)
-                direntries[path] = parent
-        return parent
+        if dirname in self._direntries:
+            if dirname in self._loaded:
+                return self._direntries[dirname]
+            return None
+        parent = self._loaded_dir_entry(utils.dirname(dirname))
+        if parent is None:
+            return None
+        item = self._direntries[dirname] = self.add_directory(parent, dirname)
+        self._loaded.add(dirname)
+        return item
+
+    def remove_file(self, path):
+        """Remove a file and any directories left empty by its removal"""
+        self._paths.remove(path)
+        self._remove_row(path)
+        dirname = utils.dirname(path)
+        while dirname and not self._paths.is_dir(dirname):
+            self._remove_row(dirname)
+            parent_path = utils.dirname(dirname)
+            if dirname in self._direntries:
+                del self._direntries[dirname]
+                self._dir_rows[parent_path] -= 1
+            self._dir_rows.pop(dirname, None)
+            self._dirs.discard(dirname)
+            self._loaded.discard(dirname)
+            dirname = parent_path
+
+    def _remove_row(self, path):
+        """Remove the row for a path from its parent directory"""
+        self._known_paths.discard(path)
+        parent = self._direntries.get(utils.dirname(path))
+        if parent is None:
+            return
+        for idx in range(parent.rowCount()):
+            if parent.child(idx, 0).path == path:
+                parent.removeRow(idx)
+                break
 
     def entry(self, path):
         """Return the GitRepoEntry for a path."""
@@ -330,15 +412,9 @@ class GitRepoInfoTask(QRunnable):
 
         """
         if not self._data:
-            log_line = main.model().git.log('-1', '--', self.path,
-                                            M=True,
-                                            all=False,
-                                            no_color=True,
-                                            pretty='format:%ar%x01%s%x01%an'
-                                            )[STDOUT]
-            if log_line:
-                log_line = log_line
-                date, message, author = log_line.split(chr(0x01), 2)
+            info = lastchange.current().get(self.path)
+            if info:
+                date, message, author = info
                 self._data['date'] = date
                 self._data['message'] = message
                 self._data['author'] = author
@@ -376,24 +452,20 @@ class GitRepoInfoTask(QRunnable):
     def status(self):
         """Return the status for the entry's path."""
 
-        model = main.model()
-        unmerged = utils.add_parents(model.unmerged)
-        modified = utils.add_parents(model.modified)
-        staged = utils.add_parents(model.staged)
-        untracked = utils.add_parents(model.untracked)
-        upstream_changed = utils.add_parents(model.upstream_changed)
+        index = statusindex.current().get(main.model())
+        flags = index.flags(self.path)
 
-        if self.path in unmerged:
+        if flags & statusindex.UNMERGED:
             return (resources.icon('modified.png'), N_('Unmerged'))
-        if self.path in modified and self.path in staged:
+        if flags & statusindex.MODIFIED and flags & statusindex.STAGED:
             return (resources.icon('partial.png'), N_('Partially Staged'))
-        if self.path in modified:
+        if flags & statusindex.MODIFIED:
             return (resources.icon('modified.png'), N_('Modified'))
-        if self.path in staged:
+        if flags & statusindex.STAGED:
             return (resources.icon('staged.png'), N_('Staged'))
-        if self.path in upstream_changed:
+        if flags & statusindex.UPSTREAM_CHANGED:
             return (resources.icon('upstream.png'), N_('Changed Upstream'))
-        if self.path in untracked:
+        if flags & statusindex.UNTRACKED:
             return (None, '?')
         return (None, '')
 
@@ -0,0 +1,389 @@
+"""A prebuilt index for completing paths and refs as the user types
+
+The completion widgets used to rebuild the parent directories of every
+tracked file, lowercase every candidate and substring-scan the whole
+list on every keystroke.  CompletionIndex does that work once per
+change of the candidates.
+
+Entries are kept sorted by their lowercased text, which makes the
+sorted list a flat trie: the entries below a prefix, including
+everything below a directory, are a contiguous range found by
+bisection.  The paths, their last components and the directories are
+also joined into newline-separated tables so that substring and
+subsequence scans run inside str.find() and the regex engine instead of
+a Python loop.  Case-sensitive tables are built on first use.
+
+Matches are ranked in tiers: full path prefix, basename prefix,
+substring, and finally subsequence ("fuzzy") matches, which are ordered
+by how compact the match is.  A query stops scanning once it has
+MAX_RESULTS matches.  When a query found all of its matches, the next
+keystroke only re-ranks those.  A query can be cancelled between tiers
+and between windows of the table scans.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import array
+import bisect
+import re
+import threading
+
+from cola import core
+from cola import git
+from cola import gitcmds
+from cola import utils
+from cola.decorators import memoize
+
+# Upper bound on the number of completions returned by a query
+MAX_RESULTS = 100
+
+PREFIX = 0
+BASENAME = 1
+SUBSTRING = 2
+FUZZY = 3
+
+# Number of characters of a table scanned between cancellation checks
+SCAN_WINDOW = 1 << 20
+
+
+class Cancelled(Exception):
+    """Raised when a search's `cancelled` callback returns True"""
+    pass
+
+
+def _fuzzy_re(text):
+    """Match the characters of text in order, within a single line
+
+    Each gap excludes the character that follows it, so the regex finds
+    the leftmost match without backtracking.
+
+    """
+    parts = [re.escape(text[0])]
+    for c in text[1:]:
+        parts.append('[^\n%s]*%s' % (re.escape(c), re.escape(c)))
+    return re.compile(''.join(parts))
+
+
+class _Table(object):
+    """Newline-separated strings with the offset of each string"""
+
+    def __init__(self, strings):
+        self.text = '\n' + '\n'.join(strings) + '\n'
+        self.offsets = offsets = array.array('l')
+        offset = 1
+        for string in strings:
+            offsets.append(offset)
+            offset += len(string) + 1
+        offsets.append(offset)
+
+    def entry_at(self, pos):
+        """Return the index of the string containing a text offset"""
+        return bisect.bisect_right(self.offsets, pos) - 1
+
+    def windows(self, cancelled=None):
+        """Generate (start, end) ranges of whole lines of about SCAN_WINDOW
+
+        Raises Cancelled before each window when `cancelled()` is true.
+
+        """
+        text = self.text
+        size = len(text)
+        start = 0
+        while start < size:
+            if cancelled is not None and cancelled():
+                raise Cancelled()
+            end = text.find('\n', start + SCAN_WINDOW) + 1
+            if end <= 0:
+                end = size
+            yield start, end
+            start = end
+
+    def find(self, needle, cancelled=None):
+        """Generate the indexes of the strings that contain needle"""
+        text = self.text
+        offsets = self.offsets
+        for start, end in self.windows(cancelled):
+            pos = text.find(needle, start, end)
+            while pos >= 0:
+                idx = self.entry_at(pos)
+                yield idx
+                pos = text.find(needle, offsets[idx + 1], end)
+
+    def search(self, regex, cancelled=None):
+        """Generate the indexes of the strings that match regex"""
+        text = self.text
+        offsets = self.offsets
+        for start, end in self.windows(cancelled):
+            match = regex.search(text, start, end)
+            while match is not None:
+                idx = self.entry_at(match.start())
+                yield idx
+                match = regex.search(text, offsets[idx + 1], end)
+
+
+def _collect(found, indexes, limit):
+    """Add indexes to found until it holds `limit` entries
+
+    Returns True when every index was added.
+
+    """
+    for idx in indexes:
+        if len(found) >= limit:
+            return False
+        found.setdefault(idx, len(found))
+    return True
+
+
+def _basename(path):
+    return path[path.rfind('/') + 1:]
+
+
+class CompletionIndex(object):
+    """An index of completion candidates
+
+    :param items: the candidate strings
+    :param parents: add the parent directories of every item, which
+        are then listed in `dirs`
+
+    """
+
+    def __init__(self, items, parents=False):
+        entries = set(items)
+        if parents:
+            all_entries = utils.add_parents(entries)
+            self.dirs = frozenset(all_entries.difference(entries))
+        else:
+            all_entries = entries
+            self.dirs = frozenset()
+        pairs = sorted([(entry.lower(), entry) for entry in all_entries])
+        # The lowercase shadow table and the entries in the same order
+        self.keys = keys = [key for key, entry in pairs]
+        self.entries = [entry for key, entry in pairs]
+        # Lowercase basenames, sorted, with the index of their entry
+        basenames = sorted([(_basename(key), idx)
+                            for idx, key in enumerate(keys)])
+        self._basenames = [name for name, idx in basenames]
+        self._basename_entries = array.array(
+            'l', [idx for name, idx in basenames])
+        # Indexes of the directories, in sorted order
+        self._dir_entries = array.array(
+            'l', [idx for idx, entry in enumerate(self.entries)
+                  if entry in self.dirs])
+        self._tables = {False: self._build_tables(keys)}
+        self._tables_lock = threading.Lock()
+        self._last = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _build_tables(self, paths):
+        """Return tables of the full paths, their last component and dirs"""
+        return (_Table(paths),
+                _Table([_basename(path) for path in paths]),
+                _Table([paths[idx] for idx in self._dir_entries]))
+
+    def _tables_for(self, case_sensitive):
+        # Case-sensitive queries are rare, so build their tables on demand
+        with self._tables_lock:
+            try:
+                return self._tables[case_sensitive]
+            except KeyError:
+                tables = self._tables[True] = self._build_tables(self.entries)
+                return tables
+
+    def search(self, text, case_sensitive=False, limit=MAX_RESULTS,
+               cancelled=None):
+        """Return up to `limit` ranked entries matching text
+
+        `cancelled` is polled during long scans; the search raises
+        Cancelled once it returns True.
+
+        """
+        if not text:
+            return self.entries[:limit]
+        needle = case_sensitive and text or text.lower()
+        last = self._last
+        if (last is not None and needle.startswith(last[0]) and
+                last[1] == case_sensitive):
+            matches = self._sorted(last[2], needle, case_sensitive)
+            complete = True
+        else:
+            matches, complete = self._scan(needle, case_sensitive, limit,
+                                           cancelled)
+        if complete:
+            # Every match is known, so the next keystroke can refine them
+            self._last = (needle, case_sensitive, matches)
+        else:
+            self._last = None
+        return [self.entries[idx] for idx in matches[:limit]]
+
+    def _rank(self, idx, needle, regex, case_sensitive):
+        """Return the (tier, score) of an entry, or None"""
+        if case_sensitive:
+            entry = self.entries[idx]
+        else:
+            entry = self.keys[idx]
+        if entry.startswith(needle):
+            return (PREFIX, 0)
+        if _basename(entry).startswith(needle):
+            return (BASENAME, 0)
+        if needle in entry:
+            return (SUBSTRING, 0)
+        match = regex.search(entry)
+        if match is None:
+            return None
+        return (FUZZY, match.end() - match.start())
+
+    def _sorted(self, indexes, needle, case_sensitive):
+        regex = _fuzzy_re(needle)
+        ranked = []
+        for idx in indexes:
+            rank = self._rank(idx, needle, regex, case_sensitive)
+            if rank is not None:
+                ranked.append((rank, idx))
+        ranked.sort()
+        return [idx for rank, idx in ranked]
+
+    def _scan(self, needle, case_sensitive, limit, cancelled):
+        """Collect matches tier by tier until `limit` entries are found
+
+        Returns (matches, complete).  The matches are ranked when every
+        match was found, and in the order the tiers found them when the
+        limit cut the scan short.
+
+        """
+        paths = self._tables_for(case_sensitive)[0]
+        found = {}
+        complete = (
+            _collect(found, self._prefixed(needle, case_sensitive), limit) and
+            _collect(found, self._basename_prefixed(needle, case_sensitive),
+                     limit) and
+            _collect(found, self._substrings(needle, case_sensitive,
+                                             cancelled), limit) and
+            _collect(found, paths.search(_fuzzy_re(needle), cancelled),
+                     limit))
+        if complete:
+            return self._sorted(found, needle, case_sensitive), True
+        return sorted(found, key=found.get), False
+
+    def _prefixed(self, needle, case_sensitive):
+        """Generate the entries that start with needle"""
+        keys = self.keys
+        entries = self.entries
+        key = needle.lower()
+        lo = bisect.bisect_left(keys, key)
+        hi = bisect.bisect_left(keys, key + '\uffff', lo)
+        for idx in range(lo, hi):
+            if not case_sensitive or entries[idx].startswith(needle):
+                yield idx
+
+    def _basename_prefixed(self, needle, case_sensitive):
+        """Generate the entries whose basename starts with needle"""
+        basenames = self._basenames
+        indexes = self._basename_entries
+        entries = self.entries
+        key = needle.lower()
+        lo = bisect.bisect_left(basenames, key)
+        hi = bisect.bisect_left(basenames, key + '\uffff', lo)
+        for pos in range(lo, hi):
+            idx = indexes[pos]
+            if (not case_sensitive or
+                    _basename(entries[idx]).startswith(needle)):
+                yield idx
+
+    def _substrings(self, needle, case_sensitive, cancelled=None):
+        """Generate the entries that contain needle
+
+        Full paths repeat their directories, so the much smaller tables
+        of last components and of directories are scanned instead.  A
+        needle without a slash can only match inside a single component.
+        A needle with a slash matches inside a directory's path, or ends
+        its last slash at the start of a basename in a directory that
+        ends with the rest of the needle.  A directory that matches
+        brings along everything below it.
+
+        """
+        paths, names, dirs = self._tables_for(case_sensitive)
+        if '/' not in needle:
+            for idx in names.find(needle, cancelled):
+                yield idx
+                if self.entries[idx] in self.dirs:
+                    for child in self._below(idx, '/', needle,
+                                             case_sensitive):
+                        yield child
+            return
+        if not self.dirs:
+            for idx in paths.find(needle, cancelled):
+                yield idx
+            return
+        dir_entries = self._dir_entries
+        for pos in dirs.find(needle, cancelled):
+            idx = dir_entries[pos]
+            yield idx
+            for child in self._below(idx, '/', needle, case_sensitive):
+                yield child
+        head, tail = needle.rsplit('/', 1)
+        if not head:
+            # Any basename that starts with the tail, below a directory
+            keys = self.keys
+            for idx in self._basename_prefixed(tail, case_sensitive):
+                if '/' in keys[idx]:
+                    yield idx
+            return
+        # The newline ends the paths of the directories that end with head
+        for pos in dirs.find(head + '\n', cancelled):
+            for child in self._below(dir_entries[pos], '/' + tail.lower(),
+                                     needle, case_sensitive):
+                yield child
+
+    def _below(self, idx, prefix, needle, case_sensitive):
+        """Generate the entries below a directory that start with prefix"""
+        keys = self.keys
+        entries = self.entries
+        key = keys[idx] + prefix
+        lo = bisect.bisect_left(keys, key, idx + 1)
+        hi = bisect.bisect_left(keys, key + '\uffff', lo)
+        for child in range(lo, hi):
+            # Directories may differ only by case
+            if not case_sensitive or needle in entries[child]:
+                yield child
+
+
+class TrackedPaths(object):
+    """The completion index of tracked files
+
+    The file list is re-read when the git index changes, and the index
+    is rebuilt when the list differs.  It is built by the thread that
+    asks for it, which is normally the completion widgets' background
+    thread.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._files = None
+        self._index = None
+
+    def get(self):
+        """Return an up-to-date CompletionIndex of the tracked files"""
+        path = git.current().git_path('index')
+        try:
+            st = core.stat(path)
+            key = (path, st.st_mtime, st.st_size)
+        except OSError:
+            key = (path, None, None)
+        with self._lock:
+            if self._index is None or key != self._key:
+                files = gitcmds.tracked_files()
+                if self._index is None or files != self._files:
+                    self._index = CompletionIndex(files, parents=True)
+                    self._files = files
+                self._key = key
+            return self._index
+
+
+@memoize
+def tracked_paths():
+    """Return the TrackedPaths singleton"""
+    return TrackedPaths()
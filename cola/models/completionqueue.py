@@ -0,0 +1,190 @@
+"""Hands completion queries from the line edits to a worker thread
+
+Every keystroke submits a query and bumps a generation number.  Only
+the newest query is kept, so keystrokes that arrive while the worker is
+busy are coalesced into one, and a query that is superseded while it
+runs is cancelled through its `cancelled` callback.  Results that come
+back for an older generation are dropped by the model.
+
+Each query's queue wait and run time is recorded in QueryStats.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import collections
+import threading
+import time
+
+from cola.models.completionindex import Cancelled
+
+# Number of recent queries whose latency is kept
+HISTORY = 50
+
+
+class Query(object):
+    """A completion request and its timings"""
+
+    def __init__(self, generation, match_text, full_text, case_sensitive):
+        self.generation = generation
+        self.match_text = match_text
+        self.full_text = full_text
+        self.case_sensitive = case_sensitive
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.coalesced = 0      # number of earlier queries this replaced
+        self.cancelled = False
+
+    @property
+    def wait_time(self):
+        """Seconds spent waiting for the worker"""
+        if self.started is None:
+            return 0.0
+        return self.started - self.submitted
+
+    @property
+    def run_time(self):
+        """Seconds spent gathering matches"""
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def latency(self):
+        """Seconds from the keystroke to the results"""
+        if self.finished is None:
+            return 0.0
+        return self.finished - self.submitted
+
+
+class QueryStats(object):
+    """Latency counters for the queries of a completion model"""
+
+    def __init__(self, history=HISTORY):
+        self.count = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        self.max_latency = 0.0
+        self.recent = collections.deque(maxlen=history)
+        self.last = None
+
+    def add(self, query):
+        self.count += 1
+        self.coalesced += query.coalesced
+        if query.cancelled:
+            self.cancelled += 1
+        else:
+            self.completed += 1
+            self.max_latency = max(self.max_latency, query.latency)
+            self.last = query
+            self.recent.append(query.latency)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+        if recent:
+            median = recent[len(recent) // 2]
+            p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+        else:
+            median = p95 = 0.0
+        last = self.last
+        return {
+            'count': self.count,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'coalesced': self.coalesced,
+            'max_latency': self.max_latency,
+            'median_latency': median,
+            'p95_latency': p95,
+            'last_latency': last and last.latency or 0.0,
+            'last_wait_time': last and last.wait_time or 0.0,
+            'last_run_time': last and last.run_time or 0.0,
+        }
+
+
+class QueryQueue(object):
+    """Holds the newest pending query for a single worker
+
+    `submit()` returns True when no worker is running and one must be
+    started.  The worker calls `take()` until it returns None, which
+    also marks the worker as stopped.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = None
+        self._working = False
+        self._stats = QueryStats()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def submit(self, match_text, full_text, case_sensitive):
+        """Queue a query, replacing any query that has not started"""
+        with self._lock:
+            self._generation += 1
+            query = Query(self._generation, match_text, full_text,
+                          case_sensitive)
+            pending = self._pending
+            if pending is not None:
+                query.coalesced = pending.coalesced + 1
+                query.submitted = pending.submitted
+            self._pending = query
+            start = not self._working
+            self._working = True
+            return start
+
+    def take(self):
+        """Return the next query to run, or None when the queue is idle"""
+        with self._lock:
+            query = self._pending
+            self._pending = None
+            if query is None:
+                self._working = False
+            else:
+                query.started = time.time()
+            return query
+
+    def cancel(self):
+        """Drop the pending query and cancel the running one"""
+        with self._lock:
+            self._generation += 1
+            self._pending = None
+
+    def is_current(self, generation):
+        """Return True when no newer query has been submitted"""
+        return generation == self._generation
+
+    def run(self, query, gather):
+        """Run `gather(query, cancelled)` and record the query's timings
+
+        Returns the matches, or None when the query was superseded.
+
+        """
+        def cancelled():
+            return query.generation != self._generation
+
+        try:
+            result = gather(query, cancelled)
+        except Cancelled:
+            result = None
+        query.finished = time.time()
+        if result is None or cancelled():
+            query.cancelled = True
+            result = None
+        with self._lock:
+            self._stats.add(query)
+        return result
+
+    def stats(self):
+        """Return a snapshot of the latency counters"""
+        with self._lock:
+            return self._stats.as_dict()
+
+    def last_query(self):
+        """Return the last query that completed, or None"""
+        with self._lock:
+            return self._stats.last
@@ -5,6 +5,8 @@ import subprocess
 from cola import core
 from cola import utils
 from cola.git import git
+from cola.models import dagcache
+from cola.models.dagcache import CommitCache
 from cola.observable import Observable
 
 # put summary at the end b/c it can contain
@@ -22,6 +24,22 @@ class CommitFactory(object):
         cls.commits.clear()
         cls.root_generation = 0
 
+    @classmethod
+    def new_from_record(cls, record, tags=''):
+        """Create a commit from a cached (sha1, parents, ...) record"""
+        sha1 = record[0]
+        try:
+            commit = cls.commits[sha1]
+            if not commit.parsed:
+                commit.set_record(record, tags)
+            cls.root_generation = max(commit.generation,
+                                      cls.root_generation)
+        except KeyError:
+            commit = Commit(sha1=sha1)
+            commit.set_record(record, tags)
+            cls.commits[sha1] = commit
+        return commit
+
     @classmethod
     def new(cls, sha1=None, log_entry=None):
         if not sha1 and log_entry:
@@ -117,10 +135,18 @@ class Commit(object):
             self.parse(log_entry)
 
     def parse(self, log_entry, sep=logsep):
-        self.sha1 = log_entry[:40]
+        sha1 = log_entry[:40]
         (parents, tags, author, authdate, email, summary) = \
                 log_entry[41:].split(sep, 5)
-
+        parents = parents and parents.split(' ') or []
+        record = (sha1, parents, author, authdate, email, summary)
+        return self.set_record(record, tags)
+
+    def set_record(self, record, tags=''):
+        """Initialize from a (sha1, parents, author, authdate, email,
+        summary) record and a "%d" decoration string"""
+        (sha1, parents, author, authdate, email, summary) = record
+        self.sha1 = sha1
         self.summary = summary and summary or ''
         self.author = author and author or ''
         self.authdate = authdate or ''
@@ -128,7 +154,7 @@ class Commit(object):
 
         if parents:
             generation = None
-            for parent_sha1 in parents.split(' '):
+            for parent_sha1 in parents:
                 parent = CommitFactory.new(sha1=parent_sha1)
                 parent.children.append(self)
                 if generation is None:
@@ -152,6 +178,11 @@ class Commit(object):
         self.parsed = True
         return self
 
+    def record(self):
+        """Return the cacheable (sha1, parents, ...) record"""
+        return (self.sha1, tuple([p.sha1 for p in self.parents]),
+                self.author, self.authdate, self.email, self.summary)
+
     def __str__(self):
         return self.sha1
 
@@ -176,15 +207,19 @@ class Commit(object):
 
 class RepoReader(object):
 
-    def __init__(self, dag, git=git):
+    def __init__(self, dag, git=git, use_cache=True, reverse=True):
         self.dag = dag
         self.git = git
+        # The cache holds complete oldest-first histories, which is
+        # not useful when streaming the newest commits first.
+        self.use_cache = use_cache and reverse
+        self._cache = None
         self._proc = None
         self._objects = {}
-        self._cmd = ['git', 'log',
-                     '--topo-order',
-                     '--reverse',
-                     '--pretty='+logfmt]
+        self._cmd = ['git', 'log', '--topo-order']
+        if reverse:
+            self._cmd.append('--reverse')
+        self._cmd.append('--pretty='+logfmt)
         self._cached = False
         """Indicates that all data has been read"""
         self._idx = -1
@@ -201,8 +236,11 @@ class RepoReader(object):
 
     def reset(self):
         CommitFactory.reset()
+        self._reset()
+
+    def _reset(self):
         if self._proc:
-            self._topo_list = []
+            self._topo_list = self._new_topo_list()
             self._proc.kill()
         self._proc = None
         self._cached = False
@@ -222,17 +260,11 @@ class RepoReader(object):
                 self._idx = -1
                 raise StopIteration
 
-        if self._proc is None:
-            ref_args = utils.shell_split(self.dag.ref)
-            cmd = self._cmd + ['-%d' % self.dag.count] + ref_args
-            self._proc = core.start_command(cmd)
-            self._topo_list = []
+        if self._proc is None and not self._start():
+            return self.next()
 
-        log_entry = core.readline(self._proc.stdout).rstrip()
-        if not log_entry:
-            self._cached = True
-            self._proc.wait()
-            self._proc = None
+        log_entry = self._read_entry()
+        if log_entry is None:
             raise StopIteration
 
         sha1 = log_entry[:40]
@@ -246,6 +278,62 @@ class RepoReader(object):
 
     __next__ = next # for Python 3
 
+    def _start(self):
+        """Start "git log", or return False when the cache was loaded"""
+        self._topo_list = self._new_topo_list()
+        if self._load_cache():
+            return False
+        ref_args = utils.shell_split(self.dag.ref)
+        cmd = self._cmd + ['-%d' % self.dag.count] + ref_args
+        self._proc = core.start_command(cmd)
+        return True
+
+    def _read_entry(self):
+        """Return the next "git log" entry or None when the log is done"""
+        log_entry = core.readline(self._proc.stdout).rstrip()
+        if log_entry:
+            return log_entry
+        self._cached = True
+        status = self._proc.wait()
+        self._proc = None
+        if status == 0:
+            self._save_cache()
+        return None
+
+    def _new_topo_list(self):
+        return []
+
+    def _add_record(self, record, tags):
+        commit = CommitFactory.new_from_record(record, tags)
+        self._objects[commit.sha1] = commit
+        self._topo_list.append(commit)
+
+    def _records(self):
+        return [c.record() for c in self._topo_list]
+
+    def _load_cache(self):
+        """Populate the commit list from the on-disk cache, if possible"""
+        self._cache = None
+        if not self.use_cache:
+            return False
+        cache = CommitCache(self.dag.ref, self.dag.count, git=self.git)
+        if not cache.resolve():
+            return False
+        self._cache = cache
+        records = cache.load()
+        if records is None:
+            return False
+        decorations = dagcache.decorations(git=self.git)
+        for record in records:
+            self._add_record(record, decorations.get(record[0], ''))
+        self._cached = True
+        self._idx = -1
+        return True
+
+    def _save_cache(self):
+        if self._cache is not None:
+            self._cache.save(self._records())
+
     def __getitem__(self, sha1):
         return self._objects[sha1]
 
@@ -0,0 +1,365 @@
+"""Persistent on-disk cache of parsed commit records for the DAG viewer
+
+Records are stored per (ref arguments, count) under .git/cola/dag/ along
+with the resolved ref tips that produced them.  Reopening the DAG for an
+unchanged history loads the file instead of running "git log".  When the
+old tips are ancestors of the new tips only the new commits are read
+from git and appended to the cached records.
+
+Decorations are not stored since refs move independently of history;
+they are read from a single "git log --no-walk" call instead.
+
+Only the MAX_FILES most recently used files are kept; the least
+recently used ones are deleted when a new file is saved.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import array
+import binascii
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from cola import core
+from cola import utils
+from cola.git import git
+from cola.git import STDOUT
+
+# %d (decorations) is not part of the cached format
+cachefmt = 'format:%H%x01%P%x01%an%x01%ad%x01%ae%x01%s'
+cachesep = chr(0x01)
+
+MAGIC = b'COLADAG1'
+VERSION = 1
+
+# Do not try to compute deltas over huge numbers of ref tips
+MAX_DELTA_TIPS = 256
+
+# Number of cache files kept in .git/cola/dag
+MAX_FILES = 32
+
+
+def _tobytes(arr):
+    try:
+        return arr.tobytes()
+    except AttributeError:  # Python 2
+        return arr.tostring()
+
+
+def _frombytes(arr, data):
+    try:
+        arr.frombytes(data)
+    except AttributeError:  # Python 2
+        arr.fromstring(data)
+
+
+def parse_record(log_entry, sep=cachesep):
+    """Parse a "cachefmt" log line into a record tuple
+
+    Records are (sha1, parents, author, authdate, email, summary).
+
+    """
+    sha1, parents, author, authdate, email, summary = log_entry.split(sep, 5)
+    parents = parents and tuple(parents.split(' ')) or ()
+    return (sha1, parents, author, authdate, email, summary)
+
+
+def pack_records(records, header):
+    """Serialize records into the compact cache format
+
+    The layout is mmap-friendly: a JSON header followed by a table of
+    raw 20-byte SHA-1s, CSR parent offsets and indices, string offsets
+    and a single utf-8 string blob.
+
+    """
+    shas = []
+    index = {}
+    for record in records:
+        index[record[0]] = len(shas)
+        shas.append(record[0])
+
+    parent_offsets = array.array('I', [0])
+    parent_indices = array.array('I')
+    for record in records:
+        for parent in record[1]:
+            idx = index.get(parent)
+            if idx is None:
+                # A parent outside of the truncated history
+                idx = index[parent] = len(shas)
+                shas.append(parent)
+            parent_indices.append(idx)
+        parent_offsets.append(len(parent_indices))
+
+    blob = bytearray()
+    string_offsets = array.array('I', [0])
+    for record in records:
+        for value in record[2:]:
+            blob.extend(core.encode(value))
+            string_offsets.append(len(blob))
+
+    header = dict(header)
+    header.update({
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'itemsize': parent_offsets.itemsize,
+        'records': len(records),
+        'shas': len(shas),
+        'parents': len(parent_indices),
+        'blob': len(blob),
+    })
+    header_data = core.encode(json.dumps(header, sort_keys=True))
+    sha_data = binascii.unhexlify(core.encode(''.join(shas)))
+    return b''.join([MAGIC,
+                     struct.pack('<I', len(header_data)),
+                     header_data,
+                     sha_data,
+                     _tobytes(parent_offsets),
+                     _tobytes(parent_indices),
+                     _tobytes(string_offsets),
+                     bytes(blob)])
+
+
+def unpack_header(data):
+    """Return (header, offset) or (None, 0) for unusable data"""
+    if not data.startswith(MAGIC):
+        return None, 0
+    offset = len(MAGIC)
+    try:
+        size = struct.unpack('<I', data[offset:offset+4])[0]
+        offset += 4
+        header = json.loads(core.decode(data[offset:offset+size]))
+    except (struct.error, ValueError):
+        return None, 0
+    if (type(header) is not dict or
+            header.get('version') != VERSION or
+            header.get('byteorder') != sys.byteorder or
+            header.get('itemsize') != array.array('I').itemsize):
+        return None, 0
+    return header, offset + size
+
+
+def unpack_records(data):
+    """Return (header, records) from packed data, or (None, None)"""
+    header, offset = unpack_header(data)
+    if header is None:
+        return None, None
+    try:
+        return header, _unpack_records(header, data, offset)
+    except (KeyError, IndexError, ValueError):
+        return None, None
+
+
+def _unpack_records(header, data, offset):
+    nrecords = header['records']
+    nshas = header['shas']
+    nparents = header['parents']
+    itemsize = header['itemsize']
+
+    sha_data = data[offset:offset + nshas*20]
+    offset += nshas*20
+    shas = core.decode(binascii.hexlify(sha_data))
+    shas = [shas[i:i+40] for i in range(0, nshas*40, 40)]
+
+    def read_array(count):
+        arr = array.array('I')
+        _frombytes(arr, data[read_array.offset:
+                             read_array.offset + count*itemsize])
+        read_array.offset += count*itemsize
+        if len(arr) != count:
+            raise ValueError('truncated cache')
+        return arr
+    read_array.offset = offset
+
+    parent_offsets = read_array(nrecords + 1)
+    parent_indices = read_array(nparents)
+    string_offsets = read_array(nrecords*4 + 1)
+    blob = data[read_array.offset:read_array.offset + header['blob']]
+    if len(blob) != header['blob']:
+        raise ValueError('truncated cache')
+
+    records = []
+    for idx in range(nrecords):
+        parents = tuple([shas[i] for i in
+                         parent_indices[parent_offsets[idx]:
+                                        parent_offsets[idx+1]]])
+        base = idx * 4
+        strings = [core.decode(blob[string_offsets[base+i]:
+                                    string_offsets[base+i+1]])
+                   for i in range(4)]
+        records.append((shas[idx], parents) + tuple(strings))
+    return records
+
+
+def decorations(git=git):
+    """Return a dict mapping SHA-1s to their "%d" decoration strings"""
+    out = git.log(no_walk='unsorted', all=True, no_color=True,
+                  format='%H%x01%d')[STDOUT]
+    result = {}
+    for line in out.splitlines():
+        sha1, sep, decoration = line.partition(cachesep)
+        if decoration:
+            result[sha1] = decoration
+    return result
+
+
+class CommitCache(object):
+    """Loads and stores the commit records for a DAG ref and count"""
+
+    def __init__(self, ref, count, git=git):
+        self.git = git
+        self.ref_args = utils.shell_split(ref)
+        self.count = count
+        self.tips = None
+        self.cacheable = False
+        self.incremental = False
+        digest = hashlib.sha1(core.encode('%d\0%s' % (count, ref)))
+        self.path = git.git_path('cola', 'dag', digest.hexdigest())
+
+    def resolve(self):
+        """Resolve the ref arguments into the tips used as the cache key
+
+        Flags such as --since or --author can depend on the current
+        time or configuration so they are never cached.  "--revs-only"
+        reports revision flags such as --since as "--max-age=<time>", so
+        its output must consist of object names only.  Path-limited
+        histories are cached but not updated incrementally.
+
+        """
+        self.tips = None
+        self.cacheable = False
+        self.incremental = False
+        status, out, err = self.git.rev_parse('--revs-only', *self.ref_args)
+        if status != 0 or not out:
+            return False
+        tips = out.splitlines()
+        if [tip for tip in tips if tip.startswith('-')]:
+            return False
+        status, extra, err = self.git.rev_parse('--no-revs', *self.ref_args)
+        if status != 0:
+            return False
+        extra = [arg for arg in extra.splitlines() if arg and arg != '--']
+        if [arg for arg in extra if arg.startswith('-')]:
+            return False
+        self.tips = sorted(set(tips))
+        self.cacheable = True
+        self.incremental = (not extra and
+                            len(self.tips) <= MAX_DELTA_TIPS and
+                            not [t for t in self.tips if t.startswith('^')])
+        return True
+
+    def read(self):
+        """Return (header, records) from disk or (None, None)"""
+        try:
+            with core.xopen(self.path, 'rb') as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return None, None
+        return unpack_records(data)
+
+    def load(self):
+        """Return cached records for the current tips or None
+
+        The tips must have been computed by resolve().
+
+        """
+        if not self.cacheable:
+            return None
+        header, records = self.read()
+        if header is None:
+            return None
+        old_tips = header.get('tips', [])
+        if old_tips == self.tips:
+            _touch(self.path)
+            return records
+        if not self.incremental or not header.get('incremental'):
+            return None
+        delta = self._read_delta(old_tips)
+        if delta is None:
+            return None
+        records = merge_records(records, delta, self.count)
+        self.save(records)
+        return records
+
+    def _read_delta(self, old_tips):
+        """Read the commits reachable from the new tips but not the old"""
+        # Rewritten history cannot be appended to
+        args = list(old_tips) + ['^' + tip for tip in self.tips]
+        status, out, err = self.git.rev_list('--count', *args)
+        if status != 0 or out.strip() != '0':
+            return None
+        args = list(self.tips) + ['^' + tip for tip in old_tips]
+        status, out, err = self.git.log('--topo-order', '--reverse',
+                                        '-%d' % self.count,
+                                        no_color=True, pretty=cachefmt,
+                                        *args)
+        if status != 0:
+            return None
+        return [parse_record(line) for line in out.splitlines() if line]
+
+    def save(self, records):
+        """Atomically write records for the current tips"""
+        if not self.cacheable:
+            return False
+        header = {
+            'tips': self.tips,
+            'count': self.count,
+            'incremental': self.incremental,
+        }
+        data = pack_records(records, header)
+        tmp_path = self.path + '.tmp'
+        try:
+            parent = os.path.dirname(self.path)
+            if not core.isdir(parent):
+                core.makedirs(parent)
+            with core.xopen(tmp_path, 'wb') as fh:
+                fh.write(data)
+            os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+        except (IOError, OSError):
+            return False
+        prune(parent, MAX_FILES)
+        return True
+
+
+def _touch(path):
+    """Mark a cache file as recently used"""
+    try:
+        os.utime(core.mkpath(path), None)
+    except (IOError, OSError):
+        pass
+
+
+def prune(directory, keep):
+    """Delete all but the `keep` most recently used files in directory"""
+    try:
+        names = [core.decode(name)
+                 for name in os.listdir(core.mkpath(directory))]
+    except (IOError, OSError):
+        return
+    if len(names) <= keep:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            entries.append((core.stat(path).st_mtime, path))
+        except (IOError, OSError):
+            continue
+    entries.sort(reverse=True)
+    for mtime, path in entries[keep:]:
+        try:
+            core.unlink(path)
+        except (IOError, OSError):
+            pass
+
+
+def merge_records(records, delta, count):
+    """Append new records to cached records and keep the newest `count`"""
+    seen = set([record[0] for record in records])
+    merged = list(records)
+    merged.extend([record for record in delta if record[0] not in seen])
+    if count > 0 and len(merged) > count:
+        merged = merged[-count:]
+    return merged
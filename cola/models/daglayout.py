@@ -0,0 +1,155 @@
+"""Layout engines for the DAG graph view
+
+Layout engines receive commits oldest-first, in batches as they are
+read by RepoReader, and return the (x, y) scene position of each new
+commit.  Engines keep their state between batches so that batches can
+be appended incrementally.
+
+GenerationLayout is the original algorithm: commits are placed by
+generation number and every fork shifts all generations up to its
+newest child to the right.  This is quadratic on long-lived branches.
+
+LaneLayout assigns each commit to a lane like "git log --graph" does:
+a commit continues the lane of its first parent when that lane is still
+open, merged-in lanes are closed, and closed lanes are reused.  Each
+commit costs O(parents) plus a heap operation when a lane is opened.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import collections
+import heapq
+
+
+class GenerationLayout(object):
+    """Places commits by generation, shifting forks to the right"""
+
+    def __init__(self, x_off, y_off):
+        self.x_off = x_off
+        self.y_off = y_off
+        self.reset()
+
+    def reset(self):
+        self.x_max = 0
+        self.y_min = 0
+        self.x_offsets = collections.defaultdict(int)
+
+    def append(self, nodes):
+        positions = {}
+
+        x_max = self.x_max
+        y_min = self.y_min
+        x_off = self.x_off
+        y_off = self.y_off
+        x_offsets = self.x_offsets
+
+        for node in nodes:
+            generation = node.generation
+            sha1 = node.sha1
+
+            if node.is_fork():
+                # This is a fan-out so sweep over child generations and
+                # shift them to the right to avoid overlapping edges
+                child_gens = [c.generation for c in node.children]
+                maxgen = max(child_gens)
+                for g in range(generation + 1, maxgen):
+                    x_offsets[g] += x_off
+
+            parents = node.parents
+            if len(parents) == 1:
+                # Align nodes relative to their parents
+                parent_gen = parents[0].generation
+                parent_off = x_offsets[parent_gen]
+                x_offsets[generation] = max(parent_off-x_off,
+                                            x_offsets[generation])
+
+            cur_xoff = x_offsets[generation]
+            next_xoff = cur_xoff
+            next_xoff += x_off
+            x_offsets[generation] = next_xoff
+
+            x_pos = cur_xoff
+            y_pos = -generation * y_off
+
+            y_pos = min(y_pos, y_min - y_off)
+
+            positions[sha1] = (x_pos, y_pos)
+
+            x_max = max(x_max, x_pos)
+            y_min = y_pos
+
+        self.x_max = x_max
+        self.y_min = y_min
+
+        return positions
+
+
+class LaneLayout(object):
+    """Places commits one per row in reusable lanes"""
+
+    def __init__(self, x_off, y_off):
+        self.x_off = x_off
+        self.y_off = y_off
+        self.reset()
+
+    def reset(self):
+        self.x_max = 0
+        self.y_min = 0
+        self.width = 0
+        self._tips = {}     # sha1 -> lane for commits whose lane is open
+        self._free = []     # heap of closed lanes
+
+    def _open_lane(self):
+        if self._free:
+            return heapq.heappop(self._free)
+        lane = self.width
+        self.width += 1
+        return lane
+
+    def append(self, nodes):
+        positions = {}
+
+        tips = self._tips
+        free = self._free
+        x_off = self.x_off
+        y_off = self.y_off
+        x_max = self.x_max
+        y_min = self.y_min
+
+        for node in nodes:
+            parents = node.parents
+            lane = None
+            if parents:
+                lane = tips.pop(parents[0].sha1, None)
+                # Branches merged into this commit end here
+                for parent in parents[1:]:
+                    merged = tips.pop(parent.sha1, None)
+                    if merged is not None:
+                        heapq.heappush(free, merged)
+            if lane is None:
+                lane = self._open_lane()
+            sha1 = node.sha1
+            tips[sha1] = lane
+
+            x_pos = lane * x_off
+            y_pos = y_min - y_off
+            positions[sha1] = (x_pos, y_pos)
+
+            x_max = max(x_max, x_pos)
+            y_min = y_pos
+
+        self.x_max = x_max
+        self.y_min = y_min
+
+        return positions
+
+
+LAYOUTS = {
+    'generation': GenerationLayout,
+    'lanes': LaneLayout,
+}
+
+
+def new_layout(name, x_off, y_off):
+    """Create a layout engine by name"""
+    return LAYOUTS[name](x_off, y_off)
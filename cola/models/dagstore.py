@@ -0,0 +1,398 @@
+"""Compact, column-oriented storage for DAG commits
+
+CommitStore holds the same information as dag.Commit/CommitFactory but
+keeps it in flat arrays indexed by integer commit ids instead of one
+Python object per commit:
+
+* SHA-1s are packed as raw 20-byte strings in a single bytearray.
+* Parents are stored CSR-style: per-commit offset pairs into a shared
+  array of parent ids.
+* Children are stored as an array-backed linked list of edges so that
+  appending commits never has to rebuild the adjacency.
+* Author names and emails are interned into shared string tables.
+* Dates and summaries are kept utf-8 encoded in a single blob and only
+  decoded when they are accessed.
+
+StoredCommit is a small proxy that exposes the dag.Commit attributes
+used by the DAG widgets on top of a CommitStore.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import array
+import binascii
+
+from cola import core
+from cola.models.dag import RepoReader
+from cola.models.dag import logsep
+
+
+def _pack_sha1(sha1):
+    return binascii.unhexlify(core.encode(sha1))
+
+
+def _parse_tags(tags):
+    """Parse a "%d" decoration string into a tuple of ref names"""
+    result = []
+    for tag in tags[2:-1].split(', '):
+        if tag.startswith('tag: '):
+            tag = tag[5:] # tag: refs/
+        elif tag.startswith('refs/remotes/'):
+            tag = tag[13:] # refs/remotes/
+        elif tag.startswith('refs/heads/'):
+            tag = tag[11:] # refs/heads/
+        if tag.endswith('/HEAD'):
+            continue
+        if tag not in result:
+            result.append(tag)
+    return tuple(result)
+
+
+class StringTable(object):
+    """Interns strings and maps them to small integers"""
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, value):
+        try:
+            return self.index[value]
+        except KeyError:
+            idx = self.index[value] = len(self.strings)
+            self.strings.append(value)
+            return idx
+
+    def get(self, idx):
+        return self.strings[idx]
+
+    def clear(self):
+        self.strings = []
+        self.index = {}
+
+
+class CommitStore(object):
+    """Columnar storage for commits read by RepoReader"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.root_generation = 0
+        self._index = {}
+        self._sha1s = bytearray()
+        self._parsed = bytearray()
+        self._generation = array.array('i')
+        # Parents: [parent_start[id], parent_end[id]) in parent_ids
+        self._parent_start = array.array('I')
+        self._parent_end = array.array('I')
+        self._parent_ids = array.array('I')
+        # Children: edge lists threaded through child_next
+        self._child_head = array.array('i')
+        self._child_ids = array.array('I')
+        self._child_next = array.array('i')
+        # Strings
+        self._names = StringTable()
+        self._author = array.array('I')
+        self._email = array.array('I')
+        self._text = bytearray()
+        self._text_offsets = array.array('I')
+        self._tags = {}
+
+    def __len__(self):
+        return len(self._generation)
+
+    def __contains__(self, sha1):
+        return self.lookup(sha1) is not None
+
+    def lookup(self, sha1):
+        """Return the id for a SHA-1 or None"""
+        try:
+            return self._index.get(_pack_sha1(sha1))
+        except (TypeError, ValueError):
+            return None
+
+    def _allocate(self, sha1, generation):
+        commit_id = len(self._generation)
+        self._index[_pack_sha1(sha1)] = commit_id
+        self._sha1s.extend(_pack_sha1(sha1))
+        self._parsed.append(0)
+        self._generation.append(generation)
+        self._parent_start.append(0)
+        self._parent_end.append(0)
+        self._child_head.append(-1)
+        self._author.append(0)
+        self._email.append(0)
+        self._text_offsets.extend((0, 0, 0))
+        return commit_id
+
+    def _placeholder(self, sha1):
+        """Return the id for a SHA-1, allocating an unparsed commit"""
+        commit_id = self.lookup(sha1)
+        if commit_id is None:
+            self.root_generation += 1
+            commit_id = self._allocate(sha1, self.root_generation)
+        return commit_id
+
+    def add_log_entry(self, log_entry, sep=logsep):
+        """Add a commit from a dag.logfmt "git log" entry"""
+        sha1 = log_entry[:40]
+        (parents, tags, author, authdate, email, summary) = \
+                log_entry[41:].split(sep, 5)
+        parents = parents and parents.split(' ') or []
+        record = (sha1, parents, author, authdate, email, summary)
+        return self.add_record(record, tags)
+
+    def add_record(self, record, tags=''):
+        """Add a commit from a (sha1, parents, ...) record
+
+        Returns the integer id of the commit.
+
+        """
+        sha1 = record[0]
+        commit_id = self.lookup(sha1)
+        if commit_id is None:
+            commit_id = self._allocate(sha1, self.root_generation)
+            self._set_record(commit_id, record, tags)
+        else:
+            if not self._parsed[commit_id]:
+                self._set_record(commit_id, record, tags)
+            self.root_generation = max(self._generation[commit_id],
+                                       self.root_generation)
+        return commit_id
+
+    def _set_record(self, commit_id, record, tags):
+        (sha1, parents, author, authdate, email, summary) = record
+
+        if parents:
+            generation = None
+            start = len(self._parent_ids)
+            for parent_sha1 in parents:
+                parent_id = self._placeholder(parent_sha1)
+                self._parent_ids.append(parent_id)
+                self._add_child(parent_id, commit_id)
+                parent_gen = self._generation[parent_id] + 1
+                if generation is None or parent_gen > generation:
+                    generation = parent_gen
+            self._parent_start[commit_id] = start
+            self._parent_end[commit_id] = len(self._parent_ids)
+            self._generation[commit_id] = generation
+
+        self._author[commit_id] = self._names.intern(author or '')
+        self._email[commit_id] = self._names.intern(email or '')
+
+        text = self._text
+        offset = commit_id * 3
+        self._text_offsets[offset] = len(text)
+        text.extend(core.encode(authdate or ''))
+        self._text_offsets[offset+1] = len(text)
+        text.extend(core.encode(summary or ''))
+        self._text_offsets[offset+2] = len(text)
+
+        if tags:
+            self._tags[commit_id] = _parse_tags(tags)
+        self._parsed[commit_id] = 1
+
+    def _add_child(self, parent_id, child_id):
+        self._child_ids.append(child_id)
+        self._child_next.append(self._child_head[parent_id])
+        self._child_head[parent_id] = len(self._child_ids) - 1
+
+    # Column accessors
+    def commit(self, commit_id):
+        return StoredCommit(self, commit_id)
+
+    def sha1(self, commit_id):
+        offset = commit_id * 20
+        raw = bytes(self._sha1s[offset:offset+20])
+        return core.decode(binascii.hexlify(raw))
+
+    def parsed(self, commit_id):
+        return bool(self._parsed[commit_id])
+
+    def generation(self, commit_id):
+        return self._generation[commit_id]
+
+    def parent_ids(self, commit_id):
+        start = self._parent_start[commit_id]
+        end = self._parent_end[commit_id]
+        return self._parent_ids[start:end].tolist()
+
+    def child_ids(self, commit_id):
+        """Return child ids in the order the children were added"""
+        result = []
+        edge = self._child_head[commit_id]
+        while edge >= 0:
+            result.append(self._child_ids[edge])
+            edge = self._child_next[edge]
+        result.reverse()
+        return result
+
+    def child_count(self, commit_id):
+        count = 0
+        edge = self._child_head[commit_id]
+        while edge >= 0:
+            count += 1
+            edge = self._child_next[edge]
+        return count
+
+    def author(self, commit_id):
+        return self._names.get(self._author[commit_id])
+
+    def email(self, commit_id):
+        return self._names.get(self._email[commit_id])
+
+    def _text_field(self, commit_id, field):
+        offset = commit_id * 3 + field
+        start = self._text_offsets[offset]
+        end = self._text_offsets[offset+1]
+        return core.decode(bytes(self._text[start:end]))
+
+    def authdate(self, commit_id):
+        return self._text_field(commit_id, 0)
+
+    def summary(self, commit_id):
+        return self._text_field(commit_id, 1)
+
+    def tags(self, commit_id):
+        return self._tags.get(commit_id, ())
+
+    def record(self, commit_id):
+        """Return the cacheable (sha1, parents, ...) record"""
+        return (self.sha1(commit_id),
+                tuple([self.sha1(i) for i in self.parent_ids(commit_id)]),
+                self.author(commit_id),
+                self.authdate(commit_id),
+                self.email(commit_id),
+                self.summary(commit_id))
+
+
+class StoredCommit(object):
+    """A lightweight dag.Commit-like view of a commit in a CommitStore"""
+
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, commit_id):
+        self.store = store
+        self.id = commit_id
+
+    sha1 = property(lambda self: self.store.sha1(self.id))
+    summary = property(lambda self: self.store.summary(self.id))
+    author = property(lambda self: self.store.author(self.id))
+    authdate = property(lambda self: self.store.authdate(self.id))
+    email = property(lambda self: self.store.email(self.id))
+    generation = property(lambda self: self.store.generation(self.id))
+    parsed = property(lambda self: self.store.parsed(self.id))
+    tags = property(lambda self: self.store.tags(self.id))
+
+    @property
+    def parents(self):
+        store = self.store
+        return [StoredCommit(store, i) for i in store.parent_ids(self.id)]
+
+    @property
+    def children(self):
+        store = self.store
+        return [StoredCommit(store, i) for i in store.child_ids(self.id)]
+
+    def record(self):
+        return self.store.record(self.id)
+
+    def is_fork(self):
+        ''' Returns True if the node is a fork'''
+        return self.store.child_count(self.id) > 1
+
+    def is_merge(self):
+        ''' Returns True if the node is a merge'''
+        store = self.store
+        return store._parent_end[self.id] - store._parent_start[self.id] > 1
+
+    def __eq__(self, other):
+        return (isinstance(other, StoredCommit) and
+                other.store is self.store and other.id == self.id)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.sha1
+
+    def __repr__(self):
+        return ("{\n"
+                "  sha1: " + self.sha1 + "\n"
+                "  summary: " + self.summary + "\n"
+                "  author: " + self.author + "\n"
+                "  authdate: " + self.authdate + "\n"
+                "  parents: [" + ', '.join([p.sha1 for p in self.parents]) + "]\n"
+                "  tags: [" + ', '.join(self.tags) + "]\n"
+                "}")
+
+
+class StoreReader(RepoReader):
+    """A RepoReader that keeps commits in a CommitStore
+
+    Iteration yields StoredCommit objects; the reader itself only keeps
+    an array of commit ids in topological order.
+
+    """
+
+    def __init__(self, dag, store=None, **kwargs):
+        RepoReader.__init__(self, dag, **kwargs)
+        if store is None:
+            store = CommitStore()
+        self.store = store
+        self._topo_list = self._new_topo_list()
+
+    def reset(self):
+        self.store.reset()
+        self._reset()
+
+    def next(self):
+        store = self.store
+        if self._cached:
+            self._idx += 1
+            if self._idx < len(self._topo_list):
+                return store.commit(self._topo_list[self._idx])
+            self._idx = -1
+            raise StopIteration
+
+        if self._proc is None and not self._start():
+            return self.next()
+
+        log_entry = self._read_entry()
+        if log_entry is None:
+            raise StopIteration
+
+        commit_id = store.lookup(log_entry[:40])
+        if commit_id is None or not store.parsed(commit_id):
+            commit_id = store.add_log_entry(log_entry)
+            self._topo_list.append(commit_id)
+        return store.commit(commit_id)
+
+    __next__ = next # for Python 3
+
+    def _new_topo_list(self):
+        return array.array('I')
+
+    def _add_record(self, record, tags):
+        self._topo_list.append(self.store.add_record(record, tags))
+
+    def _records(self):
+        store = self.store
+        return [store.record(i) for i in self._topo_list]
+
+    def __getitem__(self, sha1):
+        commit_id = self.store.lookup(sha1)
+        if commit_id is None:
+            raise KeyError(sha1)
+        return self.store.commit(commit_id)
+
+    def items(self):
+        store = self.store
+        return [(store.sha1(i), store.commit(i)) for i in self._topo_list]
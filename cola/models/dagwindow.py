@@ -0,0 +1,163 @@
+"""Row-based model for streaming, virtualized DAG views
+
+A streamed history arrives newest-first from "git log --topo-order", so
+each commit is assigned to a row in the order it is read.  RowGraph
+assigns each row a lane, like "git log --graph", and records the line
+segments drawn between a row and the row below it.  Rows only depend on
+the rows above them so the graph can be extended as more history is
+paged in.
+
+RowWindow tracks which rows have graphics items so that views can
+create items for the rows near the viewport and recycle the rest.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import array
+import heapq
+
+
+class RowGraph(object):
+    """Incrementally assigns newest-first commits to rows and lanes
+
+    Commits are identified by any hashable key, typically the integer
+    ids from a CommitStore.  Appending a row costs O(parents + active
+    lanes).
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.width = 0
+        self._lanes = []        # key expected in each lane, or None
+        self._expected = {}     # key -> lanes expecting it
+        self._free = []         # heap of free lanes
+        self._lane = array.array('H')
+        self._seg_offsets = array.array('I', [0])
+        self._segments = array.array('H')
+        self._pending = None    # (row, [(source, lane)]) for the last row
+
+    def __len__(self):
+        return len(self._lane)
+
+    def lane(self, row):
+        """Return the lane for a row"""
+        return self._lane[row]
+
+    def segments(self, row):
+        """Return the (source, target) lanes linking a row to the next
+
+        The segments for the last row are provisional: each lane is
+        continued straight down until the next row is known.
+
+        """
+        if row + 1 < len(self._seg_offsets):
+            start = self._seg_offsets[row]
+            end = self._seg_offsets[row+1]
+            segments = self._segments[start:end]
+            return [(segments[i], segments[i+1])
+                    for i in range(0, len(segments), 2)]
+        if self._pending is not None and self._pending[0] == row:
+            return [(source, lane) for (source, lane) in self._pending[1]]
+        return []
+
+    def _alloc(self):
+        if self._free:
+            return heapq.heappop(self._free)
+        lane = len(self._lanes)
+        self._lanes.append(None)
+        self.width = len(self._lanes)
+        return lane
+
+    def _release(self, lane):
+        self._lanes[lane] = None
+        heapq.heappush(self._free, lane)
+
+    def _expect(self, lane, key):
+        self._lanes[lane] = key
+        self._expected.setdefault(key, []).append(lane)
+
+    def append(self, key, parents):
+        """Add the next (older) commit and return its row"""
+        row = len(self._lane)
+
+        waiting = self._expected.pop(key, None)
+        if waiting:
+            lane = min(waiting)
+            for other in waiting:
+                if other != lane:
+                    self._release(other)
+        else:
+            lane = self._alloc()
+        self._finish_pending(key, lane, waiting or ())
+
+        # Lanes passing by this row keep going straight down
+        pending = [(idx, idx) for (idx, expected) in enumerate(self._lanes)
+                   if expected is not None and idx != lane]
+
+        self._lanes[lane] = None
+        for idx, parent in enumerate(parents):
+            existing = self._expected.get(parent)
+            if existing:
+                target = existing[0]
+            elif idx == 0:
+                target = lane
+                self._expect(lane, parent)
+            else:
+                target = self._alloc()
+                self._expect(target, parent)
+            pending.append((lane, target))
+        if self._lanes[lane] is None:
+            heapq.heappush(self._free, lane)
+
+        self._lane.append(lane)
+        self._pending = (row, pending)
+        return row
+
+    def _finish_pending(self, key, lane, waiting):
+        """Resolve the segments of the previous row now that its
+        successor's lane is known"""
+        if self._pending is None:
+            return
+        segments = self._segments
+        for source, target in self._pending[1]:
+            if target in waiting:
+                target = lane
+            segments.append(source)
+            segments.append(target)
+        self._seg_offsets.append(len(segments))
+        self._pending = None
+
+
+class RowWindow(object):
+    """Tracks the range of rows that have graphics items"""
+
+    def __init__(self):
+        self.start = 0
+        self.stop = 0
+
+    def reset(self):
+        self.start = 0
+        self.stop = 0
+
+    def update(self, start, stop):
+        """Move the window and return (released, added) row ranges"""
+        start = max(0, start)
+        stop = max(start, stop)
+        old = set(range(self.start, self.stop))
+        new = set(range(start, stop))
+        self.start = start
+        self.stop = stop
+        return sorted(old - new), sorted(new - old)
+
+    def __contains__(self, row):
+        return self.start <= row < self.stop
+
+
+def visible_rows(top, bottom, row_height, margin=0):
+    """Return the (start, stop) rows between two y coordinates"""
+    start = int(top // row_height) - margin
+    stop = int(bottom // row_height) + 1 + margin
+    return max(0, start), max(0, stop)
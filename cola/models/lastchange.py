@@ -0,0 +1,233 @@
+"""Bulk lookups of the last commit that changed each path
+
+The worktree browser shows the date, summary and author of the last
+commit that touched every visible file.  Instead of running
+"git log -1 -- <path>" for every path, LastChange walks the history of
+a whole directory once with "git log --name-only" and resolves all of
+the directory's entries in a single pass.  The walk stops as soon as
+every entry has been seen, or after WALK_LIMIT commits, after which the
+few remaining entries are looked up individually.
+
+Results are cached until HEAD changes.  The commit timestamp is cached
+rather than git's relative date, which would drift as time passes;
+get() formats the relative date when it is called.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import os
+import threading
+
+from cola import core
+from cola import utils
+from cola.decorators import memoize
+from cola.git import git
+from cola.models.searchindex import relative_date
+
+# Headers are prefixed with \x01 to tell them apart from paths in the
+# NUL-separated "git log --name-only -z" output.
+infofmt = '%at%x01%s%x01%an'
+logfmt = '%x01' + infofmt
+logsep = chr(0x01)
+
+
+# Commits scanned by the bulk walk of a directory.  Entries that have not
+# been seen by then are looked up one at a time with "git log -1".
+WALK_LIMIT = 2000
+
+
+@memoize
+def current():
+    """Return the LastChange singleton"""
+    return LastChange()
+
+
+class LastChange(object):
+    """Caches the (date, message, author) of the last change to paths
+
+    get() may be called from several threads.  Each directory is walked
+    by a single thread while the others wait for its results; walks of
+    different directories run concurrently.
+
+    """
+
+    def __init__(self, git=git):
+        self.git = git
+        ## Protects the cached state, but is never held while git runs
+        self._lock = threading.Lock()
+        self._head_key = None
+        self.reset()
+
+    def reset(self):
+        self._head = None
+        self._info = {}
+        self._resolved = set()
+        ## Events for the directories that are being walked
+        self._pending = {}
+
+    def get(self, path):
+        """Return (date, message, author) for a path, or None
+
+        The date is relative to the current time, e.g. "2 hours ago".
+        None is returned for paths that are not part of HEAD's history,
+        e.g. untracked files.
+
+        """
+        directory = utils.dirname(path)
+        self._check_head()
+        while True:
+            with self._lock:
+                head = self._head
+                if head is None or directory in self._resolved:
+                    return _display(self._info.get(path))
+                event = self._pending.get(directory)
+                if event is None:
+                    event = self._pending[directory] = threading.Event()
+                    known = set(self._info)
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                event.wait()
+                continue
+            info = {}
+            try:
+                info = self._walk(head, directory, known)
+            finally:
+                with self._lock:
+                    if self._head == head:
+                        for key, value in info.items():
+                            self._info.setdefault(key, value)
+                        self._resolved.add(directory)
+                    if self._pending.get(directory) is event:
+                        del self._pending[directory]
+                event.set()
+
+    def _check_head(self):
+        """Discard cached results when HEAD has changed"""
+        key = self._stat_head()
+        with self._lock:
+            if key is not None and key == self._head_key:
+                return
+        status, out, err = self.git.rev_parse('HEAD', verify=True)
+        head = status == 0 and out.strip() or None
+        with self._lock:
+            if head != self._head:
+                self.reset()
+                self._head = head
+            self._head_key = key
+
+    def _stat_head(self):
+        """Return a key that changes whenever HEAD may have moved"""
+        git_path = self.git.git_path
+        head = git_path('HEAD')
+        try:
+            key = [core.stat(head).st_mtime]
+            data = core.read(head).strip()
+        except (IOError, OSError):
+            return None
+        paths = [git_path('packed-refs')]
+        if data.startswith('ref: '):
+            paths.append(git_path(data[5:]))
+        for path in paths:
+            try:
+                key.append(core.stat(path).st_mtime)
+            except OSError:
+                key.append(None)
+        return tuple(key)
+
+    def _children(self, head, directory):
+        """Return the entries of a directory in HEAD"""
+        args = ['-z', '--name-only', head]
+        if directory:
+            args.extend(['--', directory + '/'])
+        status, out, err = self.git.ls_tree(*args)
+        if status != 0:
+            return set()
+        return set([path for path in out.split('\0') if path])
+
+    def _walk(self, head, directory, known):
+        """Resolve every entry of a directory and return {path: info}
+
+        A single bounded "git log" resolves most entries.  Rename
+        detection is skipped since only the names in HEAD are wanted.
+
+        """
+        info = {}
+        wanted = set([p for p in self._children(head, directory)
+                      if p not in known])
+        if not wanted:
+            return info
+        prefix = directory and directory + '/' or ''
+        cmd = ['git', 'log', '--name-only', '-z', '--no-color',
+               '--max-count=%d' % WALK_LIMIT, '--format=' + logfmt,
+               head, '--']
+        if prefix:
+            cmd.append(prefix)
+
+        proc = core.start_command(cmd)
+        fd = proc.stdout.fileno()
+        header = None
+        remainder = b''
+        try:
+            while wanted:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                tokens = (remainder + data).split(b'\0')
+                remainder = tokens.pop()
+                for token in tokens:
+                    if token.startswith(b'\x01'):
+                        header = _parse_info(core.decode(token[1:]))
+                        continue
+                    path = core.decode(token.lstrip(b'\n'))
+                    if header is None or not path.startswith(prefix):
+                        continue
+                    self._record(info, path, prefix, header, wanted)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+        # Entries that were last changed before the walk limit
+        for path in sorted(wanted):
+            header = self._last_change(head, path)
+            if header is not None:
+                info[path] = header
+        return info
+
+    def _last_change(self, head, path):
+        """Return the last change to a single path, or None"""
+        status, out, err = self.git.log('-1', '--no-color',
+                                        '--format=' + infofmt,
+                                        head, '--', path)
+        if status != 0 or not out:
+            return None
+        return _parse_info(out.rstrip('\n'))
+
+    def _record(self, info, path, prefix, header, wanted):
+        """Record a change to path and to its parents below prefix"""
+        while len(path) > len(prefix):
+            if path not in info:
+                info[path] = header
+                wanted.discard(path)
+            path = utils.dirname(path)
+
+
+def _parse_info(text):
+    """Parse an "infofmt" header into (timestamp, message, author)"""
+    timestamp, message, author = text.split(logsep, 2)
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        timestamp = 0
+    return (timestamp, message, author)
+
+
+def _display(info):
+    """Return (date, message, author) with a relative date, or None"""
+    if info is None:
+        return None
+    timestamp, message, author = info
+    return (relative_date(timestamp), message, author)
@@ -8,7 +8,10 @@ import copy
 
 from cola import core
 from cola import git
+from cola import gitcfg
 from cola import gitcmds
+from cola import utils
+from cola.diffparse import DiffIndex
 from cola.git import STDOUT
 from cola.observable import Observable
 from cola.decorators import memoize
@@ -29,6 +32,7 @@ class MainModel(Observable):
     # Observable messages
     message_about_to_update = 'about_to_update'
     message_commit_message_changed = 'commit_message_changed'
+    message_diff_stream = 'diff_stream'
     message_diff_text_changed = 'diff_text_changed'
     message_directory_changed = 'directory_changed'
     message_filename_changed = 'filename_changed'
@@ -66,6 +70,7 @@ class MainModel(Observable):
 
         self.head = 'HEAD'
         self.diff_text = ''
+        self._diff_index = None
         self.mode = self.mode_none
         self.filename = None
         self.is_merging = False
@@ -85,6 +90,8 @@ class MainModel(Observable):
         self.staged_deleted = set()
         self.unstaged_deleted = set()
         self.submodules = set()
+        # Incremented whenever the file lists above are replaced
+        self.status_version = 0
 
         self.local_branches = []
         self.remote_branches = []
@@ -127,10 +134,27 @@ class MainModel(Observable):
         except:
             pass
 
+    def diff_index(self):
+        """Return the DiffIndex of the current diff text
+
+        The index is built once per diff and shared by everything that
+        maps lines of the diff, e.g. partial staging.
+
+        """
+        index = self._diff_index
+        if index is None or index.text is not self.diff_text:
+            index = self._diff_index = DiffIndex(self.diff_text)
+        return index
+
     def set_diff_text(self, txt):
         self.diff_text = txt
         self.notify_observers(self.message_diff_text_changed, txt)
 
+    def stream_diff(self, command, encoding, deleted=False):
+        """Ask the diff viewer to read a huge diff from a command"""
+        self.notify_observers(self.message_diff_stream,
+                              command, encoding, deleted)
+
     def set_directory(self, path):
         self.directory = path
         self.notify_observers(self.message_directory_changed, path)
@@ -184,12 +208,104 @@ class MainModel(Observable):
         self._update_branch_heads()
         self.notify_observers(self.message_updated)
 
+    def update_paths_status(self, paths):
+        """Rescan a set of paths and merge the result into the file lists
+
+        Paths that are not mentioned keep their current state, so the
+        cost scales with the number of changed paths.  Falls back to a
+        full update_file_status() when a path filter is active.
+
+        """
+        if not paths or self.filter_paths:
+            self.update_file_status()
+            return
+        self.notify_observers(self.message_about_to_update)
+        self._update_paths(paths)
+        self.notify_observers(self.message_updated)
+
+    def update_changes(self, head=False, index=False, merge=False,
+                       refs=None, paths=None):
+        """Apply the narrowest updates for a set of repository changes
+
+        :param head: HEAD changed, e.g. a branch switch.
+        :param index: the index changed.
+        :param merge: a merge or rebase started or finished.
+        :param refs: set of changed refs, e.g. "refs/heads/master",
+                     or "packed-refs".
+        :param paths: set of changed worktree paths.
+
+        """
+        refs = refs or set()
+        paths = paths or set()
+        if not (head or index or merge or refs or paths):
+            return
+        self.notify_observers(self.message_about_to_update)
+        if merge:
+            self._update_merge_rebase_status()
+        if refs:
+            self._update_branches_and_tags()
+        if head:
+            self._update_branch_heads()
+
+        # Moving the current branch, e.g. a commit from the terminal,
+        # changes what is staged relative to HEAD.
+        current_ref = 'refs/heads/' + self.currentbranch
+        head_moved = (head or current_ref in refs or 'packed-refs' in refs)
+        if head_moved or index or (paths and self.filter_paths):
+            self._update_files()
+        else:
+            # Fetching moves the tracked branch, which changes what
+            # differs upstream but not the worktree.
+            if refs and self._upstream_moved(refs):
+                self._update_upstream()
+            if paths:
+                self._update_paths(paths)
+        self.notify_observers(self.message_updated)
+
+    def _upstream_moved(self, refs):
+        if 'packed-refs' in refs:
+            return True
+        tracked = gitcmds.tracked_branch(self.currentbranch)
+        return bool(tracked) and ('refs/remotes/' + tracked) in refs
+
+    def _update_upstream(self):
+        self.upstream_changed = sorted(gitcmds.diff_upstream(self.head))
+        self.status_version += 1
+
     def _update_files(self, update_index=False):
         display_untracked = prefs.display_untracked()
         state = gitcmds.worktree_state(head=self.head,
                                        update_index=update_index,
                                        display_untracked=display_untracked,
                                        paths=self.filter_paths)
+        self._set_files(state)
+
+    def _update_paths(self, paths):
+        if '.' in paths:
+            self._update_files()
+            return
+        paths = sorted(set(paths))
+        display_untracked = prefs.display_untracked()
+        state = gitcmds.worktree_state(head=self.head,
+                                       display_untracked=display_untracked,
+                                       paths=paths,
+                                       upstream=False)
+        # Changes in the worktree do not affect the upstream changes
+        state['upstream_changed'] = self.upstream_changed
+
+        scope = set(paths)
+        for key in ('staged', 'modified', 'unmerged', 'untracked'):
+            old = set([p for p in getattr(self, key)
+                       if not _in_scope(p, scope)])
+            state[key] = sorted(old.union(state.get(key, [])))
+        for key in ('staged_deleted', 'unstaged_deleted', 'submodules'):
+            old = set([p for p in getattr(self, key)
+                       if not _in_scope(p, scope)])
+            state[key] = old | state.get(key, set())
+
+        self._set_files(state)
+
+    def _set_files(self, state):
         self.staged = state.get('staged', [])
         self.modified = state.get('modified', [])
         self.unmerged = state.get('unmerged', [])
@@ -198,6 +314,11 @@ class MainModel(Observable):
         self.staged_deleted = state.get('staged_deleted', set())
         self.unstaged_deleted = state.get('unstaged_deleted', set())
         self.submodules = state.get('submodules', set())
+        self.status_version += 1
+
+        # Resolve the encodings of the files that are likely to be diffed
+        gitcfg.current().prefetch_file_encodings(
+            self.staged + self.modified + self.unmerged + self.untracked)
 
         sel = selection_model()
         if self.is_empty():
@@ -464,6 +585,15 @@ class MainModel(Observable):
 
 
 # Helpers
+def _in_scope(path, scope):
+    """Is `path` or one of its parent directories in the `scope` set?"""
+    while path:
+        if path in scope:
+            return True
+        path = utils.dirname(path)
+    return False
+
+
 def remote_args(remote,
                 local_branch='',
                 remote_branch='',
@@ -0,0 +1,135 @@
+"""Path bookkeeping for the worktree browser
+
+SortedPaths keeps the repository's paths in a sorted list so that the
+entries of any directory can be listed with a few binary searches.
+This lets the browser model create rows for a directory only when it
+is expanded.
+
+Status snapshots map paths to the status lists they appear in, e.g.
+("staged", "modified").  diff_snapshots() compares two snapshots so
+that only the paths whose status changed have to be updated.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import bisect
+
+from cola import core
+
+# Status lists that make a path "interesting" to the browser
+INTERESTING = ('staged', 'modified', 'unmerged', 'untracked')
+STATUS_LISTS = INTERESTING + ('upstream_changed',)
+
+
+class SortedPaths(object):
+    """A sorted list of file paths with fast directory listings"""
+
+    def __init__(self, paths=()):
+        self.paths = sorted(set(paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        paths = self.paths
+        idx = bisect.bisect_left(paths, path)
+        return idx < len(paths) and paths[idx] == path
+
+    def add(self, path):
+        """Add a path; returns False when it was already present"""
+        paths = self.paths
+        idx = bisect.bisect_left(paths, path)
+        if idx < len(paths) and paths[idx] == path:
+            return False
+        paths.insert(idx, path)
+        return True
+
+    def remove(self, path):
+        """Remove a path; returns False when it was not present"""
+        paths = self.paths
+        idx = bisect.bisect_left(paths, path)
+        if idx < len(paths) and paths[idx] == path:
+            del paths[idx]
+            return True
+        return False
+
+    def is_dir(self, path):
+        """Return True when any path lives below path"""
+        paths = self.paths
+        prefix = path + '/'
+        idx = bisect.bisect_left(paths, prefix)
+        return idx < len(paths) and paths[idx].startswith(prefix)
+
+    def children(self, directory):
+        """Return the (directories, files) directly inside a directory
+
+        Costs O(entries * log(paths)); the contents of subdirectories are
+        skipped over with a binary search.
+
+        """
+        paths = self.paths
+        if directory:
+            prefix = directory + '/'
+        else:
+            prefix = ''
+        idx = bisect.bisect_left(paths, prefix)
+        end = len(paths)
+        if prefix:
+            # '0' sorts right after '/'
+            end = bisect.bisect_left(paths, directory + '0', idx)
+        dirs = []
+        files = []
+        offset = len(prefix)
+        while idx < end:
+            path = paths[idx]
+            slash = path.find('/', offset)
+            if slash < 0:
+                files.append(path)
+                idx += 1
+            else:
+                subdir = path[:slash]
+                dirs.append(subdir)
+                idx = bisect.bisect_left(paths, subdir + '0', idx, end)
+        return dirs, files
+
+
+def status_snapshot(model):
+    """Return a dict mapping paths to the status lists they belong to"""
+    snapshot = {}
+    for name in STATUS_LISTS:
+        for path in getattr(model, name):
+            snapshot[path] = snapshot.get(path, ()) + (name,)
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """Return the sorted paths whose status differs between snapshots"""
+    changed = [path for path, status in new.items()
+               if old.get(path) != status]
+    changed.extend([path for path in old if path not in new])
+    changed.sort()
+    return changed
+
+
+def is_interesting(status):
+    """Return True when a snapshot status makes a path interesting"""
+    if not status:
+        return False
+    for name in status:
+        if name in INTERESTING:
+            return True
+    return False
+
+
+def is_present(path, status, exists=core.exists):
+    """Return True when a path exists in the worktree or the index
+
+    Modified and unmerged paths are in the index even when they have
+    been deleted from the worktree.  Paths that only changed upstream,
+    or whose deletion has been staged, exist in neither.
+
+    """
+    if status and ('modified' in status or 'unmerged' in status):
+        return True
+    return exists(path)
+
@@ -7,6 +7,8 @@ from cola import observable
 FONTDIFF = 'cola.fontdiff'
 DIFFCONTEXT = 'gui.diffcontext'
 DIFFTOOL = 'diff.tool'
+DIFF_MAX_FILE_SIZE = 'cola.diffmaxfilesize'
+DIFF_STREAM_THRESHOLD = 'cola.diffstreamthreshold'
 DISPLAY_UNTRACKED = 'gui.displayuntracked'
 EDITOR = 'gui.editor'
 LINEBREAK = 'cola.linebreak'
@@ -24,6 +26,16 @@ USER_NAME = 'user.name'
 
 
 
+def diff_max_file_size():
+    """Streamed diffs are truncated after this many characters per file"""
+    return gitcfg.current().get(DIFF_MAX_FILE_SIZE, 8 * 1024 * 1024)
+
+
+def diff_stream_threshold():
+    """Files larger than this many bytes are diffed in streaming mode"""
+    return gitcfg.current().get(DIFF_STREAM_THRESHOLD, 2 * 1024 * 1024)
+
+
 def display_untracked():
     return gitcfg.current().get(DISPLAY_UNTRACKED, True)
 
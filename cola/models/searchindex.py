@@ -0,0 +1,835 @@
+"""A persistent index of commit metadata for the Search dialog
+
+The message, author, committer, path and date searches used to run
+"git log --all" and walk the whole history for every query.  The
+CommitIndex keeps the metadata of every commit reachable from any ref
+in .git/cola/search along with the ref tips it was built from.  When
+the tips move, only the commits reachable from the new tips are read
+from git and appended.  Commits that are no longer reachable, e.g.
+after an amend, rebase or branch deletion, are marked as removed.
+The index is read, built and updated in a background thread, and the
+Search dialog uses "git log" until it is ready.
+
+Commits keep the id they were given when they were added.  Message
+words, authors, committers and touched paths map to the ids of their
+commits through Postings, so a query intersects a few id lists and
+then checks the candidates against the original pattern.  Results are
+ordered by commit date, newest first, like "git log".
+
+The file has the same layout as the DAG cache: a magic string, a JSON
+header describing the sections, then the raw arrays and utf-8 blobs.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import array
+import binascii
+import bisect
+import fnmatch
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+from cola import core
+from cola.decorators import memoize
+from cola.git import git
+
+MAGIC = b'COLASRC1'
+VERSION = 2
+
+# Commit dates are signed 64-bit where the platform has them, since
+# commits can be dated before 1970 or after 2106.
+try:
+    array.array('q')
+    DATE_TYPECODE = 'q'
+except ValueError:  # Python 2
+    DATE_TYPECODE = 'l'
+
+# Rebuild once this fraction of the indexed commits has been removed
+MAX_REMOVED_RATIO = 0.5
+
+logfmt = '%x1e%H%x1f%aN <%aE>%x1f%at%x1f%cN <%cE>%x1f%ct%x1f%B%x1f'
+logsep = '\x1f'
+logstart = '\x1e'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Characters that make a basic regular expression more than a string
+_BRE_SPECIAL = set('.[]*^$\\')
+
+
+def _tobytes(arr):
+    try:
+        return arr.tobytes()
+    except AttributeError:  # Python 2
+        return arr.tostring()
+
+
+def _frombytes(arr, data):
+    try:
+        arr.frombytes(data)
+    except AttributeError:  # Python 2
+        arr.fromstring(data)
+
+
+def words(text):
+    """Return the set of lowercase words in text"""
+    return set(_WORD_RE.findall(text.lower()))
+
+
+def bre_to_re(pattern, icase=False):
+    """Compile a POSIX basic regular expression, as used by "git log"
+
+    Raises re.error for patterns that Python cannot express.
+
+    """
+    result = []
+    idx = 0
+    size = len(pattern)
+    while idx < size:
+        c = pattern[idx]
+        if c == '\\' and idx + 1 < size:
+            n = pattern[idx + 1]
+            if n in '(){}|+?':
+                result.append(n)
+            else:
+                result.append('\\' + n)
+            idx += 2
+            continue
+        if c == '[':
+            # Copy the bracket expression, where a backslash is literal
+            end = idx + 1
+            if end < size and pattern[end] == '^':
+                end += 1
+            if end < size and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                raise re.error('unmatched [')
+            result.append(pattern[idx:end + 1].replace('\\', '\\\\'))
+            idx = end + 1
+            continue
+        if c in '(){}|+?':
+            result.append('\\' + c)
+        elif c == '*' and (not result or result[-1] in ('^', '(')):
+            result.append('\\*')
+        else:
+            result.append(c)
+        idx += 1
+    flags = re.MULTILINE | re.UNICODE
+    if icase:
+        flags |= re.IGNORECASE
+    return re.compile(''.join(result), flags)
+
+
+def _plural(count, unit):
+    if count == 1:
+        return '1 %s' % unit
+    return '%d %ss' % (count, unit)
+
+
+def relative_date(timestamp, now=None):
+    """Format a date like git's "%ar" relative dates"""
+    if now is None:
+        now = time.time()
+    diff = int(now) - timestamp
+    if diff < 0:
+        return 'in the future'
+    if diff < 90:
+        return _plural(diff, 'second') + ' ago'
+    diff = (diff + 30) // 60
+    if diff < 90:
+        return _plural(diff, 'minute') + ' ago'
+    diff = (diff + 30) // 60
+    if diff < 36:
+        return _plural(diff, 'hour') + ' ago'
+    diff = (diff + 12) // 24
+    if diff < 14:
+        return _plural(diff, 'day') + ' ago'
+    if diff < 70:
+        return _plural((diff + 3) // 7, 'week') + ' ago'
+    if diff < 365:
+        return _plural((diff + 15) // 30, 'month') + ' ago'
+    if diff < 1825:
+        total_months = (diff * 12 * 2 + 365) // (365 * 2)
+        years, months = divmod(total_months, 12)
+        if months:
+            return '%s, %s ago' % (_plural(years, 'year'),
+                                   _plural(months, 'month'))
+        return _plural(years, 'year') + ' ago'
+    return _plural((diff + 183) // 365, 'year') + ' ago'
+
+
+def parse_log(out):
+    """Generate commit tuples from "git log -z --name-only" output
+
+    Commits are (sha1, author, adate, committer, cdate, message, paths).
+
+    """
+    for entry in out.split(logstart):
+        commit = _parse_entry(entry)
+        if commit is not None:
+            yield commit
+
+
+def read_log(fh, chunk_size=65536):
+    """Generate commit tuples from a "git log" stream, see parse_log()
+
+    Only one commit's worth of output is held in memory at a time.
+
+    """
+    start = core.encode(logstart)
+    pending = b''
+    while True:
+        data = fh.read(chunk_size)
+        if not data:
+            break
+        entries = (pending + data).split(start)
+        pending = entries.pop()
+        for entry in entries:
+            commit = _parse_entry(core.decode(entry))
+            if commit is not None:
+                yield commit
+    commit = _parse_entry(core.decode(pending))
+    if commit is not None:
+        yield commit
+
+
+def _parse_entry(entry):
+    fields = entry.split(logsep)
+    if len(fields) != 7:
+        return None
+    sha1, author, adate, committer, cdate, message, names = fields
+    paths = [path for path in names.lstrip('\0\n').split('\0') if path]
+    return (sha1, author, int(adate or 0), committer, int(cdate or 0),
+            message, paths)
+
+
+class Postings(object):
+    """Maps keys to the ascending ids of the commits that contain them"""
+
+    def __init__(self):
+        self.keys = []
+        self.index = {}
+        self.ids = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, commit_id):
+        """Add a commit to a key and return the key's id"""
+        try:
+            key_id = self.index[key]
+        except KeyError:
+            key_id = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.ids.append(array.array('I'))
+        ids = self.ids[key_id]
+        if not ids or ids[-1] != commit_id:
+            ids.append(commit_id)
+        return key_id
+
+    def get(self, key):
+        """Return the commit ids of a key"""
+        try:
+            return self.ids[self.index[key]]
+        except KeyError:
+            return array.array('I')
+
+    def union(self, keys):
+        """Return the set of commit ids of several keys"""
+        result = set()
+        for key in keys:
+            result.update(self.get(key))
+        return result
+
+    def pack(self):
+        """Return (keys blob, key offsets, id offsets, ids)"""
+        blob, key_offsets = _pack_strings(self.keys)
+        id_offsets = array.array('I', [0])
+        ids = array.array('I')
+        for key_ids in self.ids:
+            ids.extend(key_ids)
+            id_offsets.append(len(ids))
+        return blob, key_offsets, id_offsets, ids
+
+    @classmethod
+    def unpack(cls, blob, key_offsets, id_offsets, ids):
+        postings = cls()
+        postings.keys = _unpack_strings(blob, key_offsets)
+        postings.index = dict([(key, idx)
+                               for idx, key in enumerate(postings.keys)])
+        postings.ids = [ids[id_offsets[idx]:id_offsets[idx + 1]]
+                        for idx in range(len(postings.keys))]
+        return postings
+
+
+def _pack_strings(strings):
+    blob = bytearray()
+    offsets = array.array('I', [0])
+    for string in strings:
+        blob.extend(core.encode(string))
+        offsets.append(len(blob))
+    return bytes(blob), offsets
+
+
+def _unpack_strings(blob, offsets):
+    return [core.decode(blob[offsets[idx]:offsets[idx + 1]])
+            for idx in range(len(offsets) - 1)]
+
+
+class CommitIndex(object):
+    """Commit metadata with postings for message words, people and paths"""
+
+    def __init__(self, tips=None):
+        self.tips = tips or []
+        self.shas = []
+        self.messages = []
+        self.adates = array.array(DATE_TYPECODE)
+        self.cdates = array.array(DATE_TYPECODE)
+        self.author_ids = array.array('I')
+        self.committer_ids = array.array('I')
+        self.authors = Postings()
+        self.committers = Postings()
+        self.words = Postings()
+        self.paths = Postings()
+        # Ids of commits that are no longer reachable from any tip
+        self.removed = set()
+        self._ids = None
+        self._ranked = None
+        self._sorted_paths = None
+
+    def __len__(self):
+        return len(self.shas) - len(self.removed)
+
+    def __contains__(self, sha1):
+        commit_id = self.commit_id(sha1)
+        return commit_id is not None and commit_id not in self.removed
+
+    def commit_id(self, sha1):
+        """Return the id of a commit, or None"""
+        if self._ids is None:
+            self._ids = dict([(sha, idx) for idx, sha in enumerate(self.shas)])
+        return self._ids.get(sha1)
+
+    def remove(self, shas):
+        """Mark commits as unreachable"""
+        for sha1 in shas:
+            commit_id = self.commit_id(sha1)
+            if commit_id is not None:
+                self.removed.add(commit_id)
+        self._ranked = None
+
+    def add(self, sha1, author, adate, committer, cdate, message, paths):
+        """Append a commit, or restore a commit that was removed"""
+        commit_id = self.commit_id(sha1)
+        if commit_id is not None:
+            self.removed.discard(commit_id)
+            self._ranked = None
+            return
+        commit_id = len(self.shas)
+        self.shas.append(sha1)
+        self.messages.append(message)
+        self.adates.append(adate)
+        self.cdates.append(cdate)
+        self.author_ids.append(self.authors.add(author, commit_id))
+        self.committer_ids.append(self.committers.add(committer, commit_id))
+        for word in words(message):
+            self.words.add(word, commit_id)
+        for path in paths:
+            self.paths.add(path, commit_id)
+        self._ids[sha1] = commit_id
+        self._ranked = None
+        self._sorted_paths = None
+
+    def ranked(self):
+        """Return (ids, rank of each id, negated dates) by date, newest first
+
+        The negated commit dates are ascending so they can be bisected.
+        Removed commits are left out and rank after every other commit.
+
+        """
+        if self._ranked is None:
+            cdates = self.cdates
+            removed = self.removed
+            ids = sorted([i for i in range(len(cdates)) if i not in removed],
+                         key=lambda i: (-cdates[i], -i))
+            ranks = array.array('I', [len(ids)]) * len(cdates)
+            for rank, commit_id in enumerate(ids):
+                ranks[commit_id] = rank
+            dates = [-cdates[i] for i in ids]
+            self._ranked = (ids, ranks, dates)
+        return self._ranked
+
+    def search(self, message=None, author=None, committer=None, paths=None,
+               after=None, before=None, icase=False, max_count=0):
+        """Return the ids of the commits that match every given filter
+
+        `message`, `author` and `committer` are basic regular expressions
+        matched like "git log --grep/--author/--committer".  `paths`
+        match themselves and everything below them.  `after` and
+        `before` bound the commit date.
+
+        """
+        candidates = None
+        checks = []
+        if message:
+            regex = bre_to_re(message, icase=icase)
+            found = self._word_candidates(message)
+            candidates = _intersect(candidates, found)
+            messages = self.messages
+            checks.append(lambda i: regex.search(messages[i]) is not None)
+        if author:
+            candidates = _intersect(candidates,
+                                    self._people(self.authors, author, icase))
+        if committer:
+            candidates = _intersect(candidates,
+                                    self._people(self.committers, committer,
+                                                 icase))
+        if paths:
+            candidates = _intersect(candidates, self._paths(paths))
+        if candidates is not None and self.removed:
+            candidates.difference_update(self.removed)
+        ids, ranks, dates = self.ranked()
+        if after is not None or before is not None:
+            if before is None:
+                lo = 0
+            else:
+                lo = bisect.bisect_left(dates, -before)
+            if after is None:
+                hi = len(dates)
+            else:
+                hi = bisect.bisect_right(dates, -after, lo)
+            if candidates is None:
+                ordered = ids[lo:hi]
+            else:
+                ordered = [i for i in _sorted(candidates, ranks)
+                           if lo <= ranks[i] < hi]
+        elif candidates is None:
+            ordered = ids
+        else:
+            ordered = _sorted(candidates, ranks)
+        result = []
+        for commit_id in ordered:
+            if [check for check in checks if not check(commit_id)]:
+                continue
+            result.append(commit_id)
+            if max_count and len(result) >= max_count:
+                break
+        return result
+
+    def _word_candidates(self, pattern):
+        """Return the ids that can match a message pattern, or None
+
+        A pattern without special characters must appear in the
+        message, so every word in it is a substring of a word of the
+        message.  Regular expressions are checked against every message.
+
+        """
+        if _BRE_SPECIAL.intersection(pattern):
+            return None
+        result = None
+        for word in words(pattern):
+            keys = [key for key in self.words.keys if word in key]
+            result = _intersect(result, self.words.union(keys))
+            if not result:
+                break
+        return result
+
+    def _people(self, postings, pattern, icase):
+        regex = bre_to_re(pattern, icase=icase)
+        keys = [key for key in postings.keys if regex.search(key)]
+        return postings.union(keys)
+
+    def _paths(self, pathspecs):
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.paths.keys)
+        all_paths = self._sorted_paths
+        keys = []
+        for pathspec in pathspecs:
+            pathspec = pathspec.rstrip('/')
+            if not pathspec or pathspec == '.':
+                return set(range(len(self.shas)))
+            if [c for c in pathspec if c in '*?[']:
+                keys.extend(fnmatch.filter(all_paths, pathspec))
+                keys.extend([path for path in all_paths
+                             if fnmatch.fnmatchcase(path, pathspec + '/*')])
+                continue
+            if pathspec in self.paths.index:
+                keys.append(pathspec)
+            prefix = pathspec + '/'
+            lo = bisect.bisect_left(all_paths, prefix)
+            hi = bisect.bisect_left(all_paths, prefix + '\uffff', lo)
+            keys.extend(all_paths[lo:hi])
+        return self.paths.union(keys)
+
+    def summary(self, commit_id, now=None):
+        """Return the "%aN - %s - %ar" summary of a commit"""
+        author = self.authors.keys[self.author_ids[commit_id]]
+        name = author.rsplit(' <', 1)[0]
+        subject = self.messages[commit_id].split('\n', 1)[0]
+        return '%s - %s - %s' % (name, subject,
+                                 relative_date(self.adates[commit_id],
+                                               now=now))
+
+    def results(self, commit_ids, now=None):
+        """Return (SHA-1, summary) pairs like gitcmds.parse_rev_list()"""
+        return [(self.shas[idx], self.summary(idx, now=now))
+                for idx in commit_ids]
+
+    def pack(self):
+        """Serialize the index"""
+        sections = []
+
+        def add(name, data):
+            if isinstance(data, array.array):
+                data = _tobytes(data)
+            sections.append((name, data))
+
+        add('shas', binascii.unhexlify(core.encode(''.join(self.shas))))
+        blob, offsets = _pack_strings(self.messages)
+        add('messages', blob)
+        add('message_offsets', offsets)
+        add('adates', self.adates)
+        add('cdates', self.cdates)
+        add('author_ids', self.author_ids)
+        add('committer_ids', self.committer_ids)
+        add('removed', array.array('I', sorted(self.removed)))
+        for name in ('authors', 'committers', 'words', 'paths'):
+            parts = getattr(self, name).pack()
+            for suffix, part in zip(('keys', 'key_offsets', 'id_offsets',
+                                     'ids'), parts):
+                add('%s_%s' % (name, suffix), part)
+        header = {
+            'version': VERSION,
+            'byteorder': sys.byteorder,
+            'itemsize': array.array('I').itemsize,
+            'date_typecode': DATE_TYPECODE,
+            'date_itemsize': array.array(DATE_TYPECODE).itemsize,
+            'tips': self.tips,
+            'commits': len(self.shas),
+            'sections': [[name, len(data)] for name, data in sections],
+        }
+        header_data = core.encode(json.dumps(header, sort_keys=True))
+        return b''.join([MAGIC, struct.pack('<I', len(header_data)),
+                         header_data] + [data for name, data in sections])
+
+    @classmethod
+    def unpack(cls, data):
+        """Return a CommitIndex from packed data, or None"""
+        if not data.startswith(MAGIC):
+            return None
+        offset = len(MAGIC)
+        try:
+            size = struct.unpack('<I', data[offset:offset+4])[0]
+            offset += 4
+            header = json.loads(core.decode(data[offset:offset+size]))
+            offset += size
+            if (type(header) is not dict or
+                    header.get('version') != VERSION or
+                    header.get('byteorder') != sys.byteorder or
+                    header.get('itemsize') != array.array('I').itemsize or
+                    header.get('date_typecode') != DATE_TYPECODE or
+                    header.get('date_itemsize') !=
+                    array.array(DATE_TYPECODE).itemsize):
+                return None
+            sections = {}
+            for name, length in header['sections']:
+                sections[name] = data[offset:offset+length]
+                if len(sections[name]) != length:
+                    return None
+                offset += length
+            return cls._unpack(header, sections)
+        except (struct.error, KeyError, IndexError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def _unpack(cls, header, sections):
+        def read_array(name, typecode='I'):
+            arr = array.array(typecode)
+            _frombytes(arr, sections[name])
+            return arr
+
+        index = cls(tips=header['tips'])
+        count = header['commits']
+        shas = core.decode(binascii.hexlify(sections['shas']))
+        index.shas = [shas[i:i+40] for i in range(0, count * 40, 40)]
+        index.messages = _unpack_strings(sections['messages'],
+                                         read_array('message_offsets'))
+        index.adates = read_array('adates', DATE_TYPECODE)
+        index.cdates = read_array('cdates', DATE_TYPECODE)
+        index.author_ids = read_array('author_ids')
+        index.committer_ids = read_array('committer_ids')
+        index.removed = set(read_array('removed'))
+        for name in ('authors', 'committers', 'words', 'paths'):
+            postings = Postings.unpack(sections[name + '_keys'],
+                                       read_array(name + '_key_offsets'),
+                                       read_array(name + '_id_offsets'),
+                                       read_array(name + '_ids'))
+            setattr(index, name, postings)
+        for values in (index.messages, index.adates, index.cdates,
+                       index.author_ids, index.committer_ids):
+            if len(values) != count:
+                raise ValueError('truncated index')
+        if [idx for idx in index.removed if idx >= count]:
+            raise ValueError('invalid removed commits')
+        return index
+
+
+def parse_date(datestr, end=False):
+    """Return the local timestamp of a YYYY-MM-DD date, or None
+
+    `end` returns the last second of the day.
+
+    """
+    try:
+        timestamp = int(time.mktime(time.strptime(datestr, '%Y-%m-%d')))
+    except (ValueError, OverflowError):
+        return None
+    if end:
+        timestamp += 24 * 60 * 60 - 1
+    return timestamp
+
+
+def parse_query(args):
+    """Return CommitIndex.search() filters for "key:value" arguments
+
+    author:, committer:, path:, after: and before: select a filter and
+    the remaining arguments are searched for in commit messages.
+
+    """
+    filters = {}
+    message = []
+    paths = []
+    for arg in args:
+        key, sep, value = arg.partition(':')
+        if not sep or not value:
+            message.append(arg)
+        elif key in ('author', 'committer'):
+            filters[key] = value
+        elif key == 'path':
+            paths.append(value)
+        elif key in ('after', 'before'):
+            timestamp = parse_date(value, end=key == 'before')
+            if timestamp is None:
+                raise ValueError('invalid date: %s' % value)
+            filters[key] = timestamp
+        else:
+            message.append(arg)
+    if message:
+        filters['message'] = ' '.join(message)
+    if paths:
+        filters['paths'] = paths
+    return filters
+
+
+def _sorted(ids, ranks):
+    """Sort commit ids by their rank"""
+    return sorted(ids, key=ranks.__getitem__)
+
+
+def _intersect(candidates, ids):
+    """Intersect a candidate set with ids, where None means everything"""
+    if ids is None:
+        return candidates
+    if candidates is None:
+        return set(ids)
+    return candidates.intersection(ids)
+
+
+class SearchIndex(object):
+    """Keeps the CommitIndex of a repository up to date
+
+    get() updates the index in the calling thread.  The Search dialog
+    uses request(), which never waits for git to walk the history.
+
+    """
+
+    def __init__(self, git=git):
+        self.git = git
+        self.path = None
+        self.index = None
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def tips(self):
+        """Return the sorted SHA-1s of every ref and HEAD, or None"""
+        status, out, err = self.git.rev_parse('--all')
+        if status != 0:
+            return None
+        tips = set(out.split())
+        status, out, err = self.git.rev_parse('-q', '--verify', 'HEAD')
+        if status == 0 and out:
+            tips.add(out.strip())
+        return sorted(tips)
+
+    def read(self):
+        """Return the CommitIndex stored on disk, or None"""
+        try:
+            with core.xopen(self.path, 'rb') as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return None
+        return CommitIndex.unpack(data)
+
+    def save(self, index):
+        """Atomically write an index"""
+        tmp_path = self.path + '.tmp'
+        try:
+            parent = os.path.dirname(self.path)
+            if not core.isdir(parent):
+                core.makedirs(parent)
+            with core.xopen(tmp_path, 'wb') as fh:
+                fh.write(index.pack())
+            os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+        except (IOError, OSError):
+            return False
+        return True
+
+    def request(self):
+        """Return an up-to-date CommitIndex without waiting for it
+
+        Returns None while the index is read, built or updated by a
+        background thread, which is started when needed.  Callers fall
+        back to "git log" in the meantime.
+
+        """
+        path = self.git.git_path('cola', 'search')
+        with self._lock:
+            index = self.index
+            ready = self._thread is None and path == self.path
+        if ready and index is not None:
+            tips = self.tips()
+            if tips is not None and tips == index.tips:
+                return index
+        self.refresh()
+        return None
+
+    def refresh(self):
+        """Bring the index up to date in a background thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            thread = self._thread = threading.Thread(target=self._refresh)
+            thread.daemon = True
+        thread.start()
+
+    def wait(self):
+        """Wait for a background refresh to finish"""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _refresh(self):
+        try:
+            self.get()
+        except Exception as e:
+            # Searches keep using "git log"
+            self.stats = {'mode': 'error', 'error': '%s' % e}
+        finally:
+            with self._lock:
+                self._thread = None
+
+    def get(self):
+        """Return an up-to-date CommitIndex, or None when git fails
+
+        Commits that are no longer reachable are marked as removed.
+        The index is rebuilt once most of its commits have been removed.
+
+        """
+        start = time.time()
+        path = self.git.git_path('cola', 'search')
+        with self._lock:
+            if path != self.path:
+                # Another repository
+                self.path = path
+                self.index = None
+            index = self.index
+        tips = self.tips()
+        if tips is None:
+            return None
+        if index is None:
+            index = self.read()
+        mode = 'cached'
+        if index is None or index.tips != tips:
+            updated = None
+            if index is not None and index.tips:
+                updated = self._update(index, tips)
+                mode = 'incremental'
+            if (updated is None or
+                    len(updated.removed) >
+                    len(updated.shas) * MAX_REMOVED_RATIO):
+                updated = self._build(tips)
+                mode = 'full'
+            if updated is None:
+                return None
+            index = updated
+            self.save(index)
+        with self._lock:
+            if path == self.path:
+                self.index = index
+        self.stats = {'mode': mode, 'commits': len(index),
+                      'removed': len(index.removed),
+                      'elapsed': time.time() - start}
+        return index
+
+    def _log(self, index, revs):
+        """Add the commits of "git log" over revisions given on stdin
+
+        The output is oldest first and is parsed as it is read.
+        Returns False when git fails.
+
+        """
+        argv = ['git', 'log', '--stdin', '--reverse', '-z', '--name-only',
+                '--no-renames', '--no-color', '--encoding=UTF-8',
+                '--format=' + logfmt]
+        with open(os.devnull, 'wb') as devnull:
+            proc = core.start_command(argv, stderr=devnull)
+            proc.stdin.write(core.encode('\n'.join(revs) + '\n'))
+            proc.stdin.close()
+            for commit in read_log(proc.stdout):
+                index.add(*commit)
+            proc.stdout.close()
+            return proc.wait() == 0
+
+    def _run(self, argv, revs):
+        proc = core.start_command(argv)
+        out, err = proc.communicate(core.encode('\n'.join(revs) + '\n'))
+        return proc.returncode, core.decode(out)
+
+    def _build(self, tips):
+        index = CommitIndex(tips=tips)
+        if tips and not self._log(index, tips):
+            return None
+        return index
+
+    def _update(self, index, tips):
+        """Apply the difference between the old and new tips, or None
+
+        Commits reachable from the new tips are appended, or restored
+        when they had been removed.  Commits only reachable from the old
+        tips, e.g. after an amend, rebase or branch deletion, are marked
+        as removed.
+
+        """
+        old_tips = index.tips
+        status, out = self._run(['git', 'rev-list', '--stdin'],
+                                old_tips + ['^' + tip for tip in tips])
+        if status != 0:
+            return None
+        index.remove(out.split())
+        if not self._log(index, tips + ['^' + tip for tip in old_tips]):
+            return None
+        index.tips = tips
+        return index
+
+
+@memoize
+def current():
+    """Return the SearchIndex singleton"""
+    return SearchIndex()
@@ -0,0 +1,89 @@
+"""A shared index of the status of paths and their parent directories
+
+The worktree browser shows a status icon for every visible file and
+directory.  A directory is e.g. "Modified" when any file below it is
+modified.  StatusIndex maps every path with a status, and each of its
+parent directories, to a set of status flags so that a lookup is a
+single dict access.
+
+The index is built once per status update of the main model and shared
+by all of the browser's background tasks, and by the browser model when
+it decides whether a path is interesting.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import threading
+
+from cola import utils
+from cola.decorators import memoize
+
+UNMERGED = 1
+MODIFIED = 2
+STAGED = 4
+UNTRACKED = 8
+UPSTREAM_CHANGED = 16
+
+# Flags that make a path, or the directories above it, "interesting"
+INTERESTING = UNMERGED | MODIFIED | STAGED | UNTRACKED
+
+FLAGS = (
+    ('unmerged', UNMERGED),
+    ('modified', MODIFIED),
+    ('staged', STAGED),
+    ('untracked', UNTRACKED),
+    ('upstream_changed', UPSTREAM_CHANGED),
+)
+
+
+@memoize
+def current():
+    """Return the StatusIndexCache singleton"""
+    return StatusIndexCache()
+
+
+class StatusIndex(object):
+    """Maps paths and their parent directories to status flags"""
+
+    def __init__(self, model=None, version=None):
+        self.version = version
+        self._flags = {}
+        if model is not None:
+            for name, flag in FLAGS:
+                for path in getattr(model, name):
+                    self.add(path, flag)
+
+    def __len__(self):
+        return len(self._flags)
+
+    def add(self, path, flag):
+        """Flag a path and its parent directories"""
+        flags = self._flags
+        while path:
+            value = flags.get(path, 0)
+            if value & flag:
+                # The parents were flagged along with this path
+                break
+            flags[path] = value | flag
+            path = utils.dirname(path)
+
+    def flags(self, path):
+        """Return the flags of a path or any path below it"""
+        return self._flags.get(path, 0)
+
+
+class StatusIndexCache(object):
+    """Builds a StatusIndex at most once per model status update"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def get(self, model):
+        """Return the StatusIndex for the model's current status"""
+        version = model.status_version
+        with self._lock:
+            index = self._index
+            if index is None or index.version != version:
+                index = self._index = StatusIndex(model, version=version)
+            return index
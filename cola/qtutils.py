@@ -14,6 +14,7 @@ from PyQt4.QtCore import Qt
 from PyQt4.QtCore import SIGNAL
 
 from cola import core
+from cola import diffsyntax
 from cola import gitcfg
 from cola import utils
 from cola import resources
@@ -908,60 +909,37 @@ class GenericSyntaxHighligher(QtGui.QSyntaxHighlighter):
 class DiffSyntaxHighlighter(GenericSyntaxHighligher):
     """Implements the diff syntax highlighting
 
-    This class is used by widgets that display diffs.
+    This class is used by widgets that display diffs.  Lines are
+    classified in a single pass by diffsyntax.DiffClassifier, which
+    dispatches on the first character of each line instead of trying
+    every rule regex in turn.
 
     """
     def __init__(self, doc, whitespace=True):
         self.whitespace = whitespace
+        self.classifier = diffsyntax.DiffClassifier(whitespace=whitespace)
         GenericSyntaxHighligher.__init__(self, doc)
 
     def generate_rules(self):
-        diff_head = self.mkformat(fg=self.color_header)
-        diff_head_bold = self.mkformat(fg=self.color_header, bold=True)
-
-        diff_add = self.mkformat(fg=self.color_text, bg=self.color_add)
-        diff_remove = self.mkformat(fg=self.color_text, bg=self.color_remove)
-
-        if self.whitespace:
-            bad_ws = self.mkformat(fg=Qt.black, bg=Qt.red)
-
-        # We specify the whitespace rule last so that it is
-        # applied after the diff addition/removal rules.
-        # The rules for the header
-        diff_old_rgx = TERMINAL(r'^--- ')
-        diff_new_rgx = TERMINAL(r'^\+\+\+ ')
-        diff_ctx_rgx = TERMINAL(r'^@@ ')
-
-        diff_hd1_rgx = TERMINAL(r'^diff --git a/.*b/.*')
-        diff_hd2_rgx = TERMINAL(r'^index \S+\.\.\S+')
-        diff_hd3_rgx = TERMINAL(r'^new file mode')
-        diff_hd4_rgx = TERMINAL(r'^deleted file mode')
-        diff_add_rgx = TERMINAL(r'^\+')
-        diff_rmv_rgx = TERMINAL(r'^-')
-        diff_bar_rgx = TERMINAL(r'^([ ]+.*)(\|[ ]+\d+[ ]+[+-]+)$')
-        diff_sts_rgx = (r'(.+\|.+?)(\d+)(.+?)([\+]*?)([-]*?)$')
-        diff_sum_rgx = (r'(\s+\d+ files changed[^\d]*)'
-                        r'(:?\d+ insertions[^\d]*)'
-                        r'(:?\d+ deletions.*)$')
-
-        self.create_rules(diff_old_rgx,     diff_head,
-                          diff_new_rgx,     diff_head,
-                          diff_ctx_rgx,     diff_head_bold,
-                          diff_bar_rgx,     (diff_head_bold, diff_head),
-                          diff_hd1_rgx,     diff_head,
-                          diff_hd2_rgx,     diff_head,
-                          diff_hd3_rgx,     diff_head,
-                          diff_hd4_rgx,     diff_head,
-                          diff_add_rgx,     diff_add,
-                          diff_rmv_rgx,     diff_remove,
-                          diff_sts_rgx,     (None, diff_head,
-                                             None, diff_head,
-                                             diff_head),
-                          diff_sum_rgx,     (diff_head,
-                                             diff_head,
-                                             diff_head))
-        if self.whitespace:
-            self.create_rules(r'(..*?)(\s+)$', (None, bad_ws))
+        self._formats = {
+            diffsyntax.HEADER: self.mkformat(fg=self.color_header),
+            diffsyntax.HEADER_BOLD: self.mkformat(fg=self.color_header,
+                                                  bold=True),
+            diffsyntax.ADD: self.mkformat(fg=self.color_text,
+                                          bg=self.color_add),
+            diffsyntax.REMOVE: self.mkformat(fg=self.color_text,
+                                             bg=self.color_remove),
+            diffsyntax.BAD_WHITESPACE: self.mkformat(fg=Qt.black,
+                                                     bg=Qt.red),
+        }
+
+    def highlightBlock(self, qstr):
+        if not self.enabled:
+            return
+        formats = self._formats
+        set_format = self.setFormat
+        for start, length, style in self.classifier.spans(ustr(qstr)):
+            set_format(start, length, formats[style])
 
 
 def install():
@@ -24,6 +24,8 @@ _versions = {
     'pyqt': '4.4',
     'pyqt_qrunnable': '4.4',
     'diff-submodule': '1.6.6',
+    # git-status learned --porcelain=v2 in 2.11.0
+    'status-porcelain-v2': '2.11.0',
 }
 
 
@@ -0,0 +1,256 @@
+"""Decides which directories the file notifier watches and which it polls
+
+Large worktrees have more directories than the kernel allows inotify
+watches, so the notifier watches a bounded set of directories and polls
+the rest.  WatchSet holds that state without depending on pyinotify or
+Qt; the notifier supplies callbacks that add and remove watches.
+
+"""
+from __future__ import division, absolute_import, unicode_literals
+
+import errno
+import os
+from collections import deque
+from threading import Lock
+
+from cola import core
+
+# Errors from add_watch that mean the directory has gone away
+MISSING_ERRNOS = (errno.ENOENT, errno.ENOTDIR)
+
+
+class WatchError(Exception):
+    """Raised by add_watch callbacks when a watch cannot be added"""
+    pass
+
+
+class WatchSet(object):
+    """Decides which directories are watched and which are polled
+
+    Directories are queued and watched incrementally, hot directories
+    (those containing changed files) first.  The number of watches is
+    kept under a budget; once it is exhausted a hot directory evicts the
+    least recently active watched directory.  Directories that are not
+    watched are polled for changes by comparing stat() signatures.
+
+    `add_watch(directory)` returns a watch descriptor, None when the
+    directory no longer exists, or raises WatchError when the watch
+    could not be added.  Failures shrink the budget to the number of
+    current watches.  `is_ignored(directories)` returns the subset of
+    newly created directories that git ignores; those are never hot.
+
+    """
+
+    def __init__(self, add_watch, rm_watch, budget, is_ignored=None):
+        ## Callback that watches a directory and returns a watch descriptor
+        self._add_watch = add_watch
+        ## Callback that removes a watch descriptor
+        self._rm_watch = rm_watch
+        ## Callback that filters ignored directories
+        self._is_ignored = is_ignored
+        ## Maximum number of watches
+        self.budget = max(1, budget)
+        ## Watched directories and their watch descriptors
+        self._watched = {}
+        ## Activity stamps of the watched directories
+        self._stamps = {}
+        self._clock = 0
+        ## (stamp, directory) in least-recently-used order.  Entries whose
+        ## stamp is no longer current are skipped.
+        self._lru = deque()
+        ## Queued directories
+        self._hot = deque()
+        self._cold = deque()
+        self._queued = set()
+        ## Created directories that have not been checked against ignores
+        self._created = []
+        ## Polled directories and their last seen signature
+        self._polled = {}
+        ## Polled directories in round-robin order
+        self._poll_order = deque()
+        self._poll_queued = set()
+        ## Protects the above from the notifier and model threads
+        self._lock = Lock()
+
+    def is_watched(self, directory):
+        return directory in self._watched
+
+    def is_polled(self, directory):
+        return directory in self._polled
+
+    def watch_count(self):
+        return len(self._watched)
+
+    def pending_count(self):
+        return len(self._hot) + len(self._cold) + len(self._created)
+
+    def queue(self, directories, hot=False):
+        """Queue directories for watching"""
+        with self._lock:
+            self._queue(directories, hot)
+
+    def _queue(self, directories, hot):
+        for directory in directories:
+            if directory in self._watched:
+                if hot:
+                    self._touch(directory)
+                continue
+            if hot:
+                self._hot.append(directory)
+            elif directory not in self._queued:
+                self._cold.append(directory)
+            self._queued.add(directory)
+
+    def created(self, directories):
+        """Queue directories that have just appeared
+
+        They are hot unless git ignores them, so build output does not
+        evict the watches of tracked directories.
+
+        """
+        with self._lock:
+            self._created.extend(directories)
+
+    def _sort_created(self):
+        with self._lock:
+            created = self._created
+            self._created = []
+        if not created:
+            return
+        if self._is_ignored is None:
+            ignored = set()
+        else:
+            ignored = set(self._is_ignored(created))
+        with self._lock:
+            self._queue([d for d in created if d not in ignored], True)
+            self._queue([d for d in created if d in ignored], False)
+
+    def touch(self, directory):
+        """Mark a watched directory as recently active"""
+        with self._lock:
+            self._touch(directory)
+
+    def _touch(self, directory):
+        if directory in self._watched:
+            self._stamp(directory)
+
+    def _stamp(self, directory):
+        self._clock += 1
+        self._stamps[directory] = self._clock
+        self._lru.append((self._clock, directory))
+        if len(self._lru) > 2 * len(self._stamps) + 64:
+            # Drop the stale entries left behind by touch()
+            self._lru = deque(sorted([(stamp, d) for d, stamp
+                                      in self._stamps.items()]))
+
+    def process(self, limit):
+        """Watch up to `limit` queued directories"""
+        self._sort_created()
+        count = 0
+        with self._lock:
+            while count < limit and (self._hot or self._cold):
+                hot = bool(self._hot)
+                if hot:
+                    directory = self._hot.popleft()
+                else:
+                    directory = self._cold.popleft()
+                self._queued.discard(directory)
+                if directory in self._watched:
+                    continue
+                self._watch(directory, hot)
+                count += 1
+        return count
+
+    def _watch(self, directory, hot):
+        if len(self._watched) >= self.budget:
+            if not hot:
+                # Cold directories never displace watched ones
+                self._poll_later(directory)
+                return
+            self._evict()
+        try:
+            wd = self._add_watch(directory)
+        except OSError as e:
+            if e.errno in MISSING_ERRNOS:
+                wd = None
+            else:
+                self._watch_failed(directory)
+                return
+        except WatchError:
+            self._watch_failed(directory)
+            return
+        if wd is None:
+            # The directory was removed before it could be watched
+            self._polled.pop(directory, None)
+            return
+        self._polled.pop(directory, None)
+        self._watched[directory] = wd
+        self._stamp(directory)
+
+    def _watch_failed(self, directory):
+        # Out of watches: stop growing and fall back to polling
+        self.budget = max(1, len(self._watched))
+        self._poll_later(directory)
+
+    def _evict(self):
+        while True:
+            stamp, directory = self._lru.popleft()
+            if self._stamps.get(directory) == stamp:
+                break
+        del self._stamps[directory]
+        wd = self._watched.pop(directory)
+        try:
+            self._rm_watch(wd)
+        except (OSError, WatchError):
+            pass
+        self._poll_later(directory)
+
+    def _poll_later(self, directory):
+        if directory not in self._polled:
+            self._polled[directory] = _dir_signature(directory)
+        if directory not in self._poll_queued:
+            self._poll_queued.add(directory)
+            self._poll_order.append(directory)
+
+    def poll(self, limit):
+        """Stat up to `limit` polled directories and return the changed ones
+
+        Polling is round-robin so every directory is eventually visited.
+
+        """
+        changed = []
+        with self._lock:
+            count = 0
+            order = self._poll_order
+            while count < limit and order:
+                directory = order.popleft()
+                self._poll_queued.discard(directory)
+                if directory not in self._polled:
+                    # Watched since it was queued
+                    continue
+                count += 1
+                old = self._polled.pop(directory)
+                new = _dir_signature(directory)
+                if new is not None:
+                    self._polled[directory] = new
+                    self._poll_queued.add(directory)
+                    order.append(directory)
+                if new != old:
+                    changed.append(directory)
+        return changed
+
+
+def _dir_signature(directory):
+    """Return a cheap summary of a directory's entries, or None"""
+    try:
+        names = os.listdir(directory)
+        signature = [core.stat(directory).st_mtime]
+    except OSError:
+        return None
+    for name in names:
+        try:
+            st = os.lstat(os.path.join(directory, name))
+        except OSError:
+            continue
+        signature.append((name, st.st_mtime, st.st_size))
+    return tuple(signature)
@@ -16,9 +16,12 @@ from cola.git import git
 from cola.i18n import N_
 from cola.interaction import Interaction
 from cola.models import main
+from cola.models import statusindex
 from cola.models.browse import GitRepoModel
 from cola.models.browse import GitRepoEntryManager
 from cola.models.browse import GitRepoNameItem
+from cola.models.browse import QRunnable
+from cola.models.browse import TaskRunner
 from cola.models.selection import State
 from cola.models.selection import selection_model
 from cola.widgets import defs
@@ -205,20 +208,17 @@ class RepoTreeView(standard.TreeView):
         state = State(staged, unmerged, modified, untracked)
 
         paths = self.selected_paths()
-        model = main.model()
-        model_staged = utils.add_parents(model.staged)
-        model_modified = utils.add_parents(model.modified)
-        model_unmerged = utils.add_parents(model.unmerged)
-        model_untracked = utils.add_parents(model.untracked)
+        index = statusindex.current().get(main.model())
 
         for path in paths:
-            if path in model_unmerged:
+            flags = index.flags(path)
+            if flags & statusindex.UNMERGED:
                 unmerged.append(path)
-            elif path in model_untracked:
+            elif flags & statusindex.UNTRACKED:
                 untracked.append(path)
-            elif path in model_staged:
+            elif flags & statusindex.STAGED:
                 staged.append(path)
-            elif path in model_modified:
+            elif flags & statusindex.MODIFIED:
                 modified.append(path)
             else:
                 staged.append(path)
@@ -257,40 +257,33 @@ class RepoTreeView(standard.TreeView):
 
     def selected_staged_paths(self, selection=None):
         """Return selected staged paths."""
-        if selection is None:
-            selection = self.selected_paths()
-        staged = utils.add_parents(main.model().staged)
-        return [p for p in selection if p in staged]
+        return self._selected_with_status(statusindex.STAGED, selection)
 
     def selected_modified_paths(self, selection=None):
         """Return selected modified paths."""
-        if selection is None:
-            selection = self.selected_paths()
-        model = main.model()
-        modified = utils.add_parents(model.modified)
-        return [p for p in selection if p in modified]
+        return self._selected_with_status(statusindex.MODIFIED, selection)
 
     def selected_unstaged_paths(self, selection=None):
         """Return selected unstaged paths."""
-        if selection is None:
-            selection = self.selected_paths()
-        model = main.model()
-        modified = utils.add_parents(model.modified)
-        untracked = utils.add_parents(model.untracked)
-        unstaged = modified.union(untracked)
-        return [p for p in selection if p in unstaged]
+        return self._selected_with_status(
+                statusindex.MODIFIED | statusindex.UNTRACKED, selection)
 
     def selected_tracked_paths(self, selection=None):
         """Return selected tracked paths."""
         if selection is None:
             selection = self.selected_paths()
-        model = main.model()
-        staged = set(self.selected_staged_paths(selection=selection))
-        modified = set(self.selected_modified_paths(selection=selection))
-        untracked = utils.add_parents(model.untracked)
-        tracked = staged.union(modified)
+        index = statusindex.current().get(main.model())
+        tracked = statusindex.STAGED | statusindex.MODIFIED
         return [p for p in selection
-                if p not in untracked or p in tracked]
+                if not index.flags(p) & statusindex.UNTRACKED
+                    or index.flags(p) & tracked]
+
+    def _selected_with_status(self, flags, selection=None):
+        """Return selected paths with any of the given status flags."""
+        if selection is None:
+            selection = self.selected_paths()
+        index = statusindex.current().get(main.model())
+        return [p for p in selection if index.flags(p) & flags]
 
     def _create_action(self, name, tooltip, slot, shortcut=None):
         """Create an action with a shortcut, tooltip, and callback slot."""
@@ -640,33 +633,101 @@ class GitFileTreeModel(QtGui.QStandardItemModel):
 
 
 class GitTreeModel(GitFileTreeModel):
+    """Presents the tree of a git ref
+
+    Trees are read one level at a time on a background thread.  The
+    top-level entries are read when the model is created and the
+    entries of a directory are read when it is first expanded.
+
+    """
     def __init__(self, ref, parent):
         GitFileTreeModel.__init__(self, parent)
         self.ref = ref
+        # directory paths -> tree sha1s of directories that are not loaded
+        self.trees = {}
+        self.pending = set()
+        self.notifier = QtCore.QObject(self)
+        self.connect(self.notifier, SIGNAL('tree_read'), self._tree_read)
         self._initialize()
 
     def _initialize(self):
-        """Iterate over git-ls-tree and create GitTreeItems."""
-        status, out, err = git.ls_tree('--full-tree', '-r', '-t', '-z',
-                                       self.ref)
-        if status != 0:
-            Interaction.log_status(status, out, err)
-            return
+        """Read the top-level tree in the background"""
+        self._read_tree('', self.ref)
 
-        if not out:
-            return
+    def clear(self):
+        GitFileTreeModel.clear(self)
+        self.trees = {}
+        self.pending = set()
+
+    def hasChildren(self, index=QtCore.QModelIndex()):
+        if self._unloaded_dir(index) is not None:
+            return True
+        return GitFileTreeModel.hasChildren(self, index)
+
+    def canFetchMore(self, index):
+        return self._unloaded_dir(index) is not None
+
+    def fetchMore(self, index):
+        path = self._unloaded_dir(index)
+        if path is not None and path not in self.pending:
+            self._read_tree(path, self.trees[path])
+
+    def _unloaded_dir(self, index):
+        """Return the path of an unread directory index, or None"""
+        if not index.isValid():
+            return None
+        item = self.itemFromIndex(index)
+        if item is None or not item.is_dir or item.path not in self.trees:
+            return None
+        return item.path
+
+    def _read_tree(self, path, objname):
+        self.pending.add(path)
+        task = TreeReadTask(self.notifier, path, objname)
+        TaskRunner.current().run(task)
 
-        for line in out[:-1].split('\0'):
-            # .....6 ...4 ......................................40
-            # 040000 tree c127cde9a0c644a3a8fef449a244f47d5272dfa6	relative
-            # 100644 blob 139e42bf4acaa4927ec9be1ec55a252b97d3f1e2	relative/path
-            objtype = line[7]
-            relpath = line[6 + 1 + 4 + 1 + 40 + 1:]
-            if objtype == 't':
-                parent = self.dir_entries[utils.dirname(relpath)]
+    def _tree_read(self, path, entries):
+        """Add the entries of a tree once it has been read"""
+        if path not in self.pending:
+            # the model was cleared while the tree was being read
+            return
+        self.pending.discard(path)
+        self.trees.pop(path, None)
+        parent = self.dir_entries.get(path)
+        if parent is None:
+            return
+        if entries is None:
+            Interaction.log(N_('Unable to read "%s"') %
+                            (path and '%s:%s' % (self.ref, path) or self.ref))
+            return
+        for mode, objtype, sha1, name in entries:
+            relpath = path and path + '/' + name or name
+            if objtype == 'tree':
                 self.add_directory(parent, relpath)
-            elif objtype == 'b':
-                self.add_file(relpath)
+                self.trees[relpath] = sha1
+            elif objtype == 'blob':
+                parent.appendRow(self.create_row(relpath, False))
+
+
+class TreeReadTask(QRunnable):
+    """Reads a single tree level for GitTreeModel"""
+
+    def __init__(self, notifier, path, objname):
+        QRunnable.__init__(self)
+        self.notifier = notifier
+        self.path = path
+        self.objname = objname
+
+    def run(self):
+        entries = None
+        try:
+            entries = git.object_reader().read_tree(self.objname)
+        except (IOError, OSError, ValueError):
+            pass
+        finally:
+            # Always report back so that the path is no longer pending
+            self.notifier.emit(SIGNAL('tree_read'), self.path, entries)
+            TaskRunner.current().cleanup_task(self)
 
 
 class GitTreeItem(QtGui.QStandardItem):
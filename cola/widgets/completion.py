@@ -8,10 +8,13 @@ from PyQt4 import QtGui
 from PyQt4.QtCore import Qt
 from PyQt4.QtCore import SIGNAL
 
-from cola import gitcmds
 from cola.i18n import N_
+from cola import core
+from cola import git
 from cola import qtutils
 from cola import utils
+from cola.models import completionindex
+from cola.models import completionqueue
 from cola.models import main
 from cola.widgets import defs
 from cola.widgets import text
@@ -150,23 +153,21 @@ class CompletionLineEdit(text.HintedLineEdit):
 
 
 class GatherCompletionsThread(QtCore.QThread):
+    """Runs a CompletionModel's queued queries until its queue is empty"""
 
     def __init__(self, model):
         QtCore.QThread.__init__(self)
         self.model = model
-        self.case_sensitive = False
 
     def run(self):
-        text = None
-        # Loop when the matched text changes between the start and end time.
-        # This happens when gather_matches() takes too long and the
-        # model's match_text changes in-between.
-        while text != self.model.match_text:
-            text = self.model.match_text
-            items = self.model.gather_matches(self.case_sensitive)
-
-        if text is not None:
-            self.emit(SIGNAL('items_gathered'), items)
+        queue = self.model.queue
+        while True:
+            query = queue.take()
+            if query is None:
+                break
+            items = queue.run(query, self.model.gather_matches)
+            if items is not None:
+                self.emit(SIGNAL('items_gathered'), query, items)
 
 
 class HighlightDelegate(QtGui.QStyledItemDelegate):
@@ -235,21 +236,31 @@ class HighlightDelegate(QtGui.QStyledItemDelegate):
         painter.restore()
 
 
-class CompletionModel(QtGui.QStandardItemModel):
+class CompletionModel(QtCore.QAbstractListModel):
+    """A list of completions that is replaced wholesale by each query
+
+    Rows are served from the list of matches, so applying a query's
+    results does not create an item per match.
+
+    """
 
     def __init__(self, parent):
-        QtGui.QStandardItemModel.__init__(self, parent)
+        QtCore.QAbstractListModel.__init__(self, parent)
         self.match_text = ''
         self.full_text = ''
         self.case_sensitive = False
+        self.queue = completionqueue.QueryQueue()
+        self._matches = []
+        self._ref_count = 0
+        self._dirs = frozenset()
+        self._icons = None
 
         self.update_thread = GatherCompletionsThread(self)
         self.connect(self.update_thread, SIGNAL('items_gathered'),
                      self.apply_matches)
 
     def update(self):
-        case_sensitive = self.update_thread.case_sensitive
-        self.update_matches(case_sensitive)
+        self.update_matches(self.case_sensitive)
 
     def set_match_text(self, full_text, match_text, case_sensitive):
         self.full_text = full_text
@@ -258,70 +269,70 @@ class CompletionModel(QtGui.QStandardItemModel):
 
     def update_matches(self, case_sensitive):
         self.case_sensitive = case_sensitive
-        self.update_thread.case_sensitive = case_sensitive
-        if not self.update_thread.isRunning():
+        start = self.queue.submit(self.match_text, self.full_text,
+                                  case_sensitive)
+        if start:
+            # The worker may still be returning after finding the queue empty
+            self.update_thread.wait()
             self.update_thread.start()
 
-    def gather_matches(self, case_sensitive):
-        return ((), (), set())
-
-    def apply_matches(self, match_tuple):
-        self.match_tuple = match_tuple
-        matched_refs, matched_paths, dirs = match_tuple
-        QStandardItem = QtGui.QStandardItem
-        file_icon = qtutils.file_icon()
-        dir_icon = qtutils.dir_icon()
-        git_icon = qtutils.git_icon()
-
-        items = []
-        for ref in matched_refs:
-            item = QStandardItem()
-            item.setText(ref)
-            item.setIcon(git_icon)
-            items.append(item)
-
-        for match in matched_paths:
-            item = QStandardItem()
-            item.setText(match)
-            if match in dirs:
-                item.setIcon(dir_icon)
-            else:
-                item.setIcon(file_icon)
-            items.append(item)
-
-        self.clear()
-        self.invisibleRootItem().appendRows(items)
-
-
-def filter_matches(match_text, candidates, case_sensitive):
-    """Filter candidates and return the matches"""
+    def gather_matches(self, query, cancelled):
+        """Return (refs, paths, dirs) for a query
 
-    if case_sensitive:
-        transform = lambda x: x
-        keyfunc = lambda x: x.replace('.', '')
-    else:
-        transform = lambda x: x.lower()
-        keyfunc = lambda x: x.replace('.', '').lower()
+        Runs in the worker thread.  `cancelled` returns True once a newer
+        query has been submitted.
 
-    if match_text:
-        matches = [r for r in candidates
-                    if transform(match_text) in transform(r)]
-    else:
-        matches = list(candidates)
-
-    matches.sort(key=keyfunc)
-    return matches
-
-
-def filter_path_matches(match_text, file_list, case_sensitive):
-    """Return matching completions from a list of candidate files"""
+        """
+        return ((), (), set())
 
-    files = set(file_list)
-    files_and_dirs = utils.add_parents(files)
-    dirs = files_and_dirs.difference(files)
+    def apply_matches(self, query, match_tuple):
+        if not self.queue.is_current(query.generation):
+            return
+        matched_refs, matched_paths, dirs = match_tuple
+        self.beginResetModel()
+        self._matches = list(matched_refs) + list(matched_paths)
+        self._ref_count = len(matched_refs)
+        self._dirs = dirs
+        self.endResetModel()
+        if git.GIT_COLA_TRACE:
+            core.stderr('completion "%s": %d matches in %.1fms '
+                        '(%.1fms queued, %d coalesced)' %
+                        (query.match_text, len(self._matches),
+                         query.latency * 1000, query.wait_time * 1000,
+                         query.coalesced))
+
+    def latency_stats(self):
+        """Return the latency counters of this model's queries"""
+        return self.queue.stats()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._matches)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        if not index.isValid() or row >= len(self._matches):
+            return QtCore.QVariant()
+        if role == Qt.DisplayRole or role == Qt.EditRole:
+            return QtCore.QVariant(self._matches[row])
+        if role == Qt.DecorationRole:
+            return QtCore.QVariant(self._icon(row))
+        return QtCore.QVariant()
+
+    def _icon(self, row):
+        if self._icons is None:
+            self._icons = (qtutils.git_icon(), qtutils.dir_icon(),
+                           qtutils.file_icon())
+        git_icon, dir_icon, file_icon = self._icons
+        if row < self._ref_count:
+            return git_icon
+        if self._matches[row] in self._dirs:
+            return dir_icon
+        return file_icon
 
-    paths = filter_matches(match_text, files_and_dirs, case_sensitive)
-    return (paths, dirs)
+    def dispose(self):
+        self.queue.cancel()
 
 
 class Completer(QtGui.QCompleter):
@@ -350,13 +361,24 @@ class GitCompletionModel(CompletionModel):
     def __init__(self, parent):
         CompletionModel.__init__(self, parent)
         self.main_model = model = main.model()
+        self._refs = None
+        self._ref_index = None
         msg = model.message_updated
         model.add_observer(msg, self.emit_update)
 
-    def gather_matches(self, case_sensitive):
-        refs = filter_matches(self.match_text, self.matches(), case_sensitive)
+    def gather_matches(self, query, cancelled):
+        refs = self.ref_index().search(query.match_text, query.case_sensitive,
+                                       cancelled=cancelled)
         return (refs, (), set())
 
+    def ref_index(self):
+        """Return the completion index of matches(), rebuilt on change"""
+        refs = self.matches()
+        if self._ref_index is None or refs != self._refs:
+            self._ref_index = completionindex.CompletionIndex(refs)
+            self._refs = refs
+        return self._ref_index
+
     def emit_update(self):
         try:
             self.emit(SIGNAL(UPDATE_SIGNAL))
@@ -367,6 +389,7 @@ class GitCompletionModel(CompletionModel):
         return []
 
     def dispose(self):
+        CompletionModel.dispose(self)
         self.main_model.remove_observer(self.emit_update)
 
 
@@ -408,15 +431,26 @@ class GitPathCompletionModel(GitCompletionModel):
 
     def __init__(self, parent):
         GitCompletionModel.__init__(self, parent)
+        self._paths = None
+        self._path_index = None
 
     def candidate_paths(self):
         return []
 
-    def gather_matches(self, case_sensitive):
-        paths, dirs = filter_path_matches(self.match_text,
-                                          self.candidate_paths(),
-                                          case_sensitive)
-        return ((), paths, dirs)
+    def path_index(self):
+        """Return the completion index of candidate_paths()"""
+        paths = self.candidate_paths()
+        if self._path_index is None or paths != self._paths:
+            self._path_index = completionindex.CompletionIndex(paths,
+                                                               parents=True)
+            self._paths = paths
+        return self._path_index
+
+    def gather_matches(self, query, cancelled):
+        index = self.path_index()
+        paths = index.search(query.match_text, query.case_sensitive,
+                             cancelled=cancelled)
+        return ((), paths, index.dirs)
 
 
 class GitStatusFilterCompletionModel(GitPathCompletionModel):
@@ -436,22 +470,20 @@ class GitLogCompletionModel(GitRefCompletionModel):
 
     def __init__(self, parent):
         GitRefCompletionModel.__init__(self, parent)
-        self.connect(self, SIGNAL(UPDATE_SIGNAL), self.gather_paths)
-        self._paths = []
-        self._updated = False
-
-    def gather_paths(self):
-        self._paths = gitcmds.tracked_files()
-
-    def gather_matches(self, case_sensitive):
-        if not self._paths:
-            self.gather_paths()
-        refs = filter_matches(self.match_text, self.matches(), case_sensitive)
-        paths, dirs = filter_path_matches(self.match_text, self._paths,
-                                          case_sensitive)
-        has_doubledash = (self.match_text == '--' or
-                          self.full_text.startswith('-- ') or
-                          ' -- ' in self.full_text)
+
+    def gather_matches(self, query, cancelled):
+        match_text = query.match_text
+        full_text = query.full_text
+        refs = self.ref_index().search(match_text, query.case_sensitive,
+                                       cancelled=cancelled)
+        # Rebuilt in this background thread when the git index changes
+        index = completionindex.tracked_paths().get()
+        paths = index.search(match_text, query.case_sensitive,
+                             cancelled=cancelled)
+        dirs = index.dirs
+        has_doubledash = (match_text == '--' or
+                          full_text.startswith('-- ') or
+                          ' -- ' in full_text)
         if has_doubledash:
             refs = []
         elif refs and paths:
@@ -1,6 +1,6 @@
 from __future__ import division, absolute_import, unicode_literals
 
-import collections
+import array
 import subprocess
 import math
 
@@ -16,8 +16,12 @@ from cola import difftool
 from cola import observable
 from cola import qtutils
 from cola.i18n import N_
+from cola.models import daglayout
 from cola.models.dag import DAG
-from cola.models.dag import RepoReader
+from cola.models.dagstore import StoreReader
+from cola.models.dagwindow import RowGraph
+from cola.models.dagwindow import RowWindow
+from cola.models.dagwindow import visible_rows
 from cola.widgets import completion
 from cola.widgets import defs
 from cola.widgets import standard
@@ -159,7 +163,7 @@ class ViewerMixin(object):
         has_single_selection = len(selected_items) == 1
         has_selection = bool(selected_items)
         can_diff = bool(commit and has_single_selection and
-                        commit is not selected_items[0].commit)
+                        commit != selected_items[0].commit)
 
         if can_diff:
             self.selected = selected_items[0].commit
@@ -220,6 +224,8 @@ class CommitTreeWidget(ViewerMixin, TreeWidget):
         self.notifier = notifier
         self.selecting = False
         self.commits = []
+        # Streamed commits arrive newest-first
+        self.newest_first = False
 
         self.action_up = qtutils.add_action(self, N_('Go Up'), self.go_up,
                                             Qt.Key_K)
@@ -293,13 +299,20 @@ class CommitTreeWidget(ViewerMixin, TreeWidget):
     def add_commits(self, commits):
         self.commits.extend(commits)
         items = []
-        for c in reversed(commits):
+        if self.newest_first:
+            ordered = commits
+        else:
+            ordered = reversed(commits)
+        for c in ordered:
             item = CommitTreeWidgetItem(c)
             items.append(item)
             self.sha1map[c.sha1] = item
             for tag in c.tags:
                 self.sha1map[tag] = item
-        self.insertTopLevelItems(0, items)
+        if self.newest_first:
+            self.addTopLevelItems(items)
+        else:
+            self.insertTopLevelItems(0, items)
 
     def create_patch(self):
         items = self.selectedItems()
@@ -307,6 +320,8 @@ class CommitTreeWidget(ViewerMixin, TreeWidget):
             return
         sha1s = [item.commit.sha1 for item in reversed(items)]
         all_sha1s = [c.sha1 for c in self.commits]
+        if self.newest_first:
+            all_sha1s.reverse()
         cmds.do(cmds.FormatPatch, sha1s, all_sha1s)
 
     # Qt overrides
@@ -323,6 +338,9 @@ class CommitTreeWidget(ViewerMixin, TreeWidget):
 class GitDAG(MainWindow):
     """The git-dag widget."""
 
+    # Histories larger than this are streamed into a virtualized view
+    stream_threshold = 10000
+
     def __init__(self, model, dag, parent=None, settings=None):
         MainWindow.__init__(self, parent)
 
@@ -341,6 +359,8 @@ class GitDAG(MainWindow):
         self.thread = ReaderThread(dag, self)
         self.revtext = completion.GitLogLineEdit()
         self.maxresults = standard.SpinBox()
+        # Large histories are streamed, see stream_threshold
+        self.maxresults.setMaximum(9999999)
 
         self.zoom_out = qtutils.create_action_button(
                 tooltip=N_('Zoom Out'),
@@ -362,7 +382,12 @@ class GitDAG(MainWindow):
         self.treewidget = CommitTreeWidget(notifier, self)
         self.diffwidget = DiffWidget(notifier, self)
         self.filewidget = FileWidget(notifier, self)
-        self.graphview = GraphView(notifier, self)
+        self.fullview = GraphView(notifier, self)
+        self.rowview = VirtualGraphView(notifier, self)
+        self.graphview = self.fullview
+        self.graph_stack = QtGui.QStackedWidget()
+        self.graph_stack.addWidget(self.fullview)
+        self.graph_stack.addWidget(self.rowview)
 
         self.controls_layout = qtutils.hbox(defs.no_margin, defs.spacing,
                                             self.revtext, self.maxresults)
@@ -389,7 +414,7 @@ class GitDAG(MainWindow):
         self.graph_controls_widget.setLayout(self.graph_controls_layout)
 
         self.graphview_dock = qtutils.create_dock(N_('Graph'), self)
-        self.graphview_dock.setWidget(self.graphview)
+        self.graphview_dock.setWidget(self.graph_stack)
         graph_titlebar = self.graphview_dock.titleBarWidget()
         graph_titlebar.add_corner_widget(self.graph_controls_widget)
 
@@ -432,10 +457,12 @@ class GitDAG(MainWindow):
         if not self.restore_state(settings=settings):
             self.resize_to_desktop()
 
-        qtutils.connect_button(self.zoom_out, self.graphview.zoom_out)
-        qtutils.connect_button(self.zoom_in, self.graphview.zoom_in)
+        qtutils.connect_button(self.zoom_out,
+                               lambda: self.graphview.zoom_out())
+        qtutils.connect_button(self.zoom_in,
+                               lambda: self.graphview.zoom_in())
         qtutils.connect_button(self.zoom_to_fit,
-                               self.graphview.zoom_to_fit)
+                               lambda: self.graphview.zoom_to_fit())
 
         self.thread.connect(self.thread, self.thread.commits_ready,
                             self.add_commits)
@@ -446,9 +473,18 @@ class GitDAG(MainWindow):
         self.connect(self.treewidget, SIGNAL('diff_commits'),
                      self.diff_commits)
 
-        self.connect(self.graphview, SIGNAL('diff_commits'),
+        self.connect(self.fullview, SIGNAL('diff_commits'),
+                     self.diff_commits)
+
+        self.connect(self.rowview, SIGNAL('diff_commits'),
                      self.diff_commits)
 
+        self.connect(self.rowview, SIGNAL('rows_needed'),
+                     self.thread.request)
+
+        self.connect(self.treewidget.verticalScrollBar(),
+                     SIGNAL('valueChanged(int)'), self.tree_scrolled)
+
         self.connect(self.maxresults, SIGNAL('editingFinished()'),
                      self.display)
 
@@ -519,16 +555,37 @@ class GitDAG(MainWindow):
         self.thread.stop()
         self.dag.set_ref(new_ref)
         self.dag.set_count(new_count)
+        self.set_streaming(new_count > self.stream_threshold)
 
         self.clear()
         self.thread.start()
 
+    def set_streaming(self, streaming):
+        """Switch between the full and the virtualized graph views"""
+        self.thread.streaming = streaming
+        self.treewidget.newest_first = streaming
+        if streaming:
+            self.graphview = self.rowview
+        else:
+            self.graphview = self.fullview
+        self.graph_stack.setCurrentWidget(self.graphview)
+
+    def tree_scrolled(self, value):
+        """Page in more history when the log is scrolled to the end"""
+        if not self.thread.streaming:
+            return
+        scrollbar = self.treewidget.verticalScrollBar()
+        if value >= scrollbar.maximum() - scrollbar.pageStep():
+            self.thread.request(len(self.commit_list) +
+                                ReaderThread.batch_size)
+
     def show(self):
         MainWindow.show(self)
         self.treewidget.adjust_columns()
 
     def clear(self):
-        self.graphview.clear()
+        self.fullview.clear()
+        self.rowview.clear()
         self.treewidget.clear()
         self.commits.clear()
         self.commit_list = []
@@ -542,11 +599,23 @@ class GitDAG(MainWindow):
                 self.commits[tag] = commit_obj
         self.graphview.add_commits(commits)
         self.treewidget.add_commits(commits)
+        # Streamed views are usable as soon as the first page arrives
+        if self.thread.streaming and len(self.commit_list) == len(commits):
+            self.show_initial_view()
 
     def thread_done(self):
+        if self.thread.streaming:
+            self.graphview.update_scene_rect()
+        else:
+            self.show_initial_view()
+
+    def show_initial_view(self):
         self.graphview.setFocus()
         try:
-            commit_obj = self.commit_list[-1]
+            if self.thread.streaming:
+                commit_obj = self.commit_list[0]
+            else:
+                commit_obj = self.commit_list[-1]
         except IndexError:
             return
         self.notifier.notify_observers(COMMITS_SELECTED, [commit_obj])
@@ -586,19 +655,24 @@ class GitDAG(MainWindow):
 class ReaderThread(QtCore.QThread):
     commits_ready = SIGNAL('commits_ready')
     done = SIGNAL('done')
+    batch_size = 512
 
     def __init__(self, dag, parent):
         QtCore.QThread.__init__(self, parent)
         self.dag = dag
+        # Streaming readers read newest-first and only as far as requested
+        self.streaming = False
+        self._limit = 0
         self._abort = False
         self._stop = False
         self._mutex = QtCore.QMutex()
         self._condition = QtCore.QWaitCondition()
 
     def run(self):
-        repo = RepoReader(self.dag)
+        repo = StoreReader(self.dag, reverse=not self.streaming)
         repo.reset()
         commits = []
+        count = 0
         for c in repo:
             self._mutex.lock()
             if self._stop:
@@ -608,17 +682,39 @@ class ReaderThread(QtCore.QThread):
                 repo.reset()
                 return
             commits.append(c)
-            if len(commits) >= 512:
+            count += 1
+            if (len(commits) >= self.batch_size or
+                    (self.streaming and count >= self._limit)):
                 self.emit(self.commits_ready, commits)
                 commits = []
+                if not self._wait_for_request(count):
+                    repo.reset()
+                    return
 
         if commits:
             self.emit(self.commits_ready, commits)
         self.emit(self.done)
 
+    def _wait_for_request(self, count):
+        """Block a streaming reader until more commits are requested"""
+        self._mutex.lock()
+        while self.streaming and count >= self._limit and not self._abort:
+            self._condition.wait(self._mutex)
+        self._mutex.unlock()
+        return not self._abort
+
+    def request(self, count):
+        """Ask a streaming reader to read at least `count` commits"""
+        self._mutex.lock()
+        if count > self._limit:
+            self._limit = count
+            self._condition.wakeAll()
+        self._mutex.unlock()
+
     def start(self):
         self._abort = False
         self._stop = False
+        self._limit = self.batch_size * 2
         QtCore.QThread.start(self)
 
     def pause(self):
@@ -633,7 +729,10 @@ class ReaderThread(QtCore.QThread):
         self._condition.wakeOne()
 
     def stop(self):
+        self._mutex.lock()
         self._abort = True
+        self._condition.wakeAll()
+        self._mutex.unlock()
         self.wait()
 
 
@@ -811,29 +910,45 @@ class Commit(QtGui.QGraphicsItem):
 
         QtGui.QGraphicsItem.__init__(self)
 
-        self.commit = commit
         self.notifier = notifier
 
         self.setZValue(0)
         self.setFlag(selectable)
         self.setCursor(cursor)
+
+        self.label = None
+        self.set_commit(commit, xpos=xpos,
+                        cached_commit_color=cached_commit_color,
+                        cached_merge_color=cached_merge_color)
+
+        self.pressed = False
+        self.dragged = False
+
+    def set_commit(self, commit,
+                   xpos=commit_radius/2.0 + 1.0,
+                   cached_commit_color=commit_color,
+                   cached_merge_color=merge_color):
+        """Display a commit; items can be reused for other commits"""
+        self.commit = commit
         self.setToolTip(commit.sha1[:7] + ': ' + commit.summary)
 
+        label = self.label
+        if label is not None:
+            scene = label.scene()
+            if scene is not None:
+                scene.removeItem(label)
+            self.label = None
+
         if commit.tags:
             self.label = label = Label(commit)
             label.setParentItem(self)
             label.setPos(xpos, -self.commit_radius/2.0)
-        else:
-            self.label = None
 
         if len(commit.parents) > 1:
             self.brush = cached_merge_color
         else:
             self.brush = cached_commit_color
 
-        self.pressed = False
-        self.dragged = False
-
     def blockSignals(self, blocked):
         self.notifier.notification_enabled = not blocked
 
@@ -905,6 +1020,60 @@ class Commit(QtGui.QGraphicsItem):
         self.dragged = False
 
 
+class RowItem(Commit):
+    """A recyclable Commit item that also draws the lanes below its row"""
+
+    lane_pens = {}
+
+    def __init__(self, commit, notifier, lane, segments):
+        self.bound = Commit.item_bbox
+        self.lines = []
+        Commit.__init__(self, commit, notifier)
+        self.set_row(commit, lane, segments)
+
+    @classmethod
+    def lane_pen(cls, lane):
+        try:
+            return cls.lane_pens[lane]
+        except KeyError:
+            colors = EdgeColor.colors
+            color = QtGui.QColor(colors[lane % len(colors)])
+            color.setAlpha(128)
+            pen = QtGui.QPen(color, 4.0, Qt.SolidLine,
+                             Qt.SquareCap, Qt.RoundJoin)
+            cls.lane_pens[lane] = pen
+            return pen
+
+    def set_row(self, commit, lane, segments):
+        """Display a commit in a lane along with its outgoing segments"""
+        self.prepareGeometryChange()
+        if commit != self.commit:
+            self.set_commit(commit)
+
+        x_off = GraphView.x_off
+        y_off = GraphView.y_off
+        bound = QRectF(Commit.item_bbox)
+        lines = []
+        for source, target in segments:
+            line = QtCore.QLineF((source - lane) * x_off, 0.0,
+                                 (target - lane) * x_off, y_off)
+            pen = self.lane_pen(target)
+            lines.append((line, pen))
+            rect = QRectF(line.p1(), line.p2()).normalized()
+            bound = bound.united(rect.adjusted(-2.0, -2.0, 2.0, 2.0))
+        self.lines = lines
+        self.bound = bound
+
+    def boundingRect(self):
+        return self.bound
+
+    def paint(self, painter, option, widget):
+        for line, pen in self.lines:
+            painter.setPen(pen)
+            painter.drawLine(line)
+        Commit.paint(self, painter, option, widget)
+
+
 class Label(QtGui.QGraphicsItem):
     item_type = QtGui.QGraphicsItem.UserType + 3
 
@@ -986,6 +1155,8 @@ class GraphView(ViewerMixin, QtGui.QGraphicsView):
     x_off = 18
     y_off = 24
 
+    default_layout = 'lanes'
+
     def __init__(self, notifier, parent):
         QtGui.QGraphicsView.__init__(self, parent)
         ViewerMixin.__init__(self)
@@ -1000,7 +1171,8 @@ class GraphView(ViewerMixin, QtGui.QGraphicsView):
         self.items = {}
         self.saved_matrix = QtGui.QMatrix(self.matrix())
 
-        self.x_offsets = collections.defaultdict(int)
+        self.layout_engine = None
+        self.set_layout_engine(self.default_layout)
 
         self.is_panning = False
         self.pressed = False
@@ -1047,7 +1219,7 @@ class GraphView(ViewerMixin, QtGui.QGraphicsView):
         self.scene().clear()
         self.selection_list = []
         self.items.clear()
-        self.x_offsets.clear()
+        self.layout_engine.reset()
         self.x_max = 0
         self.y_min = 0
         self.commits = []
@@ -1359,54 +1531,16 @@ class GraphView(ViewerMixin, QtGui.QGraphicsView):
             item.setPos(x, y)
 
     def position_nodes(self, nodes):
-        positions = {}
-
-        x_max = self.x_max
-        y_min = self.y_min
-        x_off = self.x_off
-        y_off = self.y_off
-        x_offsets = self.x_offsets
-
-        for node in nodes:
-            generation = node.generation
-            sha1 = node.sha1
-
-            if node.is_fork():
-                # This is a fan-out so sweep over child generations and
-                # shift them to the right to avoid overlapping edges
-                child_gens = [c.generation for c in node.children]
-                maxgen = max(child_gens)
-                for g in range(generation + 1, maxgen):
-                    x_offsets[g] += x_off
-
-            if len(node.parents) == 1:
-                # Align nodes relative to their parents
-                parent_gen = node.parents[0].generation
-                parent_off = x_offsets[parent_gen]
-                x_offsets[generation] = max(parent_off-x_off,
-                                            x_offsets[generation])
-
-            cur_xoff = x_offsets[generation]
-            next_xoff = cur_xoff
-            next_xoff += x_off
-            x_offsets[generation] = next_xoff
-
-            x_pos = cur_xoff
-            y_pos = -generation * y_off
-
-            y_pos = min(y_pos, y_min - y_off)
-
-            #y_pos = y_off
-            positions[sha1] = (x_pos, y_pos)
-
-            x_max = max(x_max, x_pos)
-            y_min = y_pos
-
-        self.x_max = x_max
-        self.y_min = y_min
-
+        positions = self.layout_engine.append(nodes)
+        self.x_max = self.layout_engine.x_max
+        self.y_min = self.layout_engine.y_min
         return positions
 
+    def set_layout_engine(self, name):
+        """Select a layout engine from daglayout.LAYOUTS"""
+        self.layout_engine = daglayout.new_layout(name, self.x_off,
+                                                  self.y_off)
+
     def update_scene_rect(self):
         y_min = self.y_min
         x_max = self.x_max
@@ -1465,3 +1599,210 @@ class GraphView(ViewerMixin, QtGui.QGraphicsView):
             self.wheel_zoom(event)
         else:
             self.wheel_pan(event)
+
+
+class VirtualGraphView(GraphView):
+    """A GraphView that only creates items for rows near the viewport
+
+    Commits are streamed newest-first and laid out one row per commit
+    by a RowGraph.  Items that scroll out of view are hidden and reused
+    for the rows that scroll into view, so the number of graphics items
+    stays bounded by the size of the viewport.
+
+    """
+    # Rows materialized above and below the viewport
+    margin_rows = 32
+    # Rows read ahead of the viewport
+    prefetch_rows = 1024
+    # Upper bound on materialized rows, e.g. when zoomed far out
+    max_rows = 4096
+
+    def __init__(self, notifier, parent):
+        GraphView.__init__(self, notifier, parent)
+        self.rows = RowGraph()
+        self.window = RowWindow()
+        self.row_items = {}
+        self.pool = []
+        self.store = None
+        self.row_ids = array.array('I')     # row -> commit id
+        self.id_rows = array.array('i')     # commit id -> row
+
+    def clear(self):
+        GraphView.clear(self)
+        self.rows.reset()
+        self.window.reset()
+        self.row_items.clear()
+        self.pool = []
+        self.store = None
+        self.row_ids = array.array('I')
+        self.id_rows = array.array('i')
+
+    def add_commits(self, commits):
+        """Append newest-first commits as new rows"""
+        rows = self.rows
+        last_row = len(rows) - 1
+        for commit in commits:
+            store = self.store = commit.store
+            commit_id = commit.id
+            row = rows.append(commit_id, store.parent_ids(commit_id))
+            self.row_ids.append(commit_id)
+            missing = commit_id + 1 - len(self.id_rows)
+            if missing > 0:
+                self.id_rows.extend([-1] * missing)
+            self.id_rows[commit_id] = row
+
+        # The segments below the previous last row are now known
+        if last_row in self.row_items:
+            self._update_item(last_row, self.row_items[last_row])
+
+        self.update_scene_rect()
+        self.update_window()
+
+    def row_for(self, commit):
+        """Return the row for a commit or -1"""
+        store = self.store
+        if store is None:
+            return -1
+        commit_id = store.lookup(commit.sha1)
+        if commit_id is None or commit_id >= len(self.id_rows):
+            return -1
+        return self.id_rows[commit_id]
+
+    def update_window(self, *args):
+        """Create items for rows near the viewport and recycle the rest"""
+        total = len(self.rows)
+        if not total:
+            return
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        start, stop = visible_rows(rect.top(), rect.bottom(), self.y_off,
+                                   margin=self.margin_rows)
+        if stop + self.prefetch_rows > total:
+            self.emit(SIGNAL('rows_needed'), stop + self.prefetch_rows)
+
+        stop = min(stop, total, start + self.max_rows)
+        added = self.window.update(start, stop)[1]
+
+        window = self.window
+        for row in [r for r in self.row_items if r not in window]:
+            self._release(row)
+        for row in added:
+            self.ensure_row(row)
+
+    def ensure_row(self, row):
+        """Return the item for a row, creating it when needed"""
+        try:
+            return self.row_items[row]
+        except KeyError:
+            pass
+        commit = self.store.commit(self.row_ids[row])
+        if self.pool:
+            item = self.pool.pop()
+            self._update_item(row, item, commit=commit)
+            item.show()
+        else:
+            lane = self.rows.lane(row)
+            item = RowItem(commit, self.notifier, lane,
+                           self.rows.segments(row))
+            item.setPos(lane * self.x_off, row * self.y_off)
+            self.scene().addItem(item)
+        self.row_items[row] = item
+        self.items[commit.sha1] = item
+        for ref in commit.tags:
+            self.items[ref] = item
+        return item
+
+    def _update_item(self, row, item, commit=None):
+        if commit is None:
+            commit = item.commit
+        lane = self.rows.lane(row)
+        item.set_row(commit, lane, self.rows.segments(row))
+        item.setPos(lane * self.x_off, row * self.y_off)
+
+    def _release(self, row):
+        item = self.row_items[row]
+        # Selected items are kept so that the selection survives scrolling
+        if item.isSelected():
+            return
+        del self.row_items[row]
+        commit = item.commit
+        self.items.pop(commit.sha1, None)
+        for ref in commit.tags:
+            if self.items.get(ref) is item:
+                del self.items[ref]
+        item.hide()
+        self.pool.append(item)
+
+    def select(self, sha1s):
+        """Select commits, creating their items when needed"""
+        store = self.store
+        if store is not None:
+            for sha1 in sha1s:
+                commit_id = store.lookup(sha1)
+                if commit_id is not None and commit_id < len(self.id_rows):
+                    row = self.id_rows[commit_id]
+                    if row >= 0:
+                        self.ensure_row(row)
+        GraphView.select(self, sha1s)
+
+    def get_item_by_generation(self, commits, criteria_fn):
+        """Return the item for the commit matching criteria"""
+        # Rows grow with age, so -row orders commits like generations
+        best = None
+        for commit in commits:
+            row = self.row_for(commit)
+            if row < 0:
+                continue
+            if best is None or criteria_fn(-best, -row):
+                best = row
+        if best is None:
+            return None
+        return self.ensure_row(best)
+
+    def sort_by_generation(self, commits):
+        commits.sort(key=lambda x: -self.row_for(x))
+        return commits
+
+    def create_patch(self):
+        items = self.selected_items()
+        if not items:
+            return
+        selected_commits = self.sort_by_generation([n.commit for n in items])
+        sha1s = [c.sha1 for c in selected_commits]
+        store = self.store
+        all_sha1s = [store.sha1(i) for i in reversed(self.row_ids)]
+        cmds.do(cmds.FormatPatch, sha1s, all_sha1s)
+
+    def set_initial_view(self):
+        count = min(8, len(self.rows))
+        items = [self.ensure_row(row) for row in range(count)]
+        self.fit_view_to_items(items)
+        self.update_window()
+
+    def update_scene_rect(self):
+        x_adjust = GraphView.x_adjust
+        y_adjust = GraphView.y_adjust
+        width = max(1, self.rows.width) * self.x_off
+        height = max(1, len(self.rows)) * self.y_off
+        self.scene().setSceneRect(-x_adjust, -y_adjust,
+                                  width + x_adjust*2, height + y_adjust*2)
+
+    def pan(self, event):
+        GraphView.pan(self, event)
+        self.update_window()
+
+    def scale_view(self, scale):
+        GraphView.scale_view(self, scale)
+        self.update_window()
+
+    # Qt overrides
+    def scrollContentsBy(self, dx, dy):
+        GraphView.scrollContentsBy(self, dx, dy)
+        self.update_window()
+
+    def resizeEvent(self, event):
+        GraphView.resizeEvent(self, event)
+        self.update_window()
+
+    def wheelEvent(self, event):
+        GraphView.wheelEvent(self, event)
+        self.update_window()
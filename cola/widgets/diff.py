@@ -1,17 +1,23 @@
 from __future__ import division, absolute_import, unicode_literals
 
+import collections
+import os
+import time
+
 from PyQt4 import QtCore
 from PyQt4 import QtGui
 from PyQt4.QtCore import Qt, SIGNAL
 
 from cola import cmds
 from cola import core
+from cola import diffstream
 from cola import gitcmds
 from cola import gravatar
 from cola import qtutils
 from cola.cmds import run
 from cola.i18n import N_
 from cola.models import main
+from cola.models import prefs
 from cola.models import selection
 from cola.qtutils import add_action
 from cola.qtutils import create_action_button
@@ -48,10 +54,29 @@ class DiffEditorWidget(QtGui.QWidget):
 
 class DiffEditor(DiffTextEdit):
 
+    # Streamed diffs are appended in batches of lines for at most
+    # stream_time_slice seconds per event loop iteration
+    stream_batch_size = 2000
+    stream_time_slice = 0.02
+
     def __init__(self, parent, titlebar):
         DiffTextEdit.__init__(self, parent)
         self.model = model = main.model()
 
+        # The text last passed to setPlainText()
+        self.plain_text = ''
+
+        # Streaming mode state
+        self.streaming = False
+        self.stream = None
+        self.stream_args = None
+        self.stream_reader = None
+        self.stream_lines = collections.deque()
+        self.stream_appended = 0
+        self.stream_timer = QtCore.QTimer(self)
+        self.stream_timer.setSingleShot(True)
+        self.stream_timer.setInterval(0)
+
         # "Diff Options" tool menu
         self.diff_ignore_space_at_eol_action = add_action(self,
                 N_('Ignore changes in whitespace at EOL'),
@@ -73,6 +98,12 @@ class DiffEditor(DiffTextEdit):
                 self._update_diff_opts)
         self.diff_function_context_action.setCheckable(True)
 
+        self.diff_truncate_action = add_action(self,
+                N_('Truncate large diffs'),
+                self._update_truncation)
+        self.diff_truncate_action.setCheckable(True)
+        self.diff_truncate_action.setChecked(True)
+
         self.diffopts_button = create_action_button(
                 tooltip=N_('Diff Options'), icon=options_icon())
         self.diffopts_menu = create_menu(N_('Diff Options'),
@@ -82,9 +113,17 @@ class DiffEditor(DiffTextEdit):
         self.diffopts_menu.addAction(self.diff_ignore_space_change_action)
         self.diffopts_menu.addAction(self.diff_ignore_all_space_action)
         self.diffopts_menu.addAction(self.diff_function_context_action)
+        self.diffopts_menu.addSeparator()
+        self.diffopts_menu.addAction(self.diff_truncate_action)
         self.diffopts_button.setMenu(self.diffopts_menu)
         qtutils.hide_button_menu_indicator(self.diffopts_button)
 
+        # Hunk index for streamed diffs
+        self.hunk_combo = QtGui.QComboBox()
+        self.hunk_combo.setToolTip(N_('Go to diff hunk'))
+        self.hunk_combo.hide()
+
+        titlebar.add_corner_widget(self.hunk_combo)
         titlebar.add_corner_widget(self.diffopts_button)
 
         self.action_apply_selection = qtutils.add_action(self, '',
@@ -106,12 +145,111 @@ class DiffEditor(DiffTextEdit):
         self.launch_difftool.setIcon(qtutils.git_icon())
 
         model.add_observer(model.message_diff_text_changed, self._emit_text)
+        model.add_observer(model.message_diff_stream, self._emit_stream)
 
         self.connect(self, SIGNAL('set_text'), self.setPlainText)
+        self.connect(self, SIGNAL('stream_diff'), self.stream_diff)
+        self.connect(self.stream_timer, SIGNAL('timeout()'),
+                     self._append_stream_lines)
+        self.connect(self.hunk_combo, SIGNAL('activated(int)'),
+                     self._goto_hunk)
 
     def _emit_text(self, text):
         self.emit(SIGNAL('set_text'), text)
 
+    def _emit_stream(self, command, encoding, deleted):
+        self.emit(SIGNAL('stream_diff'), command, encoding, deleted)
+
+    def stream_diff(self, command, encoding, deleted=False):
+        """Read a huge diff from a command and display it incrementally"""
+        self._stop_stream()
+        self.streaming = True
+        self.stream_args = (command, encoding, deleted)
+        max_file_size = 0
+        if self.diff_truncate_action.isChecked():
+            max_file_size = prefs.diff_max_file_size()
+        self.stream = diffstream.DiffStream(max_file_size=max_file_size,
+                                            deleted=deleted,
+                                            encoding=encoding)
+        self.stream_appended = 0
+        self.hunk_combo.clear()
+        self.hunk_combo.show()
+        self.plain_text = None
+        DiffTextEdit.setPlainText(self, '')
+
+        reader = self.stream_reader = DiffStreamReader(command, self)
+        self.connect(reader, SIGNAL('chunk'), self._stream_chunk)
+        self.connect(reader, SIGNAL('stream_done'), self._stream_done)
+        self.connect(reader, SIGNAL('finished()'), reader.deleteLater)
+        reader.start()
+
+    def _stop_stream(self):
+        reader = self.stream_reader
+        self.stream_reader = None
+        if reader is not None:
+            reader.stop()
+        self.stream_timer.stop()
+        self.stream_lines.clear()
+
+    def _stream_chunk(self, reader, data):
+        if reader is self.stream_reader:
+            self._queue_stream_lines(self.stream.feed(data))
+
+    def _stream_done(self, reader):
+        if reader is self.stream_reader:
+            self.stream_reader = None
+            self._queue_stream_lines(self.stream.finish())
+
+    def _queue_stream_lines(self, lines):
+        self.stream_lines.extend(lines)
+        hunks = self.stream.hunks
+        for idx in range(self.hunk_combo.count(), len(hunks)):
+            self.hunk_combo.addItem(hunks[idx][1][:80])
+        if self.stream_lines and not self.stream_timer.isActive():
+            self.stream_timer.start()
+
+    def _append_stream_lines(self, count=None):
+        """Append queued lines until the time slice or count is used up"""
+        lines = self.stream_lines
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        deadline = time.time() + self.stream_time_slice
+        while lines:
+            if count is None:
+                if time.time() > deadline:
+                    break
+                size = min(len(lines), self.stream_batch_size)
+            elif count <= 0:
+                break
+            else:
+                size = min(len(lines), count)
+                count -= size
+            batch = [lines.popleft() for i in range(size)]
+            text = '\n'.join(batch)
+            if self.stream_appended:
+                text = '\n' + text
+            cursor.insertText(text)
+            self.stream_appended += size
+        if lines and not self.stream_timer.isActive():
+            self.stream_timer.start()
+
+    def _goto_hunk(self, idx):
+        """Scroll to a hunk, appending the text up to it if needed"""
+        if self.stream is None or idx < 0 or idx >= len(self.stream.hunks):
+            return
+        line = self.stream.hunks[idx][0]
+        self._append_stream_lines(count=line + 1 - self.stream_appended)
+        block = self.document().findBlockByNumber(line)
+        if not block.isValid():
+            return
+        self.setTextCursor(QtGui.QTextCursor(block))
+        self.ensureCursorVisible()
+
+    def _update_truncation(self):
+        """Re-read the streamed diff when truncation is toggled"""
+        if self.streaming and self.stream_args is not None:
+            self.stream_diff(*self.stream_args)
+
     def _update_diff_opts(self):
         space_at_eol = self.diff_ignore_space_at_eol_action.isChecked()
         space_change = self.diff_ignore_space_change_action.isChecked()
@@ -131,7 +269,8 @@ class DiffEditor(DiffTextEdit):
         s = selection.selection()
         filename = selection.filename()
 
-        if s.modified and self.model.stageable():
+        # Streamed diffs may be truncated and are display-only
+        if s.modified and self.model.stageable() and not self.streaming:
             if s.modified[0] in main.model().submodules:
                 action = menu.addAction(qtutils.icon('add.svg'),
                                         cmds.Stage.name(),
@@ -157,7 +296,7 @@ class DiffEditor(DiffTextEdit):
                 menu.addAction(self.action_apply_selection)
                 menu.addAction(self.action_revert_selection)
 
-        if s.staged and self.model.unstageable():
+        if s.staged and self.model.unstageable() and not self.streaming:
             if s.staged[0] in main.model().submodules:
                 action = menu.addAction(qtutils.icon('remove.svg'),
                                         cmds.Unstage.name(),
@@ -223,6 +362,13 @@ class DiffEditor(DiffTextEdit):
 
     def setPlainText(self, text):
         """setPlainText(str) while retaining scrollbar positions"""
+        if self.streaming:
+            self._stop_stream()
+            self.streaming = False
+            self.stream = None
+            self.stream_args = None
+            self.hunk_combo.hide()
+
         mode = self.model.mode
         highlight = (mode != self.model.mode_none and
                      mode != self.model.mode_untracked)
@@ -238,7 +384,8 @@ class DiffEditor(DiffTextEdit):
             return
 
         offset, selection_text = self.offset_and_selection()
-        old_text = ustr(self.toPlainText())
+        old_text = self.plain_text
+        self.plain_text = text
 
         DiffTextEdit.setPlainText(self, text)
 
@@ -272,23 +419,23 @@ class DiffEditor(DiffTextEdit):
         return offset, selection_text
 
     def selected_lines(self):
-        cursor = self.textCursor()
-        selection_start = cursor.selectionStart()
-        selection_end = cursor.selectionEnd()
-
-        line_start = 0
-        for line_idx, line in enumerate(ustr(self.toPlainText()).split('\n')):
-            line_end = line_start + len(line)
-            if line_start <= selection_start <= line_end:
-                first_line_idx = line_idx
-            if line_start <= selection_end <= line_end:
-                last_line_idx = line_idx
-                break
-            line_start = line_end + 1
+        """Return the first and last line indexes of the selection
 
+        Each line of the diff is a block of the document, so the
+        document's block index maps cursor positions to diff lines.
+        Cursor positions count UTF-16 code units, not Python characters.
+
+        """
+        cursor = self.textCursor()
+        doc = self.document()
+        first_line_idx = doc.findBlock(cursor.selectionStart()).blockNumber()
+        last_line_idx = doc.findBlock(cursor.selectionEnd()).blockNumber()
         return first_line_idx, last_line_idx
 
     def apply_selection(self):
+        if self.streaming:
+            # Streamed diffs may be truncated and are display-only
+            return
         s = selection.single_selection()
         if self.model.stageable() and s.modified:
             self.process_diff_selection()
@@ -297,6 +444,8 @@ class DiffEditor(DiffTextEdit):
 
     def revert_selection(self):
         """Destructively revert selected lines or hunk from a worktree file."""
+        if self.streaming:
+            return
 
         if self.has_selection():
             title = N_('Revert Selected Lines?')
@@ -325,6 +474,47 @@ class DiffEditor(DiffTextEdit):
 
 
 
+class DiffStreamReader(QtCore.QThread):
+    """Reads the output of a diff command in chunks"""
+
+    chunk_size = 65536
+
+    def __init__(self, command, parent):
+        QtCore.QThread.__init__(self, parent)
+        self.command = command
+        self.proc = None
+        self.stopped = False
+
+    def run(self):
+        # stderr is discarded: an unread pipe could fill up and block git
+        try:
+            with open(os.devnull, 'wb') as devnull:
+                proc = self.proc = core.start_command(self.command,
+                                                      stderr=devnull)
+        except (IOError, OSError):
+            self.emit(SIGNAL('stream_done'), self)
+            return
+        fd = proc.stdout.fileno()
+        while not self.stopped:
+            data = os.read(fd, self.chunk_size)
+            if not data:
+                break
+            self.emit(SIGNAL('chunk'), self, data)
+        self.stop()
+        proc.stdout.close()
+        proc.wait()
+        self.emit(SIGNAL('stream_done'), self)
+
+    def stop(self):
+        self.stopped = True
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+
 class DiffWidget(QtGui.QWidget):
 
     def __init__(self, notifier, parent):
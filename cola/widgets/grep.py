@@ -6,12 +6,15 @@ from PyQt4.QtCore import Qt
 from PyQt4.QtCore import SIGNAL
 
 from cola import cmds
-from cola import utils
+from cola import core
+from cola import grepstream
 from cola import qtutils
+from cola import utils
 from cola.cmds import do
-from cola.git import git
+from cola.git import GIT_COLA_TRACE
 from cola.i18n import N_
 from cola.qtutils import diff_font
+from cola.widgets import completion
 from cola.widgets import defs
 from cola.widgets.standard import Dialog
 from cola.widgets.text import HintedTextView, HintedLineEdit
@@ -39,27 +42,63 @@ def goto_grep(line):
     do(cmds.Edit, [filename], line_number=line_number)
 
 
-class GrepThread(QtCore.QThread):
+class GrepReader(QtCore.QThread):
+    """Runs a sharded "git grep" and reads its merged output
+
+    The reader stops reading while its stream is full, which leaves the
+    "git grep" processes blocked on their output until more results are
+    asked for or the reader is stopped.
+
+    """
 
-    def __init__(self, parent):
+    def __init__(self, query, stream, parent, shell=False,
+                 regexp_mode='--basic-regexp', revisions=()):
         QtCore.QThread.__init__(self, parent)
-        self.query = None
-        self.shell = False
-        self.regexp_mode = '--basic-regexp'
+        self.query = query
+        self.shell = shell
+        self.regexp_mode = regexp_mode
+        self.revisions = revisions
+        self.stream = stream
+        self.engine = None
+        self.stopped = False
 
     def run(self):
-        if self.query is None:
+        shards = grepstream.grep_shards(self.query, shell=self.shell,
+                                        regexp_mode=self.regexp_mode,
+                                        revisions=self.revisions)
+        engine = self.engine = grepstream.ShardedGrep(shards)
+        if self.stopped:
             return
-        query = self.query
-        if self.shell:
-            args = utils.shell_split(query)
+        stream = self.stream
+        engine.start()
+        eof = False
+        for data in engine.chunks():
+            if self.stopped or not stream.wait_for_room():
+                break
+            lines = stream.feed(data)
+            if lines:
+                self.emit(SIGNAL('lines'), self, lines)
         else:
-            args = [query]
-        status, out, err = git.grep(self.regexp_mode, n=True, *args)
-        if query == self.query:
-            self.emit(SIGNAL('result'), status, out, err)
-        else:
-            self.run()
+            eof = not self.stopped
+        if not eof:
+            self.stop()
+            return
+        lines = stream.finish()
+        if lines:
+            self.emit(SIGNAL('lines'), self, lines)
+        engine.join()
+        if GIT_COLA_TRACE:
+            for label, elapsed, status in engine.timings():
+                core.stderr('grep shard %s -> %s: %.1fms' %
+                            (label, status, elapsed * 1000))
+        self.emit(SIGNAL('grep_done'), self, engine.status(), engine.errors())
+
+    def stop(self):
+        self.stopped = True
+        self.stream.close()
+        engine = self.engine
+        if engine is not None:
+            engine.stop()
 
 
 class Grep(Dialog):
@@ -96,6 +135,13 @@ class Grep(Dialog):
         combo.setItemData(1, '--extended-regexp', Qt.UserRole)
         combo.setItemData(2, '--fixed-strings', Qt.UserRole)
 
+        self.revisions_txt = completion.GitRefLineEdit(
+                hint=N_('revisions (optional)'), parent=self)
+        self.revisions_txt.setToolTip(
+                N_('Search these branches or revisions instead of the '
+                   'worktree.\nPress Enter to search.'))
+        self.revisions_txt.enable_hint(True)
+
         self.result_txt = GrepTextView(N_('grep result...'), self)
         self.result_txt.enable_hint(True)
 
@@ -114,26 +160,34 @@ class Grep(Dialog):
                    'Queries with spaces will require "double quotes".'))
         self.shell_checkbox.setChecked(False)
 
+        self.more_button = QtGui.QPushButton(N_('Show More'))
+        self.more_button.setToolTip(
+                N_('Show the next %d results') % grepstream.MAX_RESULTS)
+        self.more_button.hide()
+
         self.close_button = QtGui.QPushButton(N_('Close'))
 
         self.input_layout = qtutils.hbox(defs.no_margin, defs.button_spacing,
                                          self.input_label, self.input_txt,
+                                         self.revisions_txt,
                                          self.regexp_combo)
 
         self.bottom_layout = qtutils.hbox(defs.no_margin, defs.button_spacing,
                                           self.edit_button, self.refresh_button,
                                           self.shell_checkbox, qtutils.STRETCH,
-                                          self.close_button)
+                                          self.more_button, self.close_button)
 
         self.mainlayout = qtutils.vbox(defs.margin, defs.no_spacing,
                                        self.input_layout, self.result_txt,
                                        self.bottom_layout)
         self.setLayout(self.mainlayout)
 
-        self.grep_thread = GrepThread(self)
-
-        self.connect(self.grep_thread, SIGNAL('result'),
-                     self.process_result)
+        self.grep_reader = None
+        self.grep_stream = None
+        self.grep_revisions = []
+        # The previous results stay up until the new query has output
+        self.replace_results = False
+        self.saved_position = (None, 0)
 
         self.connect(self.input_txt, SIGNAL('textChanged(QString)'),
                      lambda s: self.search())
@@ -141,6 +195,10 @@ class Grep(Dialog):
         self.connect(self.regexp_combo, SIGNAL('currentIndexChanged(int)'),
                      lambda x: self.search())
 
+        self.connect(self.revisions_txt, SIGNAL('returnPressed()'),
+                     self.search)
+        self.connect(self.revisions_txt, SIGNAL('changed()'), self.search)
+
         self.connect(self.result_txt, SIGNAL('leave()'),
                      lambda: self.input_txt.setFocus())
 
@@ -153,6 +211,7 @@ class Grep(Dialog):
         qtutils.connect_button(self.edit_button, self.edit)
         qtutils.connect_button(self.refresh_button, self.search)
         qtutils.connect_toggle(self.shell_checkbox, lambda x: self.search())
+        qtutils.connect_button(self.more_button, self.show_more)
         qtutils.connect_button(self.close_button, self.close)
         qtutils.add_close_action(self)
 
@@ -160,6 +219,7 @@ class Grep(Dialog):
             self.resize(666, 420)
 
     def done(self, exit_code):
+        self.stop_grep()
         self.save_state()
         return Dialog.done(self, exit_code)
 
@@ -171,14 +231,34 @@ class Grep(Dialog):
     def search(self):
         self.edit_button.setEnabled(False)
         self.refresh_button.setEnabled(False)
+        self.stop_grep()
         query = self.input_txt.value()
         if len(query) < 2:
             self.result_txt.set_value('')
             return
-        self.grep_thread.query = query
-        self.grep_thread.shell = self.shell_checkbox.isChecked()
-        self.grep_thread.regexp_mode = self.regexp_mode()
-        self.grep_thread.start()
+        self.grep_stream = stream = grepstream.GrepStream()
+        self.replace_results = True
+        self.saved_position = (self.text_scroll(), self.text_offset())
+
+        self.grep_revisions = revisions = self.revisions()
+        reader = self.grep_reader = GrepReader(
+                query, stream, self, shell=self.shell_checkbox.isChecked(),
+                regexp_mode=self.regexp_mode(), revisions=revisions)
+        self.connect(reader, SIGNAL('lines'), self.process_lines)
+        self.connect(reader, SIGNAL('grep_done'), self.process_result)
+        self.connect(reader, SIGNAL('finished()'), reader.deleteLater)
+        reader.start()
+
+    def revisions(self):
+        return utils.shell_split(self.revisions_txt.value())
+
+    def stop_grep(self):
+        """Kill the running "git grep" and ignore the rest of its output"""
+        reader = self.grep_reader
+        self.grep_reader = None
+        if reader is not None:
+            reader.stop()
+        self.more_button.hide()
 
     def search_for(self, txt):
         self.input_txt.set_value(txt)
@@ -203,26 +283,63 @@ class Grep(Dialog):
         cursor.setPosition(offset)
         self.result_txt.setTextCursor(cursor)
 
-    def process_result(self, status, out, err):
-
-        if status == 0:
-            value = out + err
-        elif out + err:
-            value = 'git grep: ' + out + err
-        else:
-            value = ''
-
+    def process_lines(self, reader, lines):
+        if reader is not self.grep_reader:
+            return
+        self.append_results(lines)
+        # Results from revisions are not worktree files
+        self.edit_button.setEnabled(not self.grep_revisions)
+        self.refresh_button.setEnabled(True)
+        self.update_more_button()
+
+    def append_results(self, lines):
+        if not self.replace_results:
+            self.result_txt.append_lines(lines)
+            return
+        self.replace_results = False
+        value = '\n'.join(lines)
         # save scrollbar and text cursor
-        scroll = self.text_scroll()
-        offset = min(len(value), self.text_offset())
+        scroll, offset = self.saved_position
+        offset = min(len(value), offset)
 
         self.result_txt.set_value(value)
         # restore
         self.set_text_scroll(scroll)
         self.set_text_offset(offset)
 
-        self.edit_button.setEnabled(status == 0)
+    def process_result(self, reader, status, err):
+        if reader is not self.grep_reader:
+            return
+        self.grep_reader = None
+        if status == 0:
+            value = err
+        elif err:
+            value = 'git grep: ' + err
+        else:
+            value = ''
+        value = value.rstrip('\n')
+        if self.replace_results:
+            self.append_results(value and [value] or [])
+        elif value:
+            self.result_txt.append_lines([value])
+
+        self.edit_button.setEnabled(status == 0 and not self.grep_revisions)
         self.refresh_button.setEnabled(status == 0)
+        self.update_more_button()
+
+    def show_more(self):
+        stream = self.grep_stream
+        if stream is None:
+            return
+        lines = stream.show_more()
+        if lines:
+            self.append_results(lines)
+        self.update_more_button()
+
+    def update_more_button(self):
+        stream = self.grep_stream
+        more = stream is not None and stream.has_more()
+        self.more_button.setVisible(more)
 
     def edit(self):
         goto_grep(self.result_txt.selected_line()),
@@ -275,6 +392,12 @@ class GrepTextView(HintedTextView):
                 lambda: self.page(self.height()//2),
                 Qt.Key_Space)
 
+    def append_lines(self, lines):
+        """Append lines to the end without moving the text cursor"""
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText('\n' + '\n'.join(lines))
+
     def contextMenuEvent(self, event):
         menu = self.createStandardContextMenu(event.pos())
         menu.addSeparator()
@@ -1,6 +1,7 @@
 """A widget for searching git commits"""
 from __future__ import division, absolute_import, unicode_literals
 
+import re
 import time
 import subprocess
 
@@ -17,6 +18,7 @@ from cola.i18n import N_
 from cola.interaction import Interaction
 from cola.git import git
 from cola.git import STDOUT
+from cola.models import searchindex
 from cola.qtutils import connect_button
 from cola.qtutils import create_toolbutton
 from cola.qtutils import dir_icon
@@ -30,6 +32,10 @@ def mkdate(timespec):
     return '%04d-%02d-%02d' % time.localtime(timespec)[:3]
 
 
+def mkdatetime(timespec):
+    return '%04d-%02d-%02d %02d:%02d:%02d' % time.localtime(timespec)[:6]
+
+
 class SearchOptions(object):
     def __init__(self):
         self.query = ''
@@ -152,31 +158,95 @@ class RevisionSearch(SearchEngine):
         return self.revisions(all=True, *args, **opts)
 
 
-class PathSearch(SearchEngine):
+class IndexedSearch(SearchEngine):
+    """Answers queries from the commit search index
+
+    Falls back to "git log" while the index is being built or updated
+    in the background, and when it cannot express the query.
+
+    """
+
+    def filters(self):
+        return {}
+
     def results(self):
+        index = searchindex.current().request()
+        if index is not None:
+            try:
+                ids = index.search(max_count=self.model.max_count,
+                                   **self.filters())
+            except (re.error, ValueError):
+                ids = None
+            if ids is not None:
+                return index.results(ids)
+        return self.git_results()
+
+    def git_results(self):
+        pass
+
+
+class PathSearch(IndexedSearch):
+    def filters(self):
+        return {'paths': utils.shell_split(self.model.query)}
+
+    def git_results(self):
         query, args = self.common_args()
         paths = ['--'] + utils.shell_split(query)
         return self.revisions(all=True, *paths, **args)
 
 
-class MessageSearch(SearchEngine):
-    def results(self):
+class MessageSearch(IndexedSearch):
+    def filters(self):
+        return {'message': self.model.query}
+
+    def git_results(self):
         query, kwargs = self.common_args()
         return self.revisions(all=True, grep=query, **kwargs)
 
 
-class AuthorSearch(SearchEngine):
-    def results(self):
+class AuthorSearch(IndexedSearch):
+    def filters(self):
+        return {'author': self.model.query}
+
+    def git_results(self):
         query, kwargs = self.common_args()
         return self.revisions(all=True, author=query, **kwargs)
 
 
-class CommitterSearch(SearchEngine):
-    def results(self):
+class CommitterSearch(IndexedSearch):
+    def filters(self):
+        return {'committer': self.model.query}
+
+    def git_results(self):
         query, kwargs = self.common_args()
         return self.revisions(all=True, committer=query, **kwargs)
 
 
+class CombinedSearch(IndexedSearch):
+    """Combines "author:", "committer:", "path:", "after:" and "before:"
+    filters with words from the commit message"""
+
+    def filters(self):
+        return searchindex.parse_query(utils.shell_split(self.model.query))
+
+    def git_results(self):
+        try:
+            filters = self.filters()
+        except ValueError:
+            return []
+        kwargs = self.rev_args()
+        for key in ('author', 'committer'):
+            if key in filters:
+                kwargs[key] = filters[key]
+        if 'message' in filters:
+            kwargs['grep'] = filters['message']
+        for key in ('after', 'before'):
+            if key in filters:
+                kwargs[key] = mkdatetime(filters[key])
+        paths = ['--'] + filters.get('paths', [])
+        return self.revisions(all=True, *paths, **kwargs)
+
+
 class DiffSearch(SearchEngine):
     def results(self):
         query, kwargs = self.common_args()
@@ -184,11 +254,18 @@ class DiffSearch(SearchEngine):
             git.log('-S'+query, all=True, **kwargs)[STDOUT])
 
 
-class DateRangeSearch(SearchEngine):
+class DateRangeSearch(IndexedSearch):
     def validate(self):
         return self.model.start_date < self.model.end_date
 
-    def results(self):
+    def filters(self):
+        after = searchindex.parse_date(self.model.start_date)
+        before = searchindex.parse_date(self.model.end_date, end=True)
+        if after is None or before is None:
+            raise ValueError('invalid date range')
+        return {'after': after, 'before': before}
+
+    def git_results(self):
         kwargs = self.rev_args()
         start_date = self.model.start_date
         end_date = self.model.end_date
@@ -212,6 +289,7 @@ class Search(SearchWidget):
         self.AUTHOR = N_('Search Authors')
         self.COMMITTER = N_('Search Committers')
         self.DATE_RANGE = N_('Search Date Range')
+        self.COMBINED = N_('Search Combined Filters')
 
         # Each search type is handled by a distinct SearchEngine subclass
         self.engines = {
@@ -222,10 +300,12 @@ class Search(SearchWidget):
             self.AUTHOR: AuthorSearch,
             self.COMMITTER: CommitterSearch,
             self.DATE_RANGE: DateRangeSearch,
+            self.COMBINED: CombinedSearch,
         }
 
         self.modes = (self.EXPR, self.PATH, self.DATE_RANGE,
-                      self.DIFF, self.MESSAGE, self.AUTHOR, self.COMMITTER)
+                      self.DIFF, self.MESSAGE, self.AUTHOR, self.COMMITTER,
+                      self.COMBINED)
         self.mode_combo.addItems(self.modes)
 
         connect_button(self.search_button, self.search_callback)
@@ -279,6 +359,12 @@ class Search(SearchWidget):
         date_shown = mode == self.DATE_RANGE
         browse_shown = mode == self.PATH
         self.query.setVisible(not date_shown)
+        if mode == self.COMBINED:
+            self.query.setToolTip(
+                    N_('Message words, combined with author:, committer:, '
+                       'path:, after:YYYY-MM-DD and before:YYYY-MM-DD'))
+        else:
+            self.query.setToolTip('')
         self.browse_button.setVisible(browse_shown)
         self.start_date.setVisible(date_shown)
         self.end_date.setVisible(date_shown)
@@ -354,6 +440,8 @@ def search_commits(parent):
     opts = SearchOptions()
     widget = Search(opts, parent)
     widget.show()
+    # Prepare the commit search index while the query is typed
+    searchindex.current().refresh()
     return widget
 
 
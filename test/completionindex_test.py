@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import completionindex
+
+from test import helper
+
+
+def fuzzy_matches(paths, text):
+    """Brute-force subsequence matching"""
+    result = set()
+    for path in paths:
+        chars = iter(path.lower())
+        if all([c in chars for c in text.lower()]):
+            result.add(path)
+    return result
+
+
+class CompletionIndexTestCase(unittest.TestCase):
+    """Tests the CompletionIndex class"""
+
+    def setUp(self):
+        self.files = ['README', 'cola/main.py', 'cola/models/main.py',
+                      'cola/models/dag.py', 'cola/widgets/main.py',
+                      'share/doc/git-cola/README.rst', 'test/main_test.py',
+                      'Docs/Intro.txt', 'docs/intro.md']
+        self.index = completionindex.CompletionIndex(self.files,
+                                                     parents=True)
+
+    def all_paths(self):
+        return set(self.index.entries)
+
+    def test_dirs(self):
+        self.assertTrue('cola/models' in self.index.dirs)
+        self.assertTrue('share/doc/git-cola' in self.index.dirs)
+        self.assertFalse('README' in self.index.dirs)
+        self.assertEqual(len(self.index), len(self.files) + 9)
+
+    def test_empty_text(self):
+        self.assertEqual(self.index.search('', limit=3),
+                         ['cola', 'cola/main.py', 'cola/models'])
+
+    def test_ranking(self):
+        self.assertEqual(self.index.search('main'),
+                         ['cola/main.py', 'cola/models/main.py',
+                          'cola/widgets/main.py', 'test/main_test.py'])
+        matches = self.index.search('cola')
+        # prefix matches first, then substrings
+        self.assertEqual(matches[0], 'cola')
+        self.assertEqual(matches[-1], 'share/doc/git-cola/README.rst')
+
+    def test_fuzzy(self):
+        matches = self.index.search('cmdag')
+        self.assertEqual(matches, ['cola/models/dag.py'])
+        for text in ('cm', 'mdl', 'oai', 'readme', 'c/m', '/mai', 's/m'):
+            self.assertEqual(set(self.index.search(text)),
+                             fuzzy_matches(self.all_paths(), text))
+
+    def test_fuzzy_compact_first(self):
+        matches = self.index.search('cmain')
+        self.assertEqual(matches[0], 'cola/main.py')
+        self.assertEqual(set(matches),
+                         fuzzy_matches(self.all_paths(), 'cmain'))
+
+    def test_slash_needles(self):
+        self.assertEqual(self.index.search('models/'),
+                         ['cola/models/dag.py', 'cola/models/main.py'])
+        self.assertEqual(self.index.search('ls/ma'),
+                         ['cola/models/main.py', 'cola/widgets/main.py'])
+        self.assertEqual(set(self.index.search('/doc')),
+                         set(['share/doc', 'share/doc/git-cola',
+                              'share/doc/git-cola/README.rst']))
+
+    def test_case_sensitive(self):
+        self.assertEqual(self.index.search('Intro', case_sensitive=True),
+                         ['Docs/Intro.txt'])
+        self.assertEqual(self.index.search('Docs', case_sensitive=True),
+                         ['Docs', 'Docs/Intro.txt'])
+        self.assertEqual(set(self.index.search('intro')),
+                         set(['Docs/Intro.txt', 'docs/intro.md']))
+
+    def test_limit(self):
+        matches = self.index.search('o', limit=2)
+        self.assertEqual(len(matches), 2)
+        # a capped query is not refined by the next keystroke
+        self.assertEqual(set(self.index.search('ol')),
+                         fuzzy_matches(self.all_paths(), 'ol'))
+
+    def test_refine(self):
+        self.assertEqual(set(self.index.search('d')),
+                         fuzzy_matches(self.all_paths(), 'd'))
+        self.assertEqual(self.index.search('dag'), ['cola/models/dag.py'])
+        self.assertEqual(self.index.search('dagx'), [])
+        # a shorter query scans again
+        matches = self.index.search('da')
+        self.assertEqual(matches[0], 'cola/models/dag.py')
+        self.assertEqual(set(matches), fuzzy_matches(self.all_paths(), 'da'))
+
+    def test_cancelled(self):
+        self.assertRaises(completionindex.Cancelled, self.index.search,
+                          'xyz', cancelled=lambda: True)
+        # a cancelled search is not refined
+        self.assertEqual(self.index.search('xyzzy'), [])
+        self.assertEqual(self.index.search('cmdag', cancelled=lambda: False),
+                         ['cola/models/dag.py'])
+
+    def test_scan_windows(self):
+        old_window = completionindex.SCAN_WINDOW
+        completionindex.SCAN_WINDOW = 8
+        try:
+            index = completionindex.CompletionIndex(self.files, parents=True)
+            for text in ('main', 'ls/ma', 'cm', 'intro'):
+                self.assertEqual(index.search(text), self.index.search(text))
+        finally:
+            completionindex.SCAN_WINDOW = old_window
+
+    def test_refs(self):
+        refs = ['master', 'origin/master', 'origin/maint', 'v1.0']
+        index = completionindex.CompletionIndex(refs)
+        self.assertEqual(index.dirs, frozenset())
+        self.assertEqual(index.search('ma'),
+                         ['master', 'origin/maint', 'origin/master'])
+        self.assertEqual(index.search('n/ma'),
+                         ['origin/maint', 'origin/master'])
+
+
+class TrackedPathsTestCase(helper.GitRepositoryTestCase):
+    """Tests the TrackedPaths cache"""
+
+    def test_rebuilt_when_files_change(self):
+        tracked = completionindex.TrackedPaths()
+        index = tracked.get()
+        self.assertEqual(index.entries, ['A', 'B'])
+        self.assertTrue(tracked.get() is index)
+        self.touch('C')
+        self.git('add', 'C')
+        index = tracked.get()
+        self.assertEqual(index.entries, ['A', 'B', 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
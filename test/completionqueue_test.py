@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import completionindex
+from cola.models import completionqueue
+
+
+class QueryQueueTestCase(unittest.TestCase):
+    """Tests the QueryQueue class"""
+
+    def setUp(self):
+        self.queue = completionqueue.QueryQueue()
+
+    def test_first_submit_starts_worker(self):
+        self.assertTrue(self.queue.submit('a', 'a', False))
+        self.assertFalse(self.queue.submit('ab', 'ab', False))
+        query = self.queue.take()
+        self.assertEqual(query.match_text, 'ab')
+        self.assertEqual(query.generation, 2)
+        self.assertEqual(self.queue.take(), None)
+        # the worker stopped, so the next query starts it again
+        self.assertTrue(self.queue.submit('abc', 'abc', False))
+
+    def test_coalesce(self):
+        self.queue.submit('a', 'a', False)
+        first = self.queue.take()
+        self.queue.submit('ab', 'ab', False)
+        self.queue.submit('abc', 'abc', False)
+        self.queue.submit('abcd', 'abcd', True)
+        query = self.queue.take()
+        self.assertEqual(query.match_text, 'abcd')
+        self.assertTrue(query.case_sensitive)
+        self.assertEqual(query.coalesced, 2)
+        self.assertTrue(query.submitted >= first.submitted)
+        self.assertEqual(self.queue.take(), None)
+
+    def test_run(self):
+        self.queue.submit('a', 'a', False)
+        query = self.queue.take()
+        result = self.queue.run(query, lambda q, cancelled: [q.match_text])
+        self.assertEqual(result, ['a'])
+        self.assertTrue(self.queue.is_current(query.generation))
+        self.assertTrue(query.latency >= query.run_time >= 0.0)
+        stats = self.queue.stats()
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['cancelled'], 0)
+        self.assertTrue(self.queue.last_query() is query)
+
+    def test_superseded_query_is_cancelled(self):
+        self.queue.submit('a', 'a', False)
+        query = self.queue.take()
+        seen = []
+
+        def gather(q, cancelled):
+            seen.append(cancelled())
+            self.queue.submit('ab', 'ab', False)
+            seen.append(cancelled())
+            raise completionindex.Cancelled()
+
+        self.assertEqual(self.queue.run(query, gather), None)
+        self.assertEqual(seen, [False, True])
+        self.assertTrue(query.cancelled)
+        self.assertFalse(self.queue.is_current(query.generation))
+        stats = self.queue.stats()
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(stats['completed'], 0)
+        self.assertEqual(self.queue.take().match_text, 'ab')
+
+    def test_stale_result_is_dropped(self):
+        self.queue.submit('a', 'a', False)
+        query = self.queue.take()
+
+        def gather(q, cancelled):
+            self.queue.submit('ab', 'ab', False)
+            return ['a']
+
+        self.assertEqual(self.queue.run(query, gather), None)
+
+    def test_cancel(self):
+        self.queue.submit('a', 'a', False)
+        generation = self.queue.generation
+        self.queue.cancel()
+        self.assertFalse(self.queue.is_current(generation))
+        self.assertEqual(self.queue.take(), None)
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    """Tests the QueryStats class"""
+
+    def test_latency(self):
+        stats = completionqueue.QueryStats()
+        for idx in range(10):
+            query = completionqueue.Query(idx, 'a', 'a', False)
+            query.submitted = 100.0
+            query.started = 100.0
+            query.finished = 100.0 + idx / 100.0
+            stats.add(query)
+        result = stats.as_dict()
+        self.assertEqual(result['completed'], 10)
+        self.assertAlmostEqual(result['max_latency'], 0.09)
+        self.assertAlmostEqual(result['median_latency'], 0.05)
+        self.assertAlmostEqual(result['p95_latency'], 0.09)
+        self.assertAlmostEqual(result['last_latency'], 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+from cola import core
+from cola import git
+from cola.models import dag
+from cola.models import dagcache
+
+from test import helper
+
+
+class DAGCacheTestCase(helper.GitRepositoryTestCase):
+    """Tests the on-disk commit cache used by RepoReader"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.dag = dag.DAG('HEAD', 1000)
+
+    def tearDown(self):
+        dag.CommitFactory.reset()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def commit(self, name):
+        self.write_file(name, name)
+        self.git('add', name)
+        self.git('commit', '-m', name)
+
+    def read(self, **kwargs):
+        dag.CommitFactory.reset()
+        return [c.record() for c in dag.RepoReader(self.dag, **kwargs)]
+
+    def cache(self):
+        cache = dagcache.CommitCache(self.dag.ref, self.dag.count,
+                                     git=git.current())
+        cache.resolve()
+        return cache
+
+    def test_pack_roundtrip(self):
+        records = [
+            ('a' * 40, (), 'A U Thor', 'date', 'a@example.com', 'first'),
+            ('b' * 40, ('a' * 40, 'c' * 40), 'ünicode', 'date', '',
+             'merge: \x01 separator'),
+        ]
+        data = dagcache.pack_records(records, {'tips': ['b' * 40]})
+        header, unpacked = dagcache.unpack_records(data)
+        self.assertEqual(header['tips'], ['b' * 40])
+        self.assertEqual(header['shas'], 3)
+        self.assertEqual(unpacked, records)
+
+    def test_unpack_invalid(self):
+        self.assertEqual(dagcache.unpack_records(b''), (None, None))
+        data = dagcache.pack_records([('a' * 40, (), '', '', '', '')], {})
+        self.assertEqual(dagcache.unpack_records(data[:-8]), (None, None))
+
+    def test_cache_hit(self):
+        expect = self.read(use_cache=False)
+        self.assertEqual(self.cache().load(), None)
+        self.assertEqual(self.read(), expect)
+        self.assertTrue(os.path.exists(self.cache().path))
+        self.assertEqual(self.cache().load(), expect)
+        self.assertEqual(self.read(), expect)
+
+    def test_cache_decorations(self):
+        self.read()
+        self.git('tag', 'v1.0')
+        dag.CommitFactory.reset()
+        expect = list(dag.RepoReader(self.dag, use_cache=False))[-1].tags
+        dag.CommitFactory.reset()
+        commits = list(dag.RepoReader(self.dag))
+        self.assertTrue('v1.0' in commits[-1].tags)
+        self.assertEqual(commits[-1].tags, expect)
+
+    def test_cache_delta(self):
+        self.read()
+        self.commit('B')
+        self.commit('C')
+        cache = self.cache()
+        self.assertTrue(cache.incremental)
+        records = cache.load()
+        self.assertEqual(records, self.read(use_cache=False))
+        self.assertEqual(records[-1][-1], 'C')
+        self.assertEqual(records[-2][-1], 'B')
+
+    def test_cache_rewritten_history(self):
+        self.commit('B')
+        self.read()
+        self.git('reset', '--hard', 'HEAD^')
+        self.commit('C')
+        self.assertEqual(self.cache().load(), None)
+        self.assertEqual(self.read(), self.read(use_cache=False))
+
+    def test_cache_count(self):
+        self.dag.set_count(2)
+        self.commit('B')
+        self.read()
+        self.commit('C')
+        records = self.cache().load()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records, self.read(use_cache=False))
+
+    def test_uncacheable_arguments(self):
+        self.dag.set_ref('--author=nobody HEAD')
+        self.assertFalse(self.cache().cacheable)
+        self.read()
+        self.assertFalse(core.exists(self.cache().path))
+
+    def test_uncacheable_revision_flags(self):
+        self.commit('a')
+        self.dag.set_ref('--since=2.days HEAD')
+        cache = self.cache()
+        self.assertFalse(cache.cacheable)
+        self.assertEqual(cache.tips, None)
+        self.assertEqual(self.read(), self.read(use_cache=False))
+        self.assertFalse(core.exists(cache.path))
+
+    def test_prune(self):
+        self.commit('B')
+        paths = []
+        for count in (1, 2, 3):
+            self.dag.set_count(count)
+            self.read()
+            paths.append(self.cache().path)
+        os.utime(paths[0], (1000, 1000))
+        os.utime(paths[1], (2000, 2000))
+        os.utime(paths[2], (3000, 3000))
+        # Loading a cache file marks it as recently used
+        self.dag.set_count(1)
+        self.assertTrue(self.cache().load())
+        dagcache.prune(os.path.dirname(paths[0]), 2)
+        self.assertTrue(core.exists(paths[0]))
+        self.assertFalse(core.exists(paths[1]))
+        self.assertTrue(core.exists(paths[2]))
+
+    def test_save_prunes(self):
+        max_files = dagcache.MAX_FILES
+        dagcache.MAX_FILES = 2
+        try:
+            for count in (1, 2, 3):
+                self.dag.set_count(count)
+                self.read()
+        finally:
+            dagcache.MAX_FILES = max_files
+        directory = os.path.dirname(self.cache().path)
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertTrue(core.exists(self.cache().path))
+
+
+if __name__ == '__main__':
+    unittest.main()
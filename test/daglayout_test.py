@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import daglayout
+from cola.models import dagstore
+
+
+def history(*commits):
+    """Build StoredCommits from (name, parents) pairs, oldest first"""
+    store = dagstore.CommitStore()
+    ids = []
+    for name, parents in commits:
+        sha1 = name * 40
+        parents = tuple([p * 40 for p in parents])
+        ids.append(store.add_record((sha1, parents, '', '', '', name)))
+    return [store.commit(i) for i in ids]
+
+
+class LaneLayoutTestCase(unittest.TestCase):
+
+    def lanes(self, positions, commits):
+        return [positions[c.sha1][0] // 10 for c in commits]
+
+    def test_linear(self):
+        commits = history(('a', ''), ('b', 'a'), ('c', 'b'))
+        layout = daglayout.LaneLayout(10, 20)
+        positions = layout.append(commits)
+        self.assertEqual(self.lanes(positions, commits), [0, 0, 0])
+        self.assertEqual([positions[c.sha1][1] for c in commits],
+                         [-20, -40, -60])
+        self.assertEqual(layout.y_min, -60)
+        self.assertEqual(layout.width, 1)
+
+    def test_branch_and_merge(self):
+        commits = history(('a', ''), ('b', 'a'), ('c', 'a'), ('d', 'bc'),
+                          ('e', 'd'), ('f', 'd'))
+        layout = daglayout.LaneLayout(10, 20)
+        positions = layout.append(commits)
+        # "c" forks into a new lane which is reused by "f" after the merge
+        self.assertEqual(self.lanes(positions, commits), [0, 0, 1, 0, 0, 1])
+        self.assertEqual(layout.width, 2)
+        self.assertEqual(layout.x_max, 10)
+
+    def test_incremental(self):
+        commits = history(('a', ''), ('b', 'a'), ('c', 'a'), ('d', 'bc'),
+                          ('e', 'd'), ('f', 'd'), ('0', 'ef'))
+        for name in daglayout.LAYOUTS:
+            full = daglayout.new_layout(name, 10, 20).append(commits)
+            layout = daglayout.new_layout(name, 10, 20)
+            positions = layout.append(commits[:3])
+            positions.update(layout.append(commits[3:]))
+            self.assertEqual(positions, full)
+            layout.reset()
+            self.assertEqual(layout.append(commits), full)
+
+    def test_generation_layout(self):
+        commits = history(('a', ''), ('b', 'a'), ('c', 'a'))
+        positions = daglayout.GenerationLayout(10, 20).append(commits)
+        self.assertEqual(positions[commits[1].sha1][0], 0)
+        self.assertEqual(positions[commits[2].sha1][0], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import dag
+from cola.models import dagstore
+
+from test import helper
+
+
+def summarize(commits):
+    return [(c.sha1, c.generation, c.summary, c.author, c.email,
+             [p.sha1 for p in c.parents], [k.sha1 for k in c.children],
+             sorted(c.tags), c.is_fork(), c.is_merge())
+            for c in commits]
+
+
+class CommitStoreTestCase(unittest.TestCase):
+    """Tests the CommitStore column storage"""
+
+    def test_add_record(self):
+        store = dagstore.CommitStore()
+        a = store.add_record(('a' * 40, (), 'Author', 'date', 'a@x', 'A'))
+        b = store.add_record(('b' * 40, ('a' * 40,), 'Author', 'date',
+                              'a@x', 'B☃'), ' (HEAD, tag: v1.0)')
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.parent_ids(b), [a])
+        self.assertEqual(store.child_ids(a), [b])
+        self.assertEqual(store.generation(b), store.generation(a) + 1)
+        self.assertEqual(store.summary(b), 'B☃')
+        self.assertEqual(store.tags(b), ('HEAD', 'v1.0'))
+        self.assertEqual(len(store._names), 2)
+
+        commit = store.commit(b)
+        self.assertEqual(commit, store.commit(b))
+        self.assertNotEqual(commit, store.commit(a))
+        self.assertEqual(commit.parents[0].sha1, 'a' * 40)
+        self.assertEqual(commit.record(),
+                         ('b' * 40, ('a' * 40,), 'Author', 'date', 'a@x',
+                          'B☃'))
+
+    def test_placeholder_parent(self):
+        store = dagstore.CommitStore()
+        b = store.add_record(('b' * 40, ('a' * 40,), '', '', '', 'B'))
+        a = store.lookup('a' * 40)
+        self.assertFalse(store.parsed(a))
+        self.assertTrue(store.parsed(b))
+        self.assertEqual(store.child_ids(a), [b])
+        self.assertEqual(store.lookup('c' * 40), None)
+
+
+class StoreReaderTestCase(helper.GitRepositoryTestCase):
+    """Tests that StoreReader matches RepoReader"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.commit('B')
+        self.git('checkout', '-b', 'topic', 'HEAD^')
+        self.commit('C')
+        self.commit('D')
+        self.git('checkout', 'master')
+        self.git('merge', '--no-ff', '-m', 'merge', 'topic')
+        self.git('tag', 'v1.0')
+        self.dag = dag.DAG('HEAD', 1000)
+
+    def tearDown(self):
+        dag.CommitFactory.reset()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def commit(self, name):
+        self.write_file(name, name)
+        self.git('add', name)
+        self.git('commit', '-m', name)
+
+    def test_matches_repo_reader(self):
+        expect = summarize(list(dag.RepoReader(self.dag, use_cache=False)))
+        reader = dagstore.StoreReader(self.dag, use_cache=False)
+        actual = summarize(list(reader))
+        self.assertEqual(actual, expect)
+        self.assertEqual(len(reader), 5)
+        # A second pass iterates the stored commits
+        self.assertEqual(summarize(list(reader)), expect)
+
+    def test_cached_matches_repo_reader(self):
+        expect = summarize(list(dag.RepoReader(self.dag, use_cache=False)))
+        list(dagstore.StoreReader(self.dag))
+        reader = dagstore.StoreReader(self.dag)
+        self.assertEqual(summarize(list(reader)), expect)
+        self.assertTrue(reader._cache is not None)
+
+    def test_newest_first(self):
+        expect = [c.sha1 for c in dag.RepoReader(self.dag, use_cache=False)]
+        reader = dagstore.StoreReader(self.dag, reverse=False)
+        commits = list(reader)
+        self.assertEqual([c.sha1 for c in commits], list(reversed(expect)))
+        self.assertEqual(len(commits[0].parents), 2)
+        self.assertEqual(len(commits[-1].children), 2)
+        self.assertTrue(reader._cache is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
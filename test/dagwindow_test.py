@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import dagwindow
+
+
+class RowGraphTestCase(unittest.TestCase):
+    """Tests the newest-first row and lane assignment"""
+
+    def test_linear(self):
+        graph = dagwindow.RowGraph()
+        graph.append('C', ['B'])
+        graph.append('B', ['A'])
+        graph.append('A', [])
+        self.assertEqual(len(graph), 3)
+        self.assertEqual([graph.lane(r) for r in range(3)], [0, 0, 0])
+        self.assertEqual(graph.segments(0), [(0, 0)])
+        self.assertEqual(graph.segments(1), [(0, 0)])
+        self.assertEqual(graph.segments(2), [])
+        self.assertEqual(graph.width, 1)
+
+    def test_merge(self):
+        graph = dagwindow.RowGraph()
+        graph.append('D', ['B', 'C'])
+        graph.append('C', ['A'])
+        graph.append('B', ['A'])
+        graph.append('A', [])
+        self.assertEqual([graph.lane(r) for r in range(4)], [0, 1, 0, 1])
+        self.assertEqual(graph.segments(0), [(0, 0), (0, 1)])
+        self.assertEqual(graph.segments(1), [(0, 0), (1, 1)])
+        self.assertEqual(graph.segments(2), [(1, 1), (0, 1)])
+        self.assertEqual(graph.width, 2)
+
+    def test_pending_segments(self):
+        graph = dagwindow.RowGraph()
+        graph.append('C', ['A', 'B'])
+        # Unknown rows below continue straight down
+        self.assertEqual(graph.segments(0), [(0, 0), (0, 1)])
+        graph.append('B', ['A'])
+        self.assertEqual(graph.segments(0), [(0, 0), (0, 1)])
+        self.assertEqual(graph.segments(1), [(0, 0), (1, 0)])
+
+    def test_converging_lanes(self):
+        graph = dagwindow.RowGraph()
+        graph.append('C', ['A'])
+        graph.append('B', ['A'])
+        graph.append('A', [])
+        self.assertEqual([graph.lane(r) for r in range(3)], [0, 1, 0])
+        self.assertEqual(graph.segments(1), [(0, 0), (1, 0)])
+
+    def test_lane_reuse(self):
+        graph = dagwindow.RowGraph()
+        graph.append('B', [])
+        graph.append('A', [])
+        self.assertEqual([graph.lane(r) for r in range(2)], [0, 0])
+        self.assertEqual(graph.width, 1)
+
+
+class RowWindowTestCase(unittest.TestCase):
+
+    def test_update(self):
+        window = dagwindow.RowWindow()
+        self.assertEqual(window.update(0, 3), ([], [0, 1, 2]))
+        self.assertEqual(window.update(2, 5), ([0, 1], [3, 4]))
+        self.assertTrue(2 in window)
+        self.assertFalse(5 in window)
+        self.assertEqual(window.update(-4, 1), ([2, 3, 4], [0]))
+
+    def test_visible_rows(self):
+        self.assertEqual(dagwindow.visible_rows(0, 100, 24), (0, 5))
+        self.assertEqual(dagwindow.visible_rows(-50, 10, 24), (0, 1))
+        self.assertEqual(dagwindow.visible_rows(480, 500, 24, margin=2),
+                         (18, 23))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ from __future__ import unicode_literals
 import unittest
 
 from cola import core
-from cola.diffparse import _parse_range_str, DiffParser
+from cola.diffparse import _parse_range_str, DiffIndex, DiffParser
 
 from test import helper
 
@@ -122,6 +122,27 @@ class ParseDiffTestCase(unittest.TestCase):
                          '-second\n')
 
 
+class DiffIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.text = core.read(helper.fixture('diff.txt'))
+        self.index = DiffIndex(self.text)
+
+    def test_hunk_lookup(self):
+        self.assertEqual(self.index.hunk_starts, [0, 23, 41])
+        self.assertEqual(self.index.hunk_at(0).first_line_idx, 0)
+        self.assertEqual(self.index.hunk_at(22).first_line_idx, 0)
+        self.assertEqual(self.index.hunk_at(23).first_line_idx, 23)
+        self.assertEqual(self.index.hunk_at(50).first_line_idx, 41)
+        self.assertEqual(self.index.hunk_index(-1), -1)
+
+    def test_hunk_patch_between_hunks(self):
+        parser = DiffParser('x', self.text, index=self.index)
+        self.assertTrue(parser.index is self.index)
+        self.assertEqual(parser.generate_hunk_patch(22),
+                         DiffParser('x', self.text).generate_patch(0, 22))
+
+
 class ParseRangeStrTestCase(unittest.TestCase):
     def test_parse_range_str(self):
         start, count = _parse_range_str('1,2')
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from cola import core
+from cola import diffstream
+from cola import git
+from cola import gitcmds
+
+from test import helper
+
+
+DIFF = '''diff --git a/A b/A
+index 0000000..1111111 100644
+--- a/A
++++ b/A
+@@ -1 +1,2 @@ first
+ a
++b
+@@ -10 +11 @@ second
+-c
++d
+diff --git a/B b/B
+--- a/B
++++ b/B
+@@ -1 +1 @@
+-e
++f☃
+'''
+
+
+def feed_in_chunks(stream, data, size):
+    lines = []
+    for idx in range(0, len(data), size):
+        lines.extend(stream.feed(data[idx:idx+size]))
+    lines.extend(stream.finish())
+    return lines
+
+
+class DiffStreamTestCase(unittest.TestCase):
+
+    def test_chunked_lines_match(self):
+        data = DIFF.encode('utf-8')
+        for size in (1, 3, 7, len(data)):
+            stream = diffstream.DiffStream(suppress_header=False)
+            lines = feed_in_chunks(stream, data, size)
+            self.assertEqual(lines, DIFF.splitlines())
+
+    def test_suppress_header(self):
+        stream = diffstream.DiffStream()
+        lines = feed_in_chunks(stream, DIFF.encode('utf-8'), 5)
+        self.assertEqual(lines[0], '@@ -1 +1,2 @@ first')
+        self.assertTrue('diff --git a/B b/B' in lines)
+
+    def test_hunk_index(self):
+        stream = diffstream.DiffStream()
+        lines = feed_in_chunks(stream, DIFF.encode('utf-8'), 5)
+        self.assertEqual([h[1] for h in stream.hunks],
+                         ['@@ -1 +1,2 @@ first', '@@ -10 +11 @@ second',
+                          '@@ -1 +1 @@'])
+        for line_number, header in stream.hunks:
+            self.assertEqual(lines[line_number], header)
+
+    def test_truncation(self):
+        stream = diffstream.DiffStream(max_file_size=30,
+                                       suppress_header=False)
+        lines = feed_in_chunks(stream, DIFF.encode('utf-8'), 4)
+        self.assertEqual(lines[0], 'diff --git a/A b/A')
+        self.assertTrue(lines[1].startswith('... '))
+        # The next file starts over
+        self.assertTrue('diff --git a/B b/B' in lines)
+        self.assertEqual([t[0] for t in stream.truncated], ['A', 'B'])
+
+    def test_is_large(self):
+        self.assertFalse(diffstream.is_large('does-not-exist', 1))
+        self.assertFalse(diffstream.is_large(__file__, 0))
+        self.assertTrue(diffstream.is_large(__file__, 1))
+
+    def test_unknown_encoding(self):
+        stream = diffstream.DiffStream(encoding='no-such-encoding',
+                                       suppress_header=False)
+        self.assertEqual(stream.feed('a☃\n'.encode('utf-8')), ['a☃'])
+
+
+class DiffCommandTestCase(helper.GitRepositoryTestCase):
+
+    def test_stream_matches_diff_helper(self):
+        self.write_file('A', 'one\ntwo\n')
+        command, encoding = gitcmds.diff_helper_command(filename='A',
+                                                        cached=False)
+        proc = core.start_command(command)
+        out, err = core.communicate(proc)
+        self.assertEqual(proc.returncode, 0)
+        stream = diffstream.DiffStream(encoding=encoding)
+        lines = feed_in_chunks(stream, out, 8)
+        expect = gitcmds.diff_helper(filename='A', cached=False)
+        # extract_diff_header() ends its output with an extra newline
+        self.assertEqual(lines, expect.rstrip('\n').split('\n'))
+
+    def test_is_large_cached(self):
+        self.write_file('A', 'staged\n')
+        self.git('add', 'A')
+        self.write_file('A', 'a much larger worktree file\n' * 100)
+        self.assertTrue(diffstream.is_large('A', 100))
+        self.assertFalse(diffstream.is_large('A', 100, ref='HEAD',
+                                             git=git.current()))
+        self.assertTrue(diffstream.is_large('A', 3, ref='HEAD',
+                                            git=git.current()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+from __future__ import unicode_literals
+
+import re
+import unittest
+
+from cola import core
+from cola import diffsyntax
+from cola.diffsyntax import ADD, BAD_WHITESPACE, HEADER, HEADER_BOLD, REMOVE
+
+from test import helper
+
+
+def TERMINAL(pattern):
+    return '__TERMINAL__:%s' % pattern
+
+
+class RuleHighlighter(object):
+    """The original DiffSyntaxHighlighter rules, tried in order per line"""
+
+    def __init__(self, whitespace=True):
+        self._rules = []
+        rules = [
+            TERMINAL(r'^--- '), HEADER,
+            TERMINAL(r'^\+\+\+ '), HEADER,
+            TERMINAL(r'^@@ '), HEADER_BOLD,
+            TERMINAL(r'^([ ]+.*)(\|[ ]+\d+[ ]+[+-]+)$'),
+                (HEADER_BOLD, HEADER),
+            TERMINAL(r'^diff --git a/.*b/.*'), HEADER,
+            TERMINAL(r'^index \S+\.\.\S+'), HEADER,
+            TERMINAL(r'^new file mode'), HEADER,
+            TERMINAL(r'^deleted file mode'), HEADER,
+            TERMINAL(r'^\+'), ADD,
+            TERMINAL(r'^-'), REMOVE,
+            r'(.+\|.+?)(\d+)(.+?)([\+]*?)([-]*?)$',
+                (None, HEADER, None, HEADER, HEADER),
+            (r'(\s+\d+ files changed[^\d]*)'
+             r'(:?\d+ insertions[^\d]*)'
+             r'(:?\d+ deletions.*)$'), (HEADER, HEADER, HEADER),
+        ]
+        if whitespace:
+            rules.extend([r'(..*?)(\s+)$', (None, BAD_WHITESPACE)])
+        for idx in range(0, len(rules), 2):
+            rule = rules[idx]
+            terminal = rule.startswith(TERMINAL(''))
+            if terminal:
+                rule = rule[len(TERMINAL('')):]
+            self._rules.append((re.compile(rule), rules[idx+1], terminal))
+
+    def spans(self, line):
+        matched = []
+        for regex, fmts, terminal in self._rules:
+            match = regex.match(line)
+            if not match:
+                continue
+            matched.append((match, fmts))
+            if terminal:
+                break
+        spans = []
+        for match, fmts in matched:
+            start = match.start()
+            groups = match.groups()
+            if not groups:
+                spans.append((0, len(line), fmts))
+                continue
+            for grpidx, group in enumerate(groups):
+                if not group:
+                    continue
+                if fmts[grpidx]:
+                    spans.append((start, len(group), fmts[grpidx]))
+                start += len(group)
+        return tuple(spans)
+
+
+class DiffClassifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = diffsyntax.DiffClassifier()
+
+    def spans(self, line):
+        return self.classifier.spans(line)
+
+    def test_headers(self):
+        for line in ('diff --git a/x b/x', 'index 0123..4567 100644',
+                     '--- a/x', '+++ b/x', 'new file mode 100644',
+                     'deleted file mode 100644'):
+            self.assertEqual(self.spans(line), ((0, len(line), HEADER),))
+        line = '@@ -1,2 +1,3 @@ def f():'
+        self.assertEqual(self.spans(line), ((0, len(line), HEADER_BOLD),))
+
+    def test_changes(self):
+        self.assertEqual(self.spans('+added  '), ((0, 8, ADD),))
+        self.assertEqual(self.spans('-removed'), ((0, 8, REMOVE),))
+        self.assertEqual(self.spans('---'), ((0, 3, REMOVE),))
+        self.assertEqual(self.spans(' context'), ())
+        self.assertEqual(self.spans(''), ())
+
+    def test_trailing_whitespace(self):
+        self.assertEqual(self.spans(' context \t'),
+                         ((8, 2, BAD_WHITESPACE),))
+        self.assertEqual(self.spans('   '), ((1, 2, BAD_WHITESPACE),))
+        classifier = diffsyntax.DiffClassifier(whitespace=False)
+        self.assertEqual(classifier.spans(' context '), ())
+
+    def test_diffstat(self):
+        self.assertEqual(self.spans(' cola/x.py | 12 ++++--'),
+                         ((0, 11, HEADER_BOLD), (11, 11, HEADER)))
+        self.assertEqual(self.spans('a/x.py | 3 +'),
+                         ((9, 1, HEADER), (11, 1, HEADER)))
+        line = ' 2 files changed, 3 insertions(+), 1 deletions(-)'
+        self.assertEqual(self.spans(line),
+                         ((0, 18, HEADER), (18, 17, HEADER),
+                          (35, len(line) - 35, HEADER)))
+
+    def test_matches_original_rules(self):
+        rules = RuleHighlighter()
+        for name in ('diff-highlight.txt', 'diff.txt'):
+            text = core.read(helper.fixture(name))
+            for line in text.split('\n'):
+                self.assertEqual(self.spans(line), rules.spans(line))
+
+
+if __name__ == '__main__':
+    unittest.main()
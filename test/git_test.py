@@ -3,14 +3,18 @@
 """
 from __future__ import unicode_literals
 
+import os
 import time
 import signal
+import threading
 import unittest
 
 from cola import git
 from cola.compat import WIN32
 from cola.git import STDOUT
 
+from test import helper
+
 
 class GitCommandTest(unittest.TestCase):
     """Runs tests using a git.Git instance"""
@@ -94,5 +98,170 @@ class GitCommandTest(unittest.TestCase):
         signal.signal(signal.SIGALRM, prev_handler)
 
 
+class CommandSchedulerTestCase(unittest.TestCase):
+    """Tests the read/write command scheduler"""
+
+    def test_classify_command(self):
+        self.assertEqual(git.classify_command(['git', 'log', '-1']), git.READ)
+        self.assertEqual(git.classify_command(['git', 'diff-index', 'HEAD']),
+                         git.READ)
+        self.assertEqual(git.classify_command(['git', 'add', '--', 'A']),
+                         git.WRITE)
+        self.assertEqual(git.classify_command(['git', 'apply', '--cached']),
+                         git.WRITE)
+        self.assertEqual(git.classify_command(['git', 'config', '--list']),
+                         git.READ)
+        self.assertEqual(git.classify_command(['git', 'config', 'a.b', 'c']),
+                         git.WRITE)
+        self.assertEqual(git.classify_command(['sleep', '1']), git.WRITE)
+
+    def _acquire_in_thread(self, scheduler, command_class):
+        acquired = threading.Event()
+
+        def run():
+            scheduler.acquire(command_class)
+            acquired.set()
+            scheduler.release(command_class)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, acquired
+
+    def test_readers_share(self):
+        scheduler = git.CommandScheduler()
+        scheduler.acquire(git.READ)
+        thread, acquired = self._acquire_in_thread(scheduler, git.READ)
+        self.assertTrue(acquired.wait(5.0))
+        thread.join()
+        scheduler.release(git.READ)
+        self.assertEqual(scheduler.stats()[git.READ]['count'], 2)
+
+    def test_writers_are_exclusive(self):
+        scheduler = git.CommandScheduler()
+        scheduler.acquire(git.READ)
+        thread, acquired = self._acquire_in_thread(scheduler, git.WRITE)
+        self.assertFalse(acquired.wait(0.1))
+        self.assertEqual(scheduler.stats()[git.WRITE]['queued'], 1)
+        scheduler.release(git.READ)
+        self.assertTrue(acquired.wait(5.0))
+        thread.join()
+
+        stats = scheduler.stats()[git.WRITE]
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['max_queued'], 1)
+        self.assertTrue(stats['max_wait_time'] > 0.0)
+
+    def test_waiting_writer_blocks_new_readers(self):
+        scheduler = git.CommandScheduler()
+        scheduler.acquire(git.READ)
+        writer, writer_acquired = self._acquire_in_thread(scheduler, git.WRITE)
+        while not scheduler.stats()[git.WRITE]['queued']:
+            time.sleep(0.01)
+        reader, reader_acquired = self._acquire_in_thread(scheduler, git.READ)
+        self.assertFalse(reader_acquired.wait(0.1))
+        scheduler.release(git.READ)
+        writer.join()
+        reader.join()
+        self.assertTrue(writer_acquired.is_set())
+        self.assertTrue(reader_acquired.is_set())
+
+
+class ObjectReaderTestCase(helper.GitRepositoryTestCase):
+    """Tests the persistent cat-file object reader"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.reader = git.current().object_reader()
+
+    def tearDown(self):
+        git.current().close_object_reader()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def test_info(self):
+        sha1 = self.git('rev-parse', 'HEAD').decode('ascii')
+        info = self.reader.info('HEAD')
+        self.assertEqual(info[0], sha1)
+        self.assertEqual(info[1], 'commit')
+
+    def test_info_missing(self):
+        self.assertEqual(self.reader.info('does-not-exist'), None)
+        self.assertEqual(self.reader.info('HEAD:does not exist'), None)
+        # The process survives missing objects
+        self.assertEqual(self.reader.info('HEAD')[1], 'commit')
+
+    def test_read_blob(self):
+        self.write_file('C', 'hello\nworld\n')
+        self.git('add', 'C')
+        self.git('commit', '-m', 'add C')
+        self.assertEqual(self.reader.read_blob('HEAD:C'), 'hello\nworld\n')
+        self.assertEqual(self.reader.read_blob('HEAD:A'), '')
+        self.assertEqual(self.reader.read_blob('HEAD'), None)
+
+    def test_read_tree(self):
+        os.mkdir('dir')
+        self.touch('dir/file')
+        self.git('add', 'dir/file')
+        self.git('commit', '-m', 'add dir')
+        entries = self.reader.read_tree('HEAD')
+        names = [(mode, objtype, name) for mode, objtype, sha1, name in entries]
+        self.assertEqual(names, [('100644', 'blob', 'A'),
+                                 ('100644', 'blob', 'B'),
+                                 ('040000', 'tree', 'dir')])
+        expect = self.git('rev-parse', 'HEAD:dir').decode('ascii')
+        self.assertEqual(entries[2][2], expect)
+
+        entries = self.reader.read_tree('HEAD:dir')
+        self.assertEqual([e[3] for e in entries], ['file'])
+
+    def test_read_commit(self):
+        self.touch('C')
+        self.git('add', 'C')
+        self.git('commit', '-m', 'summary\n\nbody')
+        parent = self.git('rev-parse', 'HEAD^').decode('ascii')
+        commit = self.reader.read_commit('HEAD')
+        self.assertEqual(commit['parents'], [parent])
+        self.assertEqual(commit['message'], 'summary\n\nbody\n')
+        self.assertTrue(commit['author'])
+
+    def test_restart_after_close(self):
+        self.assertEqual(self.reader.info('HEAD')[1], 'commit')
+        self.reader.close()
+        self.assertEqual(self.reader.info('HEAD')[1], 'commit')
+
+
+class CheckAttrProcessTestCase(helper.GitRepositoryTestCase):
+    """Tests the persistent check-attr coprocess"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.proc = git.CheckAttrProcess(('encoding', 'diff'))
+
+    def tearDown(self):
+        self.proc.close()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def test_request(self):
+        self.write_file('.gitattributes', '*.txt encoding=cp1252 -diff\n')
+        paths = ['a.txt', 'with space.txt', 'new\nline.txt', 'b']
+        result = self.proc.request(paths)
+        self.assertEqual(result['a.txt'],
+                         {'encoding': 'cp1252', 'diff': 'unset'})
+        self.assertEqual(result['new\nline.txt']['encoding'], 'cp1252')
+        self.assertEqual(result['b'],
+                         {'encoding': 'unspecified', 'diff': 'unspecified'})
+
+    def test_chunked_request(self):
+        self.write_file('.gitattributes', '*.txt encoding=cp1252\n')
+        self.proc.chunk_size = 64
+        paths = ['dir/file%03d.txt' % i for i in range(200)]
+        result = self.proc.request(paths)
+        self.assertEqual(len(result), 200)
+        self.assertEqual(set([r['encoding'] for r in result.values()]),
+                         set(['cp1252']))
+        # The process survives and answers the next request
+        self.assertEqual(self.proc.request(['x'])['x']['diff'], 'unspecified')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import os
 import unittest
 
 from cola import gitcfg
@@ -82,6 +83,158 @@ class GitConfigTestCase(helper.GitRepositoryTestCase):
         opts = self.get_guitool_opts('Meow Cat')
         self.assertEqual(opts['cmd'], 'cat hello')
 
+    def test_subsection_case(self):
+        self.append_file('.git/config', '[Remote "Origin"]\n\tURL = x\n')
+        self.assertEqual(self.config.get('remote.Origin.url'), 'x')
+        self.assertTrue('remote.Origin.url' in self.config.all())
+
+    def test_multi_valued(self):
+        self.git('config', '--add', 'test.multi', 'a')
+        self.git('config', '--add', 'test.multi', 'b')
+        self.assertEqual(self.config.get('test.multi'), 'b')
+        self.assertEqual(self.config.get_all('test.multi'), ['a', 'b'])
+        self.assertEqual(self.config.get_all('test.missing', []), [])
+
+    def test_include(self):
+        self.write_file('included', '[test]\n\tincluded = yes\n')
+        self.git('config', 'include.path', '../included')
+        self.assertEqual(self.config.get('test.included'), True)
+
+    def test_include_if_gitdir(self):
+        self.write_file('included', '[test]\n\tvalue = gitdir\n')
+        self.write_file('excluded', '[test]\n\tother = gitdir\n')
+        repo = os.path.basename(self._testdir)
+        self.git('config', 'includeIf.gitdir:%s/.path' % repo, '../included')
+        self.git('config', 'includeIf.gitdir:nomatch/.path', '../excluded')
+        self.assertEqual(self.config.get('test.value'), 'gitdir')
+        self.assertEqual(self.config.get('test.other'), None)
+
+    def test_include_if_onbranch(self):
+        self.write_file('included', '[test]\n\tvalue = branch\n')
+        branch = self.git('rev-parse', '--abbrev-ref', 'HEAD').decode('utf-8')
+        self.git('config', 'includeIf.onbranch:%s.path' % branch, '../included')
+        self.assertEqual(self.config.get('test.value'), 'branch')
+        self.git('checkout', '-q', '-b', 'other')
+        self.config.update(force=True)
+        self.assertEqual(self.config.get('test.value'), None)
+
+    def test_freshness_check_is_rate_limited(self):
+        self.git('config', 'test.value', 'old')
+        self.assertEqual(self.config.get('test.value'), 'old')
+        self.git('config', 'test.value', 'new')
+        self.assertEqual(self.config.get('test.value'), 'old')
+        self.config._checked = 0.0
+        self.assertEqual(self.config.get('test.value'), 'new')
+
+    def test_set_repo_is_visible_immediately(self):
+        self.assertEqual(self.config.get('test.value'), None)
+        self.config.set_repo('test.value', 'set')
+        self.assertEqual(self.config.get('test.value'), 'set')
+
+    def test_file_encoding(self):
+        self.git('config', 'cola.fileattributes', 'true')
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        self.assertEqual(self.config.file_encoding('a.txt'), 'iso-8859-1')
+        self.assertEqual(self.config.file_encoding('A'), 'utf-8')
+
+    def test_file_encoding_disabled(self):
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        self.assertEqual(self.config.file_encoding('a.txt'), 'utf-8')
+
+    def test_prefetch_file_encodings(self):
+        self.git('config', 'cola.fileattributes', 'true')
+        os.mkdir('sub')
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        self.write_file('sub/.gitattributes', '*.txt encoding=cp1252\n')
+        self.config.prefetch_file_encodings(['a.txt', 'sub/b.txt', 'c'])
+        self.assertEqual(self.config._attr_cache,
+                         {'a.txt': 'iso-8859-1',
+                          'sub/b.txt': 'cp1252',
+                          'c': 'utf-8'})
+
+    def test_file_encoding_invalidation(self):
+        self.git('config', 'cola.fileattributes', 'true')
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        self.assertEqual(self.config.file_encoding('sub/a.txt'), 'iso-8859-1')
+        os.mkdir('sub')
+        self.write_file('sub/.gitattributes', '*.txt encoding=cp1252\n')
+        # Attributes files are only checked once per interval
+        self.assertEqual(self.config.file_encoding('sub/a.txt'), 'iso-8859-1')
+        self.config._attr_checked = 0.0
+        self.assertEqual(self.config.file_encoding('sub/a.txt'), 'cp1252')
+
+
+class ParseConfigTestCase(unittest.TestCase):
+    """Tests the in-process config parser"""
+
+    def test_sections(self):
+        text = ('[Core]\n'
+                '\tBare = false\n'
+                '[branch "Main"]\n'
+                '\tremote = origin\n'
+                '[section.SubSection]\n'
+                '\tkey = value\n')
+        self.assertEqual(gitcfg.parse_config(text),
+                         [('core.bare', 'false'),
+                          ('branch.Main.remote', 'origin'),
+                          ('section.subsection.key', 'value')])
+
+    def test_subsection_escapes(self):
+        text = '[a "b \\"c\\" \\\\d"]\nkey = 1\n'
+        self.assertEqual(gitcfg.parse_config(text),
+                         [('a.b "c" \\d.key', '1')])
+
+    def test_values(self):
+        text = ('[a]\n'
+                'bool\n'
+                'empty =\n'
+                'spaces =   x \t y   \n'
+                'quoted = " x ; y "\n'
+                'escapes = "a\\tb\\nc\\\\d\\"e"\n'
+                'comment = value ; comment\n'
+                'hash = value # comment\n'
+                'continued = one \\\n two\n'
+                'crlf = yes\r\n')
+        self.assertEqual(gitcfg.parse_config(text),
+                         [('a.bool', None),
+                          ('a.empty', ''),
+                          ('a.spaces', 'x   y'),
+                          ('a.quoted', ' x ; y '),
+                          ('a.escapes', 'a\tb\nc\\d"e'),
+                          ('a.comment', 'value'),
+                          ('a.hash', 'value'),
+                          ('a.continued', 'one  two'),
+                          ('a.crlf', 'yes')])
+
+    def test_key_on_section_line(self):
+        text = '# comment\n; comment\n[a] key = value'
+        self.assertEqual(gitcfg.parse_config(text), [('a.key', 'value')])
+
+    def test_multi_valued(self):
+        text = '[a]\nkey = 1\nkey = 2\n[A]\nKEY = 3\n'
+        self.assertEqual(gitcfg.parse_config(text),
+                         [('a.key', '1'), ('a.key', '2'), ('a.key', '3')])
+
+    def test_errors(self):
+        for text in ('key = value\n',
+                     '[a\n',
+                     '[a "b]\n',
+                     '[a]\n1key = value\n',
+                     '[a]\nkey value\n',
+                     '[a]\nkey = "unterminated\n',
+                     '[a]\nkey = bad \\escape\n'):
+            self.assertRaises(ValueError, gitcfg.parse_config, text)
+
+    def test_wildmatch(self):
+        regex = gitcfg._wildmatch('**/work/**')
+        self.assertTrue(regex.match('/home/me/work/project/.git'))
+        self.assertFalse(regex.match('/home/me/homework/project/.git'))
+        regex = gitcfg._wildmatch('feature/*')
+        self.assertTrue(regex.match('feature/x'))
+        self.assertFalse(regex.match('feature/x/y'))
+        self.assertTrue(gitcfg._wildmatch('F[!0-9]', icase=True).match('fa'))
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import os
 import unittest
 
+from cola import diffcache
 from cola import gitcmds
 from cola import gitcfg
 
@@ -121,6 +122,184 @@ class GitCmdsTestCase(helper.GitRepositoryTestCase):
         self.assertEqual(remote, ['origin/a', 'origin/b', 'origin/c', 'origin/master'])
         self.assertEqual(tags, ['d', 'e', 'f'])
 
+    def _make_changes(self):
+        os.mkdir('dir')
+        self.write_file('dir/C', 'C')
+        self.git('add', 'dir/C')
+        self.git('commit', '-m', 'add dir/C')
+        self.write_file('A', 'modified')
+        self.write_file('B', 'staged')
+        self.git('add', 'B')
+        self.git('rm', '-q', '--cached', 'dir/C')
+        self.touch('untracked')
+
+    def test_status_state(self):
+        """Test status_state() against a worktree with changes."""
+        self._make_changes()
+        state = gitcmds.status_state()
+        self.assertEqual(state['staged'], ['B', 'dir/C'])
+        self.assertEqual(state['modified'], ['A'])
+        self.assertEqual(state['untracked'], ['dir/C', 'untracked'])
+        self.assertEqual(state['unmerged'], [])
+        self.assertEqual(state['staged_deleted'], set(['dir/C']))
+        self.assertEqual(state['unstaged_deleted'], set())
+        self.assertEqual(state['upstream_changed'], [])
+
+    def test_status_state_matches_diff_state(self):
+        """Test that both status engines agree."""
+        self._make_changes()
+        self.assertEqual(gitcmds.status_state(),
+                         gitcmds.diff_state('HEAD'))
+
+    def test_status_state_paths(self):
+        """Test status_state() limited to a set of paths."""
+        self._make_changes()
+        state = gitcmds.status_state(paths=['A', 'untracked'])
+        self.assertEqual(state['staged'], [])
+        self.assertEqual(state['modified'], ['A'])
+        self.assertEqual(state['untracked'], ['untracked'])
+
+    def test_status_state_upstream_changed(self):
+        """Test that upstream changes are reported when behind."""
+        self.git('remote', 'add', 'origin', '.')
+        self.git('fetch', 'origin')
+        self.git('config', 'branch.master.remote', 'origin')
+        self.git('config', 'branch.master.merge', 'refs/heads/master')
+        self.assertEqual(gitcmds.status_state()['upstream_changed'], [])
+
+        self.write_file('A', 'upstream')
+        self.git('commit', '-m', 'upstream change', 'A')
+        self.git('update-ref', 'refs/remotes/origin/master', 'HEAD')
+        self.git('reset', '-q', '--hard', 'HEAD^')
+        self.assertEqual(gitcmds.status_state()['upstream_changed'], ['A'])
+
+    def test_status_state_without_untracked(self):
+        self._make_changes()
+        state = gitcmds.status_state(display_untracked=False)
+        self.assertEqual(state['untracked'], [])
+
+    def test_parse_status_porcelain_v2(self):
+        """Test parsing renames, unmerged entries and branch headers."""
+        zeros = '0' * 40
+        out = '\0'.join([
+            '# branch.oid ' + zeros,
+            '# branch.head master',
+            '# branch.upstream origin/master',
+            '# branch.ab +1 -2',
+            '2 R. N... 100644 100644 100644 %s %s R100 new name' % (zeros,
+                                                                   zeros),
+            'old name',
+            '1 .D N... 100644 100644 000000 %s %s gone' % (zeros, zeros),
+            '1 .M SC.. 160000 160000 160000 %s %s sub' % (zeros, zeros),
+            'u UU N... 100644 100644 100644 100644 %s %s %s conflict' % (
+                zeros, zeros, zeros),
+            '? new file',
+            '',
+        ])
+        state = gitcmds.parse_status_porcelain_v2(out)
+        self.assertEqual(state['staged'], ['new name', 'old name'])
+        self.assertEqual(state['staged_deleted'], set(['old name']))
+        self.assertEqual(state['modified'], ['gone', 'sub'])
+        self.assertEqual(state['unstaged_deleted'], set(['gone']))
+        self.assertEqual(state['submodules'], set(['sub']))
+        self.assertEqual(state['unmerged'], ['conflict'])
+        self.assertEqual(state['untracked'], ['new file'])
+        self.assertEqual(state['branch'], {'oid': zeros,
+                                           'head': 'master',
+                                           'upstream': 'origin/master',
+                                           'ahead': 1,
+                                           'behind': 2})
+
+    def test_diff_helper_cache(self):
+        """Test that worktree diffs are cached until the file changes."""
+        cache = diffcache.current()
+        self.write_file('A', 'one\n')
+        diff = gitcmds.diff_helper(filename='A', cached=False)
+        self.assertTrue('+one' in diff)
+        hits = cache.hits
+        self.assertEqual(gitcmds.diff_helper(filename='A', cached=False),
+                         diff)
+        self.assertEqual(cache.hits, hits + 1)
+
+        self.append_file('A', 'two\n')
+        diff = gitcmds.diff_helper(filename='A', cached=False)
+        self.assertTrue('+two' in diff)
+        self.assertEqual(cache.hits, hits + 1)
+
+        self.git('add', 'A')
+        self.assertEqual(gitcmds.diff_helper(filename='A', cached=False), '')
+        self.assertTrue('+two' in gitcmds.diff_helper(filename='A'))
+
+    def test_diff_helper_submodule(self):
+        """Test that submodule diffs follow the submodule's HEAD."""
+        os.mkdir('sub')
+        os.chdir('sub')
+        self.git('init')
+        self.git('commit', '--allow-empty', '-m', 'one')
+        os.chdir('..')
+        self.git('add', 'sub')
+        self.git('commit', '-m', 'add sub')
+        os.chdir('sub')
+        self.git('commit', '--allow-empty', '-m', 'two')
+        os.chdir('..')
+        diff = gitcmds.diff_helper(filename='sub', cached=False)
+        self.assertTrue('> two' in diff)
+        self.assertFalse('> three' in diff)
+        os.chdir('sub')
+        self.git('commit', '--allow-empty', '-m', 'three')
+        os.chdir('..')
+        diff = gitcmds.diff_helper(filename='sub', cached=False)
+        self.assertTrue('> three' in diff)
+
+    def test_sha1_diff_cache(self):
+        """Test that commit diffs are cached by sha1."""
+        self.write_file('A', 'one\n')
+        self.git('commit', '-m', 'change A', 'A')
+        sha1 = self.git('rev-parse', 'HEAD').decode('utf-8')
+        cache = diffcache.current()
+        diff = gitcmds.sha1_diff(gitcmds.git, sha1)
+        self.assertTrue('+one' in diff)
+        hits = cache.hits
+        self.assertEqual(gitcmds.sha1_diff(gitcmds.git, sha1), diff)
+        self.assertEqual(cache.hits, hits + 1)
+        # Symbolic names are not cached
+        gitcmds.sha1_diff(gitcmds.git, 'HEAD')
+        self.assertEqual(cache.hits, hits + 1)
+
+
+class DiffCacheTestCase(unittest.TestCase):
+    """Tests the cola.diffcache LRU cache."""
+
+    def test_lru_eviction(self):
+        cache = diffcache.DiffCache(max_size=10)
+        cache.put('a', 'aaaa')
+        cache.put('b', ('bb', 'bb'))
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.put('c', 'cccc')
+        # 'b' was the least recently used entry
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'cccc')
+        self.assertEqual(cache.stats(),
+                         {'hits': 2, 'misses': 1, 'entries': 2, 'size': 8})
+
+    def test_many_hits(self):
+        cache = diffcache.DiffCache(max_size=8)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        for idx in range(500):
+            cache.get('b')
+            cache.get('a')
+        self.assertTrue(len(cache._lru) < 100)
+        cache.put('c', 'cccc')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'aaaa')
+
+    def test_oversized_values(self):
+        cache = diffcache.DiffCache(max_size=4)
+        cache.put('a', 'aaaaa')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import threading
+import unittest
+
+from cola import core
+from cola import grepstream
+
+from test import helper
+
+
+class GrepStreamTestCase(unittest.TestCase):
+    """Tests the GrepStream class"""
+
+    def test_lines(self):
+        stream = grepstream.GrepStream()
+        self.assertEqual(stream.feed(b'a.txt:1:one\na.t'), ['a.txt:1:one'])
+        self.assertEqual(stream.feed(b'xt:2:tw'), [])
+        self.assertEqual(stream.finish(), ['a.txt:2:tw'])
+        self.assertFalse(stream.has_more())
+
+    def test_split_characters(self):
+        stream = grepstream.GrepStream()
+        data = 'a:1:snow☃\n'.encode('utf-8')
+        lines = stream.feed(data[:-2]) + stream.feed(data[-2:])
+        self.assertEqual(lines, ['a:1:snow☃'])
+
+    def test_limit(self):
+        stream = grepstream.GrepStream(limit=2)
+        self.assertEqual(stream.feed(b'a\nb\nc\nd\n'), ['a', 'b'])
+        self.assertTrue(stream.is_full())
+        self.assertTrue(stream.has_more())
+        self.assertEqual(stream.show_more(1), ['c'])
+        self.assertEqual(stream.finish(), [])
+        self.assertTrue(stream.has_more())
+        self.assertEqual(stream.show_more(5), ['d'])
+        self.assertFalse(stream.has_more())
+
+    def test_full_until_output_ends(self):
+        stream = grepstream.GrepStream(limit=1)
+        self.assertEqual(stream.feed(b'a\n'), ['a'])
+        # the output may go on
+        self.assertTrue(stream.has_more())
+        self.assertEqual(stream.finish(), [])
+        self.assertFalse(stream.has_more())
+
+    def test_wait_for_room(self):
+        stream = grepstream.GrepStream(limit=1)
+        stream.feed(b'a\nb\n')
+        results = []
+        thread = threading.Thread(
+                target=lambda: results.append(stream.wait_for_room()))
+        thread.start()
+        self.assertEqual(stream.show_more(), ['b'])
+        thread.join(5)
+        self.assertEqual(results, [True])
+
+    def test_close_wakes_reader(self):
+        stream = grepstream.GrepStream(limit=0)
+        results = []
+        thread = threading.Thread(
+                target=lambda: results.append(stream.wait_for_room()))
+        thread.start()
+        stream.close()
+        thread.join(5)
+        self.assertEqual(results, [False])
+
+
+class GrepCommandTestCase(helper.GitRepositoryTestCase):
+    """Tests grep_command() against a repository"""
+
+    def test_grep_command(self):
+        self.assertEqual(grepstream.grep_command('a b'),
+                         ['git', 'grep', '-n', '--basic-regexp', 'a b'])
+        self.assertEqual(grepstream.grep_command('-i "a b"', shell=True,
+                                                 regexp_mode='--fixed-strings'),
+                         ['git', 'grep', '-n', '--fixed-strings', '-i', 'a b'])
+
+    def test_stream_output(self):
+        self.write_file('A', 'needle\nhay\nneedle two\n')
+        self.git('add', 'A')
+        command = grepstream.grep_command('needle')
+        proc = core.start_command(command)
+        out, err = proc.communicate()
+        stream = grepstream.GrepStream(limit=1)
+        lines = stream.feed(out) + stream.finish()
+        self.assertEqual(lines, ['A:1:needle'])
+        self.assertEqual(stream.show_more(), ['A:3:needle two'])
+
+
+class PathspecShardsTestCase(unittest.TestCase):
+    """Tests pathspec_shards() and grep_shards()"""
+
+    def test_trees_and_blobs(self):
+        entries = [('a.txt', 'blob'), ('a', 'tree'), ('b', 'tree'),
+                   ('c.txt', 'blob'), ('d.txt', 'blob'), ('sub', 'commit')]
+        shards = grepstream.pathspec_shards(entries)
+        self.assertEqual(shards[:4],
+                         [[':(literal)a.txt'], [':(literal)a'],
+                          [':(literal)b'],
+                          [':(literal)c.txt', ':(literal)d.txt']])
+        self.assertEqual(shards[4][0], '.')
+        self.assertEqual(len(shards[4]), 7)
+        self.assertEqual(len(grepstream.pathspec_shards(entries,
+                                                        worktree=False)), 4)
+
+    def test_empty_tree(self):
+        self.assertEqual(grepstream.pathspec_shards([]), [])
+        shards = grepstream.grep_shards('x', entries=lambda rev: [])
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(shards[0].argv,
+                         ['git', 'grep', '-n', '--basic-regexp', 'x'])
+
+    def test_revisions(self):
+        entries = lambda rev: [('a', 'tree'), ('b', 'tree')]
+        shards = grepstream.grep_shards('x', revisions=['v1', 'v2'],
+                                        entries=entries)
+        self.assertEqual([shard.label() for shard in shards],
+                         ['v1:a', 'v1:b', 'v2:a', 'v2:b'])
+        self.assertEqual(shards[1].argv,
+                         ['git', 'grep', '-n', '--basic-regexp', 'x', 'v1',
+                          '--', ':(literal)b'])
+        self.assertEqual([shard.index for shard in shards], [0, 1, 2, 3])
+
+    def test_own_pathspecs(self):
+        shards = grepstream.grep_shards('x -- a', shell=True,
+                                        entries=lambda rev: [('a', 'tree')])
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(shards[0].argv[-3:], ['x', '--', 'a'])
+
+    def test_paths(self):
+        shards = grepstream.grep_shards('x', paths=['a', 'b/c'])
+        self.assertEqual([shard.argv[-2:] for shard in shards],
+                         [['--', 'a'], ['--', 'b/c']])
+
+
+class ShardedGrepTestCase(helper.GitRepositoryTestCase):
+    """Tests ShardedGrep against a repository"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        os.makedirs(os.path.join('c', 'z'))
+        os.mkdir('b')
+        for path in ('a.txt', 'b/x.txt', 'c/y.txt', 'c/z/w.txt', 'd.txt'):
+            self.write_file(path, 'needle %s\nhay\n' % path)
+        self.git('add', '.')
+        self.git('commit', '-m', 'needles')
+
+    def grep(self, query, jobs=3, **kwargs):
+        engine = grepstream.ShardedGrep(grepstream.grep_shards(query,
+                                                               **kwargs),
+                                        jobs=jobs)
+        engine.start()
+        stream = grepstream.GrepStream()
+        lines = []
+        for data in engine.chunks():
+            lines.extend(stream.feed(data))
+        lines.extend(stream.finish())
+        engine.join()
+        return engine, lines
+
+    def test_merge_order(self):
+        self.write_file('e.txt', 'needle e.txt\n')
+        self.git('add', 'e.txt')
+        engine, lines = self.grep('needle')
+        proc = core.start_command(['git', 'grep', '-n', 'needle'])
+        out, err = proc.communicate()
+        self.assertEqual(lines, core.decode(out).splitlines())
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(engine.status(), 0)
+        self.assertEqual(len(engine.timings()), len(engine.shards))
+        for label, elapsed, status in engine.timings():
+            self.assertTrue(elapsed >= 0.0)
+
+    def test_small_buffers(self):
+        grepstream.ShardedGrep.buffer_size = 1
+        try:
+            engine, lines = self.grep('needle', jobs=2)
+        finally:
+            del grepstream.ShardedGrep.buffer_size
+        self.assertEqual(len(lines), 5)
+
+    def test_no_matches(self):
+        engine, lines = self.grep('nothing-here')
+        self.assertEqual(lines, [])
+        self.assertEqual(engine.status(), 1)
+
+    def test_errors(self):
+        engine, lines = self.grep('x', revisions=['no-such-rev'])
+        self.assertEqual(lines, [])
+        self.assertNotEqual(engine.status(), 0)
+        self.assertNotEqual(engine.status(), 1)
+        self.assertTrue(engine.errors())
+
+    def test_revisions(self):
+        self.write_file('a.txt', 'hay\n')
+        self.git('commit', '-a', '-m', 'no needle')
+        engine, lines = self.grep('needle', revisions=['HEAD~', 'HEAD'])
+        self.assertEqual(lines[0], 'HEAD~:a.txt:1:needle a.txt')
+        self.assertEqual(len(lines), 9)
+
+    def test_stop(self):
+        engine = grepstream.ShardedGrep(grepstream.grep_shards('needle'),
+                                        jobs=1)
+        engine.stop()
+        engine.start()
+        self.assertEqual(list(engine.chunks()), [])
+        engine.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
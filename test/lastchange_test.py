@@ -0,0 +1,107 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import unittest
+
+from cola import git
+from cola.git import STDOUT
+from cola.models import lastchange
+
+from test import helper
+
+
+class LastChangeTestCase(helper.GitRepositoryTestCase):
+    """Tests bulk "last change" lookups"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.commit({'dir/a': 'a', 'dir/sub/b': 'b', 'C': 'c'}, 'first')
+        self.commit({'dir/a': 'a2'}, 'second')
+        self.commit({'dir/sub/b': 'b2', 'C': 'c2'}, 'third')
+        self.lastchange = lastchange.LastChange(git=git.current())
+
+    def commit(self, files, message):
+        for path, content in files.items():
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.write_file(path, content)
+            self.git('add', path)
+        self.git('commit', '-m', message)
+
+    def expect(self, path):
+        out = git.current().log('-1', '--', path, M=True, no_color=True,
+                                pretty='format:%at%x01%s%x01%an')[STDOUT]
+        timestamp, message, author = out.split(chr(0x01), 2)
+        return (int(timestamp), message, author)
+
+    def test_get(self):
+        for path in ('A', 'C', 'dir', 'dir/a', 'dir/sub', 'dir/sub/b'):
+            self.assertEqual(self.lastchange.get(path)[1:],
+                             self.expect(path)[1:])
+            self.assertEqual(self.lastchange._info[path], self.expect(path))
+        self.assertEqual(self.lastchange.get('dir/a')[1], 'second')
+        self.assertEqual(self.lastchange.get('dir')[1], 'third')
+
+    def test_single_walk_per_directory(self):
+        self.lastchange.get('dir/a')
+        self.assertEqual(self.lastchange._resolved, set(['dir']))
+        # Deeper entries are recorded while walking their parent
+        self.assertEqual(self.lastchange._info['dir/sub/b'][1], 'third')
+        self.lastchange.get('dir/sub')
+        self.assertEqual(self.lastchange._resolved, set(['dir']))
+
+    def test_relative_date(self):
+        """Test that the timestamp is cached rather than the relative date"""
+        self.lastchange.get('C')
+        info = self.lastchange._info['C']
+        timestamp = info[0]
+        self.assertEqual(info, self.expect('C'))
+        # Two days later
+        self.lastchange._info['C'] = (timestamp - 2 * 24 * 60 * 60,) + info[1:]
+        self.assertEqual(self.lastchange.get('C'),
+                         ('2 days ago', 'third', info[2]))
+
+    def test_untracked(self):
+        self.touch('untracked')
+        self.assertEqual(self.lastchange.get('untracked'), None)
+
+    def test_head_changes(self):
+        self.assertEqual(self.lastchange.get('dir/a')[1], 'second')
+        self.commit({'dir/a': 'a3'}, 'fourth')
+        self.assertEqual(self.lastchange.get('dir/a')[1], 'fourth')
+
+    def test_walk_limit(self):
+        limit = lastchange.WALK_LIMIT
+        lastchange.WALK_LIMIT = 1
+        try:
+            for path in ('A', 'C', 'dir', 'dir/a', 'dir/sub/b'):
+                self.assertEqual(self.lastchange.get(path)[1:],
+                                 self.expect(path)[1:])
+        finally:
+            lastchange.WALK_LIMIT = limit
+        self.assertEqual(self.lastchange.get('A')[1], 'intitial commit')
+
+    def test_threads(self):
+        paths = ['A', 'C', 'dir/a', 'dir/sub/b'] * 4
+        results = {}
+
+        def get(path):
+            results[path] = self.lastchange.get(path)
+
+        threads = [threading.Thread(target=get, args=(path,))
+                   for path in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for path in paths:
+            self.assertEqual(results[path][1:], self.expect(path)[1:])
+        self.assertEqual(self.lastchange._pending, {})
+        self.assertEqual(self.lastchange._resolved,
+                         set(['', 'dir', 'dir/sub']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -55,6 +55,83 @@ class MainModelTestCase(helper.GitRepositoryTestCase):
         self.model.update_status()
         self.assertEqual(self.model.untracked, ['C'])
 
+    def test_update_paths_status(self):
+        """Test merging a path-scoped rescan into the file lists."""
+        os.mkdir('dir')
+        self.write_file('A', 'change')
+        self.write_file('dir/C', 'C')
+        self.model.update_status()
+        self.assertEqual(self.model.modified, ['A'])
+        self.assertEqual(self.model.untracked, ['dir/C'])
+
+        self.write_file('B', 'change')
+        self.write_file('dir/D', 'D')
+        os.remove('dir/C')
+        self.model.update_paths_status(set(['B', 'dir']))
+        self.assertEqual(self.model.modified, ['A', 'B'])
+        self.assertEqual(self.model.untracked, ['dir/D'])
+
+        # Paths outside of the scope keep their previous state
+        self.write_file('E', 'E')
+        self.git('add', 'B')
+        self.model.update_paths_status(set(['B']))
+        self.assertEqual(self.model.staged, ['B'])
+        self.assertEqual(self.model.modified, ['A'])
+        self.assertEqual(self.model.untracked, ['dir/D'])
+
+    def test_update_changes_refs(self):
+        """Test that moving the current branch refreshes the file lists."""
+        self.model.update_status()
+        self.write_file('A', 'change')
+        self.git('add', 'A')
+        self.model.update_changes(index=True)
+        self.assertEqual(self.model.staged, ['A'])
+
+        self.git('commit', '-m', 'commit from the terminal')
+        self.git('branch', 'topic')
+        self.model.update_changes(refs=set(['refs/heads/master',
+                                            'refs/heads/topic']))
+        self.assertEqual(self.model.staged, [])
+        self.assertEqual(self.model.local_branches, ['master', 'topic'])
+
+    def test_update_changes_upstream(self):
+        """Test that moving the tracked branch refreshes upstream_changed."""
+        self.git('remote', 'add', 'origin', '.')
+        self.git('fetch', 'origin')
+        self.git('config', 'branch.master.remote', 'origin')
+        self.git('config', 'branch.master.merge', 'refs/heads/master')
+        self.model.update_status()
+        self.assertEqual(self.model.upstream_changed, [])
+
+        self.git('checkout', '-q', '-b', 'topic')
+        self.write_file('B', 'change')
+        self.git('commit', '-q', '-m', 'upstream change', 'B')
+        self.git('checkout', '-q', 'master')
+        self.git('update-ref', 'refs/remotes/origin/master', 'topic')
+        self.model.update_changes(refs=set(['refs/remotes/origin/master']))
+        self.assertEqual(self.model.upstream_changed, ['B'])
+
+        self.write_file('A', 'change')
+        self.model.update_changes(paths=set(['A']))
+        self.assertEqual(self.model.upstream_changed, ['B'])
+        self.assertEqual(self.model.modified, ['A'])
+
+    def test_update_changes_head(self):
+        """Test that switching branches updates the current branch."""
+        self.model.update_status()
+        self.git('checkout', '-q', '-b', 'topic')
+        self.model.update_changes(head=True)
+        self.assertEqual(self.model.currentbranch, 'topic')
+
+    def test_update_changes_merge(self):
+        """Test that MERGE_HEAD is noticed."""
+        self.model.update_status()
+        self.assertFalse(self.model.is_merging)
+        sha1 = self.git('rev-parse', 'HEAD').decode('ascii')
+        self.write_file(os.path.join('.git', 'MERGE_HEAD'), sha1 + '\n')
+        self.model.update_changes(merge=True)
+        self.assertTrue(self.model.is_merging)
+
     def test_remotes(self):
         """Test the 'remote' attribute."""
         self.git('remote', 'add', 'origin', '.')
@@ -0,0 +1,80 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola.models import pathlist
+
+
+class FakeModel(object):
+
+    def __init__(self, **kwargs):
+        for name in pathlist.STATUS_LISTS:
+            setattr(self, name, kwargs.get(name, []))
+
+
+class SortedPathsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = pathlist.SortedPaths([
+            'README', 'a/b/c', 'a/b/d', 'a/e', 'a-b', 'a.txt', 'z/y'])
+
+    def test_children_of_root(self):
+        dirs, files = self.paths.children('')
+        self.assertEqual(dirs, ['a', 'z'])
+        self.assertEqual(files, ['README', 'a-b', 'a.txt'])
+
+    def test_children_of_subdirectory(self):
+        self.assertEqual(self.paths.children('a'), (['a/b'], ['a/e']))
+        self.assertEqual(self.paths.children('a/b'), ([], ['a/b/c', 'a/b/d']))
+        self.assertEqual(self.paths.children('missing'), ([], []))
+
+    def test_add_remove(self):
+        self.assertTrue(self.paths.add('a/b/a'))
+        self.assertFalse(self.paths.add('a/b/a'))
+        self.assertTrue('a/b/a' in self.paths)
+        self.assertEqual(self.paths.children('a/b')[1],
+                         ['a/b/a', 'a/b/c', 'a/b/d'])
+        self.assertTrue(self.paths.remove('z/y'))
+        self.assertFalse(self.paths.remove('z/y'))
+        self.assertFalse(self.paths.is_dir('z'))
+        self.assertTrue(self.paths.is_dir('a/b'))
+        self.assertFalse(self.paths.is_dir('a/b/c'))
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def test_diff_snapshots(self):
+        old = pathlist.status_snapshot(FakeModel(
+            staged=['a', 'b'], modified=['b', 'c'], untracked=['d']))
+        new = pathlist.status_snapshot(FakeModel(
+            staged=['a'], modified=['b', 'c'], untracked=['e']))
+        self.assertEqual(old['b'], ('staged', 'modified'))
+        self.assertEqual(pathlist.diff_snapshots(old, new), ['b', 'd', 'e'])
+        self.assertEqual(pathlist.diff_snapshots(new, new), [])
+
+    def test_is_interesting(self):
+        self.assertTrue(pathlist.is_interesting(('untracked',)))
+        self.assertFalse(pathlist.is_interesting(('upstream_changed',)))
+        self.assertFalse(pathlist.is_interesting(None))
+
+    def test_is_present(self):
+        snapshot = pathlist.status_snapshot(FakeModel(
+            staged=['added', 'deleted'], modified=['removed'],
+            unmerged=['conflict'], untracked=['new'],
+            upstream_changed=['upstream', 'added']))
+        on_disk = set(['added', 'new'])
+
+        def is_present(path):
+            return pathlist.is_present(path, snapshot.get(path),
+                                       exists=on_disk.__contains__)
+
+        self.assertTrue(is_present('added'))
+        self.assertTrue(is_present('new'))
+        self.assertTrue(is_present('removed'))
+        self.assertTrue(is_present('conflict'))
+        self.assertFalse(is_present('deleted'))
+        self.assertFalse(is_present('upstream'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import time
+import unittest
+
+from cola import core
+from cola.models import searchindex
+
+from test import helper
+
+
+class HelpersTestCase(unittest.TestCase):
+    """Tests the searchindex helper functions"""
+
+    def test_bre_to_re(self):
+        regex = searchindex.bre_to_re(r'a\(b\|c\)+d?')
+        self.assertTrue(regex.search('xac+d?'))
+        self.assertFalse(regex.search('abd'))
+        self.assertTrue(searchindex.bre_to_re('^fix').search('x\nfix y'))
+        self.assertTrue(searchindex.bre_to_re('[\\]').search('a\\b'))
+        self.assertTrue(searchindex.bre_to_re('*a').search('x*a'))
+        self.assertTrue(searchindex.bre_to_re('Fix', icase=True)
+                        .search('fix'))
+
+    def test_relative_date(self):
+        now = 1000000000
+        day = 24 * 60 * 60
+        cases = [
+            (now - 30, '30 seconds ago'),
+            (now - 60 * 60, '60 minutes ago'),
+            (now - 3 * 60 * 60, '3 hours ago'),
+            (now - day * 1, '24 hours ago'),
+            (now - day * 2, '2 days ago'),
+            (now - day * 20, '3 weeks ago'),
+            (now - day * 100, '3 months ago'),
+            (now - day * 400, '1 year, 1 month ago'),
+            (now - day * 730, '2 years ago'),
+            (now - day * 3650, '10 years ago'),
+            (now + 10, 'in the future'),
+        ]
+        for timestamp, expect in cases:
+            self.assertEqual(searchindex.relative_date(timestamp, now=now),
+                             expect)
+
+    def test_parse_log(self):
+        out = ('\x1eabc\x1fA <a@x>\x1f10\x1fC <c@x>\x1f20\x1fsubject\n\nbody\n'
+               '\x1f\0\nf1\0d/f2\0\x1edef\x1fA <a@x>\x1f5\x1fC <c@x>\x1f6'
+               '\x1fmerge\n\x1f\0')
+        commits = list(searchindex.parse_log(out))
+        self.assertEqual(commits[0],
+                         ('abc', 'A <a@x>', 10, 'C <c@x>', 20,
+                          'subject\n\nbody\n', ['f1', 'd/f2']))
+        self.assertEqual(commits[1][-1], [])
+        # Entries split across reads are joined before they are parsed
+        stream = io.BytesIO(out.encode('utf-8'))
+        self.assertEqual(list(searchindex.read_log(stream, chunk_size=7)),
+                         commits)
+
+    def test_parse_query(self):
+        filters = searchindex.parse_query(['author:Jane Doe', 'fix', 'bug',
+                                           'path:cola', 'path:test',
+                                           'after:2014-01-02'])
+        self.assertEqual(filters['author'], 'Jane Doe')
+        self.assertEqual(filters['message'], 'fix bug')
+        self.assertEqual(filters['paths'], ['cola', 'test'])
+        self.assertEqual(time.localtime(filters['after'])[:3], (2014, 1, 2))
+        self.assertRaises(ValueError, searchindex.parse_query,
+                          ['before:yesterday'])
+
+
+class CommitIndexTestCase(unittest.TestCase):
+    """Tests CommitIndex searches and serialization"""
+
+    def setUp(self):
+        self.index = index = searchindex.CommitIndex(tips=['c' * 40])
+        index.add('a' * 40, 'Ann <ann@x>', 100, 'Ann <ann@x>', 100,
+                  'Add the parser\n', ['cola/parser.py', 'README'])
+        index.add('b' * 40, 'Bob <bob@x>', 200, 'Ann <ann@x>', 300,
+                  'Fix parser bugs\n\nTokenizer fixes\n', ['cola/parser.py'])
+        index.add('c' * 40, 'Bob <bob@x>', 250, 'Bob <bob@x>', 250,
+                  'Document the tokenizer\n', ['docs/tokenizer.rst'])
+
+    def search(self, **kwargs):
+        return [self.index.shas[i][0] for i in self.index.search(**kwargs)]
+
+    def test_order(self):
+        self.assertEqual(self.search(), ['b', 'c', 'a'])
+        self.assertEqual(self.search(max_count=2), ['b', 'c'])
+
+    def test_message(self):
+        self.assertEqual(self.search(message='parser'), ['b', 'a'])
+        self.assertEqual(self.search(message='okeni'), ['b', 'c'])
+        self.assertEqual(self.search(message='the parser'), ['a'])
+        # case-sensitive, like git log --grep
+        self.assertEqual(self.search(message='tokenizer'), ['c'])
+        self.assertEqual(self.search(message='^Fix.*s$'), ['b'])
+        self.assertEqual(self.search(message='nothing'), [])
+
+    def test_people(self):
+        self.assertEqual(self.search(author='Bob'), ['b', 'c'])
+        self.assertEqual(self.search(author='ann@'), ['a'])
+        self.assertEqual(self.search(committer='Ann'), ['b', 'a'])
+
+    def test_paths(self):
+        self.assertEqual(self.search(paths=['cola']), ['b', 'a'])
+        self.assertEqual(self.search(paths=['cola/']), ['b', 'a'])
+        self.assertEqual(self.search(paths=['README', 'docs']), ['c', 'a'])
+        self.assertEqual(self.search(paths=['*.rst']), ['c'])
+        self.assertEqual(self.search(paths=['col']), [])
+
+    def test_dates(self):
+        self.assertEqual(self.search(after=200), ['b', 'c'])
+        self.assertEqual(self.search(before=250), ['c', 'a'])
+        self.assertEqual(self.search(after=200, before=299), ['c'])
+
+    def test_combined(self):
+        self.assertEqual(self.search(message='parser', author='Bob'), ['b'])
+        self.assertEqual(self.search(message='parser', before=150), ['a'])
+        self.assertEqual(self.search(author='Bob', paths=['docs'],
+                                     after=200), ['c'])
+
+    def test_summary(self):
+        self.assertEqual(self.index.results([0], now=100 + 3 * 60 * 60),
+                         [('a' * 40, 'Ann - Add the parser - 3 hours ago')])
+
+    def test_pack(self):
+        data = self.index.pack()
+        index = searchindex.CommitIndex.unpack(data)
+        self.assertEqual(index.tips, ['c' * 40])
+        self.assertEqual(index.shas, self.index.shas)
+        self.assertEqual(index.messages, self.index.messages)
+        self.assertEqual(list(index.cdates), [100, 300, 250])
+        self.assertEqual(index.search(message='parser', author='Bob'), [1])
+        self.assertEqual(searchindex.CommitIndex.unpack(data[:-3]), None)
+        self.assertEqual(searchindex.CommitIndex.unpack(b'junk'), None)
+
+    def test_remove(self):
+        self.index.remove(['b' * 40, 'x' * 40])
+        self.assertEqual(len(self.index), 2)
+        self.assertFalse('b' * 40 in self.index)
+        self.assertEqual(self.search(), ['c', 'a'])
+        self.assertEqual(self.search(message='parser'), ['a'])
+        self.assertEqual(self.search(after=200), ['c'])
+        self.assertEqual(self.search(committer='Ann', after=50), ['a'])
+        index = searchindex.CommitIndex.unpack(self.index.pack())
+        self.assertEqual(index.removed, set([1]))
+        self.assertEqual(index.search(message='parser'), [0])
+        # Commits that become reachable again are restored
+        self.index.add('b' * 40, 'Bob <bob@x>', 200, 'Ann <ann@x>', 300,
+                       'Fix parser bugs\n', ['cola/parser.py'])
+        self.assertEqual(len(self.index.shas), 3)
+        self.assertEqual(self.search(), ['b', 'c', 'a'])
+
+    def test_dates_outside_32_bits(self):
+        self.index.add('d' * 40, 'Old <old@x>', -86400, 'Old <old@x>', -86400,
+                       'Ancient history\n', ['OLD'])
+        self.index.add('e' * 40, 'New <new@x>', 1 << 33, 'New <new@x>',
+                       1 << 33, 'Far future\n', ['NEW'])
+        self.assertEqual(self.search(), ['e', 'b', 'c', 'a', 'd'])
+        self.assertEqual(self.search(before=0), ['d'])
+        index = searchindex.CommitIndex.unpack(self.index.pack())
+        self.assertEqual(list(index.adates), [100, 200, 250, -86400, 1 << 33])
+
+
+class SearchIndexTestCase(helper.GitRepositoryTestCase):
+    """Tests SearchIndex against a repository"""
+
+    def commit(self, path, message, offset):
+        # Later than the initial commit, which has the current date
+        date = int(time.time()) + 1000 + offset
+        os.environ['GIT_AUTHOR_DATE'] = os.environ['GIT_COMMITTER_DATE'] = (
+                '%d +0000' % date)
+        try:
+            self.write_file(path, message)
+            self.git('add', path)
+            self.git('commit', '-m', message)
+        finally:
+            del os.environ['GIT_AUTHOR_DATE']
+            del os.environ['GIT_COMMITTER_DATE']
+
+    def git_log(self, *args):
+        proc = core.start_command(['git', 'log', '--all', '--format=%H'] +
+                                  list(args))
+        out, err = proc.communicate()
+        return core.decode(out).split()
+
+    def indexed(self, index, **kwargs):
+        return [index.shas[i] for i in index.search(**kwargs)]
+
+    def test_matches_git_log(self):
+        self.commit('A', 'first fix', 0)
+        self.git('checkout', '-b', 'topic')
+        self.commit('B', 'topic change', 100)
+        self.git('checkout', 'master')
+        self.commit('C', 'second fix', 200)
+        index = searchindex.SearchIndex().get()
+        self.assertEqual(self.indexed(index), self.git_log())
+        self.assertEqual(self.indexed(index, message='fix'),
+                         self.git_log('--grep=fix'))
+        self.assertEqual(self.indexed(index, paths=['B']),
+                         self.git_log('--', 'B'))
+        self.assertEqual(self.indexed(index, author='t@t'),
+                         self.git_log('--author=t@t'))
+
+    def test_incremental(self):
+        search = searchindex.SearchIndex()
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'full')
+        count = len(index)
+        self.assertTrue(search.get() is index)
+        self.assertEqual(search.stats['mode'], 'cached')
+
+        self.commit('A', 'more', 0)
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'incremental')
+        self.assertEqual(len(index), count + 1)
+        self.assertEqual(self.indexed(index), self.git_log())
+
+        # A new SearchIndex reads the saved index
+        search = searchindex.SearchIndex()
+        self.assertEqual(len(search.get()), count + 1)
+        self.assertEqual(search.stats['mode'], 'cached')
+
+    def test_rewritten_history(self):
+        self.commit('A', 'doomed', 0)
+        search = searchindex.SearchIndex()
+        search.get()
+        self.git('commit', '--amend', '-m', 'amended')
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'incremental')
+        self.assertEqual(search.stats['removed'], 1)
+        self.assertEqual(self.indexed(index, message='doomed'), [])
+        self.assertEqual(self.indexed(index, message='amended'),
+                         self.git_log('--grep=amended'))
+        self.assertEqual(self.indexed(index), self.git_log())
+
+    def test_deleted_branch(self):
+        self.commit('A', 'main work', 0)
+        self.commit('B', 'more work', 50)
+        self.git('checkout', '-b', 'topic')
+        self.commit('C', 'topic work', 100)
+        self.git('checkout', 'master')
+        search = searchindex.SearchIndex()
+        search.get()
+        topic = self.git_log('-1', 'topic')
+        self.git('branch', '-D', 'topic')
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'incremental')
+        self.assertEqual(self.indexed(index, message='topic'), [])
+        self.assertEqual(self.indexed(index), self.git_log())
+        # Restoring the branch restores its commits
+        self.git('branch', 'topic', topic[0])
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'incremental')
+        self.assertEqual(self.indexed(index, message='topic'), topic)
+        self.assertEqual(self.indexed(index), self.git_log())
+
+    def test_rebuild_after_many_removals(self):
+        self.git('checkout', '-b', 'topic')
+        for idx in range(3):
+            self.commit('T', 'topic %d' % idx, idx)
+        self.git('checkout', 'master')
+        search = searchindex.SearchIndex()
+        search.get()
+        self.git('branch', '-D', 'topic')
+        index = search.get()
+        self.assertEqual(search.stats['mode'], 'full')
+        self.assertEqual(index.removed, set())
+        self.assertEqual(self.indexed(index), self.git_log())
+
+    def test_request(self):
+        search = searchindex.SearchIndex()
+        self.assertEqual(search.request(), None)
+        search.wait()
+        index = search.request()
+        self.assertTrue(index is not None)
+        self.assertEqual(self.indexed(index), self.git_log())
+        # Moved refs are handled in the background
+        self.commit('A', 'more', 0)
+        self.assertEqual(search.request(), None)
+        search.wait()
+        self.assertEqual(self.indexed(search.request()), self.git_log())
+
+
+if __name__ == '__main__':
+    unittest.main()
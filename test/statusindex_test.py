@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from cola import utils
+from cola.models import statusindex
+
+
+class FakeModel(object):
+
+    def __init__(self, **kwargs):
+        self.status_version = 0
+        for name, flag in statusindex.FLAGS:
+            setattr(self, name, kwargs.get(name, []))
+
+
+class StatusIndexTestCase(unittest.TestCase):
+
+    def test_flags(self):
+        model = FakeModel(staged=['a/b/c', 'd'], modified=['a/b/c', 'a/e'],
+                          untracked=['a/f/g'])
+        index = statusindex.StatusIndex(model)
+        self.assertEqual(index.flags('a/b/c'),
+                         statusindex.STAGED | statusindex.MODIFIED)
+        self.assertEqual(index.flags('a'),
+                         statusindex.STAGED | statusindex.MODIFIED |
+                         statusindex.UNTRACKED)
+        self.assertEqual(index.flags('a/f'), statusindex.UNTRACKED)
+        self.assertEqual(index.flags('d'), statusindex.STAGED)
+        self.assertEqual(index.flags('x'), 0)
+
+    def test_interesting(self):
+        model = FakeModel(modified=['a/b/c'], upstream_changed=['a/d', 'e'])
+        index = statusindex.StatusIndex(model)
+        for path in ('a', 'a/b', 'a/b/c'):
+            self.assertTrue(index.flags(path) & statusindex.INTERESTING)
+        for path in ('a/d', 'e', 'x'):
+            self.assertFalse(index.flags(path) & statusindex.INTERESTING)
+
+    def test_matches_add_parents(self):
+        model = FakeModel(staged=['a/b/c', 'a/b/d', 'a/x', 'b'],
+                          upstream_changed=['a/b/e'])
+        index = statusindex.StatusIndex(model)
+        for name, flag in statusindex.FLAGS:
+            expect = utils.add_parents(getattr(model, name))
+            actual = set([p for p in ('a', 'a/b', 'a/b/c', 'a/b/d', 'a/b/e',
+                                      'a/x', 'b', 'c')
+                          if index.flags(p) & flag])
+            self.assertEqual(actual, expect)
+
+    def test_cache_is_versioned(self):
+        model = FakeModel(staged=['a'])
+        cache = statusindex.StatusIndexCache()
+        index = cache.get(model)
+        self.assertTrue(cache.get(model) is index)
+        model.staged = ['b']
+        model.status_version += 1
+        index = cache.get(model)
+        self.assertEqual(index.flags('a'), 0)
+        self.assertEqual(index.flags('b'), statusindex.STAGED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+from __future__ import unicode_literals
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from cola.watchset import WatchError
+from cola.watchset import WatchSet
+
+
+class FakeWatches(object):
+    """Records the watches added and removed by a WatchSet"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.wds = {}
+        self.removed = []
+        self.missing = set()
+        self._next = 0
+
+    def add_watch(self, directory):
+        if directory in self.missing:
+            return None
+        if self.limit is not None and len(self.wds) >= self.limit:
+            raise WatchError('no space left on device')
+        self._next += 1
+        self.wds[self._next] = directory
+        return self._next
+
+    def rm_watch(self, wd):
+        self.removed.append(self.wds.pop(wd))
+
+
+class WatchSetTestCase(unittest.TestCase):
+    """Tests the WatchSet class"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.watches = FakeWatches()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def mkdirs(self, *names):
+        paths = []
+        for name in names:
+            path = os.path.join(self.root, name)
+            os.makedirs(path)
+            paths.append(path)
+        return paths
+
+    def watchset(self, budget, **kwargs):
+        return WatchSet(self.watches.add_watch, self.watches.rm_watch,
+                        budget, **kwargs)
+
+    def test_budget(self):
+        a, b, c = self.mkdirs('a', 'b', 'c')
+        watchset = self.watchset(2)
+        watchset.queue([a, b, c])
+        self.assertEqual(watchset.process(10), 3)
+        self.assertEqual(watchset.watch_count(), 2)
+        self.assertTrue(watchset.is_watched(a))
+        self.assertTrue(watchset.is_watched(b))
+        self.assertTrue(watchset.is_polled(c))
+        self.assertEqual(watchset.pending_count(), 0)
+
+    def test_process_limit(self):
+        a, b, c = self.mkdirs('a', 'b', 'c')
+        watchset = self.watchset(10)
+        watchset.queue([a, b, c])
+        self.assertEqual(watchset.process(2), 2)
+        self.assertEqual(watchset.pending_count(), 1)
+        self.assertEqual(watchset.process(2), 1)
+        self.assertEqual(watchset.watch_count(), 3)
+
+    def test_hot_first(self):
+        a, b = self.mkdirs('a', 'b')
+        watchset = self.watchset(1)
+        watchset.queue([a])
+        watchset.queue([b], hot=True)
+        watchset.process(1)
+        self.assertTrue(watchset.is_watched(b))
+        self.assertFalse(watchset.is_watched(a))
+
+    def test_hot_evicts_least_recently_active(self):
+        a, b, c = self.mkdirs('a', 'b', 'c')
+        watchset = self.watchset(2)
+        watchset.queue([a, b])
+        watchset.process(10)
+        watchset.touch(a)
+        watchset.queue([c], hot=True)
+        watchset.process(10)
+        self.assertEqual(self.watches.removed, [b])
+        self.assertTrue(watchset.is_watched(a))
+        self.assertTrue(watchset.is_watched(c))
+        self.assertTrue(watchset.is_polled(b))
+
+    def test_many_touches(self):
+        a, b, c = self.mkdirs('a', 'b', 'c')
+        watchset = self.watchset(2)
+        watchset.queue([a, b])
+        watchset.process(10)
+        for idx in range(500):
+            watchset.touch(b)
+            watchset.touch(a)
+        self.assertTrue(len(watchset._lru) < 100)
+        watchset.queue([c], hot=True)
+        watchset.process(10)
+        self.assertEqual(self.watches.removed, [b])
+
+    def test_cold_does_not_evict(self):
+        a, b = self.mkdirs('a', 'b')
+        watchset = self.watchset(1)
+        watchset.queue([a], hot=True)
+        watchset.process(10)
+        watchset.queue([b])
+        watchset.process(10)
+        self.assertEqual(self.watches.removed, [])
+        self.assertTrue(watchset.is_watched(a))
+        self.assertTrue(watchset.is_polled(b))
+
+    def test_watch_failure_shrinks_budget(self):
+        a, b, c = self.mkdirs('a', 'b', 'c')
+        self.watches.limit = 1
+        watchset = self.watchset(10)
+        watchset.queue([a, b, c])
+        watchset.process(10)
+        self.assertEqual(watchset.budget, 1)
+        self.assertTrue(watchset.is_watched(a))
+        self.assertTrue(watchset.is_polled(b))
+        self.assertTrue(watchset.is_polled(c))
+
+    def test_enospc_shrinks_budget(self):
+        a, b = self.mkdirs('a', 'b')
+
+        def add_watch(directory):
+            if directory == b:
+                raise OSError(errno.ENOSPC, 'no space left on device')
+            return 1
+
+        watchset = WatchSet(add_watch, self.watches.rm_watch, 10)
+        watchset.queue([a, b])
+        watchset.process(10)
+        self.assertEqual(watchset.budget, 1)
+        self.assertTrue(watchset.is_polled(b))
+
+    def test_missing_directory_keeps_budget(self):
+        a, b = self.mkdirs('a', 'b')
+        gone = os.path.join(self.root, 'gone')
+        self.watches.missing.add(gone)
+        watchset = self.watchset(10)
+        watchset.queue([a, gone, b], hot=True)
+        watchset.process(10)
+        self.assertEqual(watchset.budget, 10)
+        self.assertFalse(watchset.is_watched(gone))
+        self.assertFalse(watchset.is_polled(gone))
+        self.assertTrue(watchset.is_watched(b))
+
+    def test_removed_directory_keeps_budget(self):
+        gone = os.path.join(self.root, 'gone')
+
+        def add_watch(directory):
+            raise OSError(errno.ENOENT, 'no such file or directory')
+
+        watchset = WatchSet(add_watch, self.watches.rm_watch, 10)
+        watchset.queue([gone], hot=True)
+        watchset.process(10)
+        self.assertEqual(watchset.budget, 10)
+        self.assertFalse(watchset.is_polled(gone))
+
+    def test_ignored_created_directories_are_cold(self):
+        a, build = self.mkdirs('a', 'build')
+
+        def is_ignored(directories):
+            return [d for d in directories if d == build]
+
+        watchset = self.watchset(1, is_ignored=is_ignored)
+        watchset.queue([a])
+        watchset.process(10)
+        watchset.created([build])
+        self.assertEqual(watchset.pending_count(), 1)
+        watchset.process(10)
+        self.assertTrue(watchset.is_watched(a))
+        self.assertTrue(watchset.is_polled(build))
+        self.assertEqual(self.watches.removed, [])
+
+    def test_created_directories_are_hot(self):
+        a, src = self.mkdirs('a', 'src')
+        watchset = self.watchset(1, is_ignored=lambda directories: [])
+        watchset.queue([a])
+        watchset.process(10)
+        watchset.created([src])
+        watchset.process(10)
+        self.assertTrue(watchset.is_watched(src))
+        self.assertEqual(self.watches.removed, [a])
+
+    def test_poll(self):
+        a, b = self.mkdirs('a', 'b')
+        watchset = self.watchset(1)
+        watchset.queue([a, b])
+        watchset.process(10)
+        self.assertTrue(watchset.is_polled(b))
+        self.assertEqual(watchset.poll(10), [])
+        with open(os.path.join(b, 'new.txt'), 'w') as fh:
+            fh.write('new\n')
+        self.assertEqual(watchset.poll(10), [b])
+        self.assertEqual(watchset.poll(10), [])
+
+    def test_poll_round_robin(self):
+        dirs = self.mkdirs('a', 'b', 'c', 'd')
+        watchset = self.watchset(1)
+        watchset.queue(dirs)
+        watchset.process(10)
+        for name in ('b', 'c', 'd'):
+            with open(os.path.join(self.root, name, 'new.txt'), 'w') as fh:
+                fh.write('new\n')
+        self.assertEqual(watchset.poll(2), dirs[1:3])
+        self.assertEqual(watchset.poll(2), dirs[3:])
+
+
+if __name__ == '__main__':
+    unittest.main()